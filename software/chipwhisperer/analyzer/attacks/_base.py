@@ -23,6 +23,11 @@
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 #=================================================
 import logging
+import os
+import sys
+import time
+
+import numpy as np
 
 from chipwhisperer.common.ui.ProgressBar import ProgressBar
 from chipwhisperer.common.utils.pluginmanager import Plugin
@@ -56,6 +61,8 @@ class AttackBaseClass(PassiveTraceObserver, AnalysisSource, Parameterized, AutoS
         self._tracePerAttack = 1
         self._reportingInterval = 10
         self._pointRange = (0,0)
+        self._resume = False
+        self._checkpointInterval = 0
         self._targetSubkeys = []
         self._project = None
         self.useAbs = True
@@ -77,6 +84,9 @@ class AttackBaseClass(PassiveTraceObserver, AnalysisSource, Parameterized, AutoS
             {'name':'Traces per Attack', 'key':'atraces', 'type':'int', 'limits':(1, 1E6), 'get':self.getTracesPerAttack, 'set':self.setTracesPerAttack, 'action':self.updateScript},
             {'name':'Iterations', 'key':'runs', 'type':'int', 'limits':(1, 1E6), 'get':self.getIterations, 'set':self.setIterations, 'action':self.updateScript},
             {'name':'Reporting Interval', 'key':'reportinterval', 'type':'int', 'get':self.getReportingInterval, 'set':self.setReportingInterval, 'action':self.updateScript},
+            {'name':'Checkpoint Interval (s)', 'key':'checkpointinterval', 'type':'int', 'limits':(0, 1E6), 'get':self.getCheckpointInterval, 'set':self.setCheckpointInterval, 'action':self.updateScript,
+             'tip':'Save the attack state to the project every N seconds (0 to disable)'},
+            {'name':'Resume from Checkpoint', 'key':'resume', 'type':'bool', 'get':self.getResume, 'set':self.setResume, 'action':self.updateScript},
         ])
         self.getParams().init()
 
@@ -127,21 +137,104 @@ class AttackBaseClass(PassiveTraceObserver, AnalysisSource, Parameterized, AutoS
             self.attack.getStatistics().clear()
             self.attack.setReportingInterval(self.getReportingInterval())
             self.attack.setTargetSubkeys(self.getTargetSubkeys())
-            self.attack.setStatsReadyCallback(self.sigAnalysisUpdated.emit)
             self.sigAnalysisStarted.emit()
 
+            checkpoint = None
+            if self.getResume():
+                if self.attack.getCheckpoint() is None:
+                    logging.warning('Attack algorithm %s can not resume from a checkpoint, starting from the first trace' % self.attack.getName())
+                else:
+                    checkpoint = self.loadCheckpoint()
+
+            lastCheckpoint = [time.time()]
+            def statsReady():
+                self.sigAnalysisUpdated.emit()
+                if 0 < self.getCheckpointInterval() <= time.time() - lastCheckpoint[0]:
+                    self.saveCheckpoint(itNum, startingTrace)
+                    lastCheckpoint[0] = time.time()
+            self.attack.setStatsReadyCallback(statsReady)
+
             for itNum in range(self.getIterations()):
                 startingTrace = self.getTracesPerAttack() * itNum + self.getTraceStart()
                 endingTrace = startingTrace + self.getTracesPerAttack() - 1
+                firstTrace = startingTrace
+
+                if checkpoint is not None:
+                    if int(checkpoint["iteration"]) > itNum:
+                        continue
+                    if int(checkpoint["iteration"]) == itNum and int(checkpoint["tracestart"]) == startingTrace:
+                        self.attack.setCheckpoint(checkpoint)
+                        firstTrace = int(checkpoint["nexttrace"])
+                        logging.info('Resuming attack from checkpoint at trace %d' % firstTrace)
+                    checkpoint = None
 
                 # TODO:support start/end point different per byte
-                self.attack.addTraces(self.getTraceSource(), (startingTrace, endingTrace), progressBar, pointRange=self.getPointRange(None))
+                if firstTrace <= endingTrace:
+                    self.getTraceSource().setReadRange(firstTrace, endingTrace + 1)
+                    self.attack.addTraces(self.getTraceSource(), (firstTrace, endingTrace), progressBar, pointRange=self.getPointRange(None))
 
                 if progressBar and progressBar.wasAborted():
+                    self.saveCheckpoint(itNum, startingTrace)
                     return
 
+                self.saveCheckpoint(itNum, startingTrace)
+
         self.sigAnalysisDone.emit()
 
+    def checkpointFilepath(self):
+        """Return the absolute path of the checkpoint file in the project, or None if there is no project"""
+        if self._project is None:
+            return None
+        return self._project.getDataFilepath('%s-checkpoint.npz' % self.__class__.__name__.lower(), 'analysis')["abs"]
+
+    def checkpointId(self):
+        """Identify the attack setup a checkpoint belongs to: algorithm, leakage model, subkeys and point range"""
+        return {"algorithm":np.array(sys.modules[self.attack.__class__.__module__].__name__ + '.' + self.attack.__class__.__name__),
+                "model":np.array(self.attackModel.getHwModelString()),
+                "targetsubkeys":np.array(self.getTargetSubkeys()),
+                "pointrange":np.array(self.getPointRange(None))}
+
+    def saveCheckpoint(self, iteration, startingTrace):
+        """Save the state of the running attack to the project analysis directory"""
+        fname = self.checkpointFilepath()
+        if fname is None or self.getCheckpointInterval() == 0:
+            return
+
+        state = self.attack.getCheckpoint()
+        if not state:
+            return
+        state.update(self.checkpointId())
+
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+
+        # Write to a temporary file first, so a crash while saving never corrupts the previous checkpoint
+        tmpname = fname + '.tmp'
+        with open(tmpname, 'wb') as f:
+            np.savez_compressed(f, iteration=iteration, tracestart=startingTrace, **state)
+        if os.path.exists(fname):
+            os.remove(fname)
+        os.rename(tmpname, fname)
+        logging.debug('Saved attack checkpoint to: %s' % fname)
+
+    def loadCheckpoint(self):
+        """Return the checkpoint saved in the project, or None if there is none matching the current attack setup"""
+        fname = self.checkpointFilepath()
+        if fname is None or not os.path.isfile(fname):
+            logging.info('No attack checkpoint found, starting from the first trace')
+            return None
+
+        with np.load(fname) as data:
+            checkpoint = dict(data)
+        if "nexttrace" not in checkpoint:
+            logging.warning('Attack checkpoint %s is from an older version, starting from the first trace' % fname)
+            return None
+        for k, v in self.checkpointId().iteritems():
+            if not np.array_equal(checkpoint[k], v):
+                logging.warning('Attack checkpoint %s was made with a different %s, starting from the first trace' % (fname, k))
+                return None
+        return checkpoint
+
     def setProject(self, project):
         self._project = project
 
@@ -176,6 +269,20 @@ class AttackBaseClass(PassiveTraceObserver, AnalysisSource, Parameterized, AutoS
     def setReportingInterval(self, ri):
         self._reportingInterval = ri
 
+    def getResume(self):
+        return self._resume
+
+    @setupSetParam("Resume from Checkpoint")
+    def setResume(self, resume):
+        self._resume = resume
+
+    def getCheckpointInterval(self):
+        return self._checkpointInterval
+
+    @setupSetParam("Checkpoint Interval (s)")
+    def setCheckpointInterval(self, interval):
+        self._checkpointInterval = interval
+
     def getPointRange(self, bnum=None):
         return self._pointRange
 
@@ -265,6 +372,8 @@ class AttackBaseClass(PassiveTraceObserver, AnalysisSource, Parameterized, AutoS
         self.addFunction("init", "setIterations", "%d" % runs.getValue())
         self.addFunction("init", "setReportingInterval", "%d" % ri.getValue())
         self.addFunction("init", "setPointRange", "(%d,%d)" % (pointrng[0], pointrng[1]))
+        self.addFunction("init", "setCheckpointInterval", "%d" % self.findParam('checkpointinterval').getValue())
+        self.addFunction("init", "setResume", "%s" % self.findParam('resume').getValue())
 
     def updateTraceLimits(self):
         if self._traceSource is None:
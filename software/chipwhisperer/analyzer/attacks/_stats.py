@@ -28,6 +28,38 @@
 import numpy as np
 
 
+class HistoryStore(object):
+    """
+    Append-only table of fixed-size records (a numpy structured dtype). Records live in a single
+    preallocated array which doubles in size when it fills up, so appending does not copy per record.
+    """
+
+    def __init__(self, dtype, capacity=64):
+        self._data = np.zeros(capacity, dtype=dtype)
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def append(self, *record):
+        if self._len == len(self._data):
+            grown = np.zeros(2 * len(self._data), dtype=self._data.dtype)
+            grown[:self._len] = self._data
+            self._data = grown
+        self._data[self._len] = record
+        self._len += 1
+
+    def last(self):
+        """Return the most recent record, or None if empty"""
+        if self._len == 0:
+            return None
+        return self._data[self._len - 1]
+
+    def data(self):
+        """Return a view of all records appended so far"""
+        return self._data[:self._len]
+
+
 class DataTypeDiffs(object):
     """
     Data type used for attacks generating peaks indicating the 'best' success. Examples include
@@ -53,8 +85,11 @@ class DataTypeDiffs(object):
         self.maxValid = [False]*self.numSubkeys
         self.pge = [255]*self.numSubkeys
         self.diffs_tnum = [None]*self.numSubkeys
-        self.pge_total = []
-        self.maxes_list = [list() for i in range(0, self.numSubkeys)]
+
+        #History of PGE for each call (trace -1 if unknown), and the maximum of every hypothesis (indexed by
+        #hypothesis, not rank) each time a subkey got new data
+        self.pge_total = HistoryStore([('trace', 'i8'), ('subkey', 'i2'), ('pge', 'i4')])
+        self.maxes_list = [HistoryStore([('trace', 'i8'), ('value', 'f4', (self.numPerms,))]) for i in range(0, self.numSubkeys)]
 
         #TODO: Ensure this gets called by attack algorithms when rerunning
 
@@ -78,62 +113,348 @@ class DataTypeDiffs(object):
                 self.diffs[bnum] = data
                 self.diffs_tnum[bnum] = tnum
 
+    @staticmethod
+    def _maxPerHypothesis(diffs, useAbsolute):
+        """Return (value, point) of the maximum of every row of diffs (... x guesses x points), NaN if all NaN"""
+        if useAbsolute:
+            diffs = np.fabs(diffs)
+        nans = np.isnan(diffs)
+        filled = np.where(nans, -np.inf, diffs)
+        points = np.argmax(filled, axis=-1)
+        values = np.take_along_axis(filled, points[..., None], axis=-1)[..., 0]
+        values[nans.all(axis=-1)] = np.nan
+        return values, points
+
     def findMaximums(self, bytelist=None, useAbsolute=True, useSingle=False):
         if bytelist is None:
             bytelist = range(0, self.numSubkeys)
 
-        # print useAbsolute
-
+        #Group subkeys needing an update by the shape of their diffs, so each group is done in one call
+        groups = {}
         for i in bytelist:
             if self.diffs[i] is None:
                 self.maxValid[i] = False
-                continue
+            elif self.maxValid[i] == False:
+                d = np.asarray(self.diffs[i], dtype=np.float64)
+                if d.ndim == 1:
+                    #One value per hypothesis (e.g. template log-likelihoods)
+                    d = d[:, None]
+                groups.setdefault(d.shape, []).append((i, d))
 
-            if self.maxValid[i] == False:
-                for hyp in range(0, self.numPerms):
-                    if useAbsolute:
-                        v = np.nanmax(np.fabs(self.diffs[i][hyp]))
-                    else:
-                        v = np.nanmax(self.diffs[i][hyp])
+        for group in groups.itervalues():
+            bnums = [i for i, _ in group]
+            diffs = np.array([d for _, d in group])
+            values, points = self._maxPerHypothesis(diffs, useAbsolute)
 
-                    mvalue = v
+            if useSingle:
+                #All table values are taken from same point MAX is taken from
+                best = np.argmax(np.where(np.isnan(values), -np.inf, values), axis=1)
+                points = np.repeat(points[np.arange(len(bnums)), best][:, None], self.numPerms, axis=1)
+                values = np.take_along_axis(diffs, points[..., None], axis=2)[..., 0]
+                if useAbsolute:
+                    values = np.fabs(values)
 
-                    #Get maximum value for this hypothesis
-                    try:
-                        mindex = np.amin(np.where(v == mvalue))
-                    except ValueError:
-                        mindex = self.numPerms-1
-                    self.maxes[i][hyp]['hyp'] = hyp
-                    self.maxes[i][hyp]['point'] = mindex
-                    self.maxes[i][hyp]['value'] = mvalue
-
-                #TODO: why does this fail?
-                #self.maxes[i][np.isnan(self.maxes[i]['value'])]['value'] = 0
-                #TODO: workaround for PGE, as NaN's get ranked first
-                numnans = np.isnan(self.maxes[i]['value']).sum()
-
-                if useSingle:
-                    #All table values are taken from same point MAX is taken from
-                    where = self.maxes[i][0]['point']
-                    for j in range(0, self.numPerms):
-                        self.maxes[i][j]['point'] = where
-                        self.maxes[i][j]['value'] = self.diffs[i][self.maxes[i][j]['hyp']][where]
-
-                self.maxes[i][::-1].sort(order='value') # sorts nunpy array in place and in reverse order
+            #Rank by decreasing value, NaN's are sorted last and ties keep hypothesis order
+            order = np.argsort(-values, axis=1, kind='mergesort')
+            ranks = np.empty_like(order)
+            np.put_along_axis(ranks, order, np.arange(self.numPerms)[None, :], axis=1)
+
+            for k, i in enumerate(bnums):
+                self.maxes[i]['hyp'] = order[k]
+                self.maxes[i]['point'] = points[k, order[k]]
+                self.maxes[i]['value'] = values[k, order[k]]
                 self.maxValid[i] = True
 
                 if self.knownkey is not None:
                     try:
-                        self.pge[i] = np.where(self.maxes[i]['hyp'] == self.knownkey[i])[0][0] - numnans
-                        if self.pge[i] < 0:
+                        key = int(self.knownkey[i])
+                        if np.isnan(values[k, key]):
                             self.pge[i] = self.numPerms/2
-                    except IndexError:
+                        else:
+                            self.pge[i] = ranks[k, key]
+                    except (IndexError, TypeError):
                         self.pge[i] = self.numPerms-1
 
+                tnum = -1 if self.diffs_tnum[i] is None else self.diffs_tnum[i]
+                last = self.maxes_list[i].last()
+                if last is None or last['trace'] != tnum:
+                    self.maxes_list[i].append(tnum, values[k])
+
+        for i in bytelist:
+            if self.diffs[i] is None:
+                continue
             tnum = self.diffs_tnum[i]
-            self.pge_total.append({'trace':tnum, 'subkey':i, 'pge':self.pge[i]})
-            
-            if len(self.maxes_list[i]) == 0 or self.maxes_list[i][-1]['trace'] != tnum:
-                self.maxes_list[i].append({'trace':tnum, 'maxes':np.array(self.maxes[i])})
+            self.pge_total.append(-1 if tnum is None else tnum, i, self.pge[i])
 
         return self.maxes
+
+
+class CorrelationAccumulator(object):
+    """
+    Streaming correlation between the hypotheticals of every guess and every trace point.
+
+    Instead of raw sums (where n*sum(t^2) - sum(t)^2 cancels catastrophically on long runs), this keeps
+    the means and centred second (co-)moments, and combines blocks of traces with the pairwise update
+    of Chan et al. Two accumulators built on different trace sets can be combined with merge().
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.n = 0
+        self.meanh = None   # guesses
+        self.meant = None   # points
+        self.m2h = None     # guesses
+        self.m2t = None     # points
+        self.cht = None     # guesses x points
+
+    def update(self, hyp, traces):
+        """Add a block of traces (traces x points) with their hypotheticals (guesses x traces)"""
+        hyp = np.asarray(hyp, dtype=np.float64)
+        traces = np.asarray(traces, dtype=np.float64)
+
+        n = traces.shape[0]
+        if n == 0:
+            return
+
+        meanh = np.mean(hyp, axis=1)
+        meant = np.mean(traces, axis=0)
+        hc = hyp - meanh[:, None]
+        tc = traces - meant
+        self._combine(n, meanh, meant, np.sum(np.square(hc), axis=1), np.sum(np.square(tc), axis=0), np.dot(hc, tc))
+
+    def updateFromSums(self, n, sumh, sumhq, sumt, sumtq, sumht):
+        """Add a block of traces given as raw sums over that block only (e.g. from the C accelerated code)"""
+        if n == 0:
+            return
+
+        sumh = np.asarray(sumh, dtype=np.float64)
+        sumt = np.asarray(sumt, dtype=np.float64)
+        self._combine(n, sumh / n, sumt / n, sumhq - np.square(sumh) / n, sumtq - np.square(sumt) / n,
+                      sumht - np.outer(sumh, sumt) / n)
+
+    def merge(self, other):
+        """Add all traces seen by another accumulator to this one"""
+        if other.n == 0:
+            return
+        self._combine(other.n, other.meanh, other.meant, other.m2h, other.m2t, other.cht)
+
+    def _combine(self, n, meanh, meant, m2h, m2t, cht):
+        if self.n == 0:
+            self.n = n
+            self.meanh = np.array(meanh, dtype=np.float64)
+            self.meant = np.array(meant, dtype=np.float64)
+            self.m2h = np.array(m2h, dtype=np.float64)
+            self.m2t = np.array(m2t, dtype=np.float64)
+            self.cht = np.array(cht, dtype=np.float64)
+            return
+
+        total = self.n + n
+        deltah = meanh - self.meanh
+        deltat = meant - self.meant
+        weight = float(self.n) * n / total
+
+        self.m2h += m2h + np.square(deltah) * weight
+        self.m2t += m2t + np.square(deltat) * weight
+        self.cht += cht + np.outer(deltah, deltat) * weight
+        self.meanh += deltah * (float(n) / total)
+        self.meant += deltat * (float(n) / total)
+        self.n = total
+
+    @staticmethod
+    def stack(accumulators):
+        """Pack a list of accumulators which have all seen traces into a dict of arrays, e.g. for np.savez()"""
+        return {"n":np.array([acc.n for acc in accumulators]),
+                "meanh":np.array([acc.meanh for acc in accumulators]),
+                "meant":np.array([acc.meant for acc in accumulators]),
+                "m2h":np.array([acc.m2h for acc in accumulators]),
+                "m2t":np.array([acc.m2t for acc in accumulators]),
+                "cht":np.array([acc.cht for acc in accumulators])}
+
+    @staticmethod
+    def unstack(data):
+        """Inverse of stack(), returns a list of accumulators"""
+        accumulators = []
+        for i in range(len(data["n"])):
+            acc = CorrelationAccumulator()
+            acc._combine(int(data["n"][i]), data["meanh"][i], data["meant"][i], data["m2h"][i], data["m2t"][i], data["cht"][i])
+            accumulators.append(acc)
+        return accumulators
+
+    def correlation(self):
+        """Return the (guesses x points) correlation coefficients of all traces added so far"""
+        return self.cht / np.sqrt(np.outer(self.m2h, self.m2t))
+
+
+class TemplateAccumulator(object):
+    """
+    Streaming mean and scatter matrix of the points of interest of every partition of one subkey.
+
+    Memory does not depend on the number of traces: blocks are folded in with the same pairwise update as
+    CorrelationAccumulator, and accumulators built on different trace ranges can be combined with merge().
+    """
+
+    def __init__(self, numPartitions, numPoints):
+        self.n = np.zeros(numPartitions, dtype=np.int64)
+        self.mean = np.zeros((numPartitions, numPoints))
+        self.scatter = np.zeros((numPartitions, numPoints, numPoints))
+
+    def update(self, points, partitions):
+        """Add a block of traces given as (traces x POI) with the partition number of each trace"""
+        points = np.asarray(points, dtype=np.float64)
+        partitions = np.asarray(partitions, dtype=np.intp)
+        if len(points) == 0:
+            return
+
+        order = np.argsort(partitions, kind='mergesort')
+        points = points[order]
+        parts, starts, counts = np.unique(partitions[order], return_index=True, return_counts=True)
+
+        mean = np.add.reduceat(points, starts, axis=0) / counts[:, None]
+        centred = points - np.repeat(mean, counts, axis=0)
+        scatter = np.add.reduceat(centred[:, :, None] * centred[:, None, :], starts, axis=0)
+        self._combine(parts, counts, mean, scatter)
+
+    def merge(self, other):
+        """Add all traces seen by another accumulator to this one"""
+        parts = np.nonzero(other.n)[0]
+        self._combine(parts, other.n[parts], other.mean[parts], other.scatter[parts])
+
+    def _combine(self, parts, n, mean, scatter):
+        total = self.n[parts] + n
+        delta = mean - self.mean[parts]
+        weight = self.n[parts].astype(np.float64) * n / total
+
+        self.scatter[parts] += scatter + delta[:, :, None] * delta[:, None, :] * weight[:, None, None]
+        self.mean[parts] += delta * (n.astype(np.float64) / total)[:, None]
+        self.n[parts] = total
+
+    def means(self):
+        """Return the (partitions x POI) means, NaN for partitions without traces"""
+        with np.errstate(invalid='ignore'):
+            return np.where(self.n[:, None] > 0, self.mean, np.nan)
+
+    def covariances(self, pooled=False):
+        """
+        Return the (partitions x POI x POI) unbiased covariance matrices. With pooled=True all partitions get
+        the same matrix, estimated from the scatter of every partition around its own mean.
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if pooled:
+                dof = np.sum(self.n) - np.count_nonzero(self.n)
+                cov = np.sum(self.scatter, axis=0) / dof
+                return np.repeat(cov[None], len(self.n), axis=0)
+            return self.scatter / (self.n - 1)[:, None, None]
+
+    @staticmethod
+    def stack(accumulators):
+        """Pack a list of accumulators into a dict of arrays, e.g. for np.savez()"""
+        return {"n":np.array([acc.n for acc in accumulators]),
+                "mean":np.array([acc.mean for acc in accumulators]),
+                "scatter":np.array([acc.scatter for acc in accumulators])}
+
+    @staticmethod
+    def unstack(data):
+        """Inverse of stack(), returns a list of accumulators"""
+        accumulators = []
+        for i in range(len(data["n"])):
+            acc = TemplateAccumulator(*data["mean"][i].shape)
+            acc.n[:] = data["n"][i]
+            acc.mean[:] = data["mean"][i]
+            acc.scatter[:] = data["scatter"][i]
+            accumulators.append(acc)
+        return accumulators
+
+
+class ClassAccumulator(object):
+    """
+    Streaming mean of every trace point for each value of a per-trace class (e.g. the plaintext byte a
+    subkey is combined with), plus the overall mean and centred sum of squares.
+
+    When the hypothetical leakage of every guess only depends on that class, the statistics of all guesses
+    follow from these by weighting the class means with a (guesses x classes) table. Adding traces is then
+    a single scatter-add, and the cost per guess no longer depends on the number of traces.
+    """
+
+    def __init__(self, numClasses, numPoints):
+        self.n = np.zeros(numClasses, dtype=np.int64)
+        self.mean = np.zeros((numClasses, numPoints))
+        self.meant = np.zeros(numPoints)
+        self.m2t = np.zeros(numPoints)
+
+    def update(self, classes, traces):
+        """Add a block of traces (traces x points) with the class of each trace"""
+        traces = np.asarray(traces, dtype=np.float64)
+        classes = np.asarray(classes)
+        if len(traces) == 0:
+            return
+
+        # Sort the block by class and sum each run
+        order = np.argsort(classes, kind='mergesort')
+        found, starts, counts = np.unique(classes[order], return_index=True, return_counts=True)
+        n = np.zeros(len(self.n), dtype=np.int64)
+        mean = np.zeros_like(self.mean)
+        n[found] = counts
+        mean[found] = np.add.reduceat(traces[order], starts, axis=0) / counts[:, None]
+
+        meant = np.mean(traces, axis=0)
+        self._combine(n, mean, meant, np.sum(np.square(traces - meant), axis=0))
+
+    def merge(self, other):
+        """Add all traces seen by another accumulator to this one"""
+        self._combine(other.n, other.mean, other.meant, other.m2t)
+
+    def _combine(self, n, mean, meant, m2t):
+        na = np.sum(self.n)
+        nb = np.sum(n)
+        if nb == 0:
+            return
+
+        total = na + nb
+        deltat = meant - self.meant
+        self.m2t += m2t + np.square(deltat) * (float(na) * nb / total)
+        self.meant += deltat * (float(nb) / total)
+
+        parts = np.nonzero(n)[0]
+        ptotal = self.n[parts] + n[parts]
+        self.mean[parts] += (mean[parts] - self.mean[parts]) * (n[parts].astype(np.float64) / ptotal)[:, None]
+        self.n[parts] = ptotal
+
+    @staticmethod
+    def stack(accumulators):
+        """Pack a list of accumulators into a dict of arrays, e.g. for np.savez()"""
+        return {"n":np.array([acc.n for acc in accumulators]),
+                "mean":np.array([acc.mean for acc in accumulators]),
+                "meant":np.array([acc.meant for acc in accumulators]),
+                "m2t":np.array([acc.m2t for acc in accumulators])}
+
+    @staticmethod
+    def unstack(data):
+        """Inverse of stack(), returns a list of accumulators"""
+        accumulators = []
+        for i in range(len(data["n"])):
+            acc = ClassAccumulator(*data["mean"][i].shape)
+            acc._combine(data["n"][i], data["mean"][i], data["meant"][i], data["m2t"][i])
+            accumulators.append(acc)
+        return accumulators
+
+    def correlation(self, table):
+        """Return the (guesses x points) correlation coefficients for the hypotheticals of each class in table"""
+        table = np.asarray(table, dtype=np.float64)
+        hc = table - (np.dot(table, self.n) / np.sum(self.n))[:, None]
+        cht = np.dot(hc * self.n, self.mean - self.meant)
+        m2h = np.dot(np.square(hc), self.n)
+        return cht / np.sqrt(np.outer(m2h, self.m2t))
+
+    def differenceOfMeans(self, table):
+        """
+        Return the (guesses x points) difference between the mean trace of the classes with a hypothetical
+        above the middle of its range and those below it. For a HW model this compares HW 5-8 against HW 0-3.
+        """
+        table = np.asarray(table, dtype=np.float64)
+        middle = (np.min(table, axis=1) + np.max(table, axis=1)) / 2.0
+        high = (table > middle[:, None]) * self.n
+        low = (table < middle[:, None]) * self.n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.dot(high, self.mean) / np.sum(high, axis=1)[:, None] - np.dot(low, self.mean) / np.sum(low, axis=1)[:, None]
@@ -25,9 +25,13 @@
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 #=================================================
 
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
 from _stats import DataTypeDiffs
 from chipwhisperer.common.api.autoscript import AutoScript
-from chipwhisperer.common.utils.parameter import Parameterized
+from chipwhisperer.common.utils.parameter import Parameterized, setupSetParam
 
 
 class AlgorithmsBase(Parameterized, AutoScript):
@@ -37,6 +41,9 @@ class AlgorithmsBase(Parameterized, AutoScript):
         self.sr = None
         self.stats = None
         self._project = None
+        self._workers = 1
+        self._pool = None
+        self._nextTrace = None
 
     def setProject(self, proj):
         self._project = proj
@@ -69,5 +76,64 @@ class AlgorithmsBase(Parameterized, AutoScript):
     def setStatsReadyCallback(self, sr):
         self.sr = sr
 
+    def getWorkers(self):
+        return self._workers
+
+    @setupSetParam("Worker Threads")
+    def setWorkers(self, workers):
+        """Set the number of threads used to attack the subkeys of a trace block in parallel"""
+        if workers != self._workers:
+            self.closeWorkers()
+        self._workers = workers
+
+    def mapSubkeys(self, func, jobs):
+        """Return [func(job) for job in jobs], spreading the jobs over the worker threads if more than one is set.
+        The threads are kept for the next call until closeWorkers()."""
+        if self._workers <= 1 or len(jobs) <= 1:
+            return [func(job) for job in jobs]
+
+        if self._pool is None:
+            self._pool = ThreadPool(self._workers)
+        return self._pool.map(func, jobs)
+
+    def closeWorkers(self):
+        """Stop the worker threads started by mapSubkeys(), called once addTraces() is done"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    @staticmethod
+    def loadTraceBlock(traceSource, start, end, raw=False):
+        """Return (traces, textins, textouts, knownkeys) for traces start to end-1, leaving out traces the
+        source could not provide (e.g. a failed resync returns None). With raw=True the traces may be returned as
+        stored (e.g. ADC codes) if they only differ from the physical values by a positive scale and an offset,
+        for attacks whose statistic doesn't change under such a map (e.g. correlation)."""
+        scale = traceSource.getTraceScale() if raw else None
+        if scale is not None and scale[0] > 0:
+            traces = traceSource.getRawTraces(start, end)
+        else:
+            traces = traceSource.getTraces(start, end)
+        textins = traceSource.getTextins(start, end)
+        textouts = traceSource.getTextouts(start, end)
+        knownkeys = traceSource.getKnownKeys(start, end)
+
+        if traces.dtype == object:
+            keep = [i for i, t in enumerate(traces) if t is not None]
+            traces = np.array([traces[i] for i in keep])
+            textins = textins[keep]
+            textouts = textouts[keep]
+            knownkeys = [knownkeys[i] for i in keep]
+
+        return traces, textins, textouts, knownkeys
+
+    def getCheckpoint(self):
+        """
+        Return the attack state as a dict of arrays, including "nexttrace" (the first trace not added yet). Algorithms
+        which can resume return an empty dict while there is nothing to save, and implement setCheckpoint(). None
+        means this algorithm can't resume.
+        """
+        return None
+
     def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None):
         pass
\ No newline at end of file
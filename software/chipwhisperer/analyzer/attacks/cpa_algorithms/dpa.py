@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2014, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.assembla.com/spaces/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+
+import numpy as np
+import math
+
+from ..algorithmsbase import AlgorithmsBase
+from .._stats import ClassAccumulator
+from chipwhisperer.common.utils.parameter import setupSetParam
+from chipwhisperer.common.utils.pluginmanager import Plugin
+
+
+class DPAProgressive(AlgorithmsBase, Plugin):
+    """
+    Progressive DPA (difference of means) or CPA attack for models whose leakage only depends on one byte
+    of each trace, such as the first-round S-Box output. Traces are summed per value of that byte, and the
+    statistics of every key guess are derived from those 256 class means by looking up the model table.
+    """
+    _name = "Progressive DPA (Binned)"
+
+    STATISTICS = {'Difference of Means':'dom', 'Correlation':'corr'}
+
+    def __init__(self):
+        AlgorithmsBase.__init__(self)
+
+        self._acc = None
+        self._checkpoint = None
+        self._statistic = 'dom'
+
+        self.getParams().addChildren([
+            {'name':'Statistic', 'key':'statistic', 'type':'list', 'values':self.STATISTICS, 'get':self.getStatistic, 'set':self.setStatistic, 'action':self.updateScript},
+            {'name':'Worker Threads', 'key':'workers', 'type':'int', 'limits':(1, 256), 'get':self.getWorkers, 'set':self.setWorkers, 'action':self.updateScript},
+        ])
+        self.updateScript()
+
+    def updateScript(self, _=None):
+        self.addFunction("init", "setStatistic", "'%s'" % self.getStatistic())
+        self.addFunction("init", "setWorkers", "%d" % self.getWorkers())
+
+    def getStatistic(self):
+        return self._statistic
+
+    @setupSetParam("statistic")
+    def setStatistic(self, statistic):
+        """Set the statistic of every guess: 'dom' (difference of means) or 'corr' (correlation)"""
+        self._statistic = statistic
+
+    def getCheckpoint(self):
+        if self._acc is None or any(self._acc[bnum] is None or np.sum(self._acc[bnum].n) == 0 for bnum in self.brange):
+            return {}
+        checkpoint = ClassAccumulator.stack([self._acc[bnum] for bnum in self.brange])
+        checkpoint["subkeys"] = np.array(self.brange)
+        checkpoint["nexttrace"] = self._nextTrace
+        return checkpoint
+
+    def setCheckpoint(self, checkpoint):
+        self._checkpoint = checkpoint
+
+    def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None):
+        numtraces = tracerange[1] - tracerange[0] + 1
+        numblocks = int(math.ceil(float(numtraces) / self._reportingInterval))
+        if progressBar:
+            progressBar.setText("Attacking traces subset: from %d to %d (total = %d)" % (tracerange[0], tracerange[1], numtraces))
+            progressBar.setStatusMask("Trace Interval: %d-%d. Current Subkey: %d")
+            progressBar.setMaximum(len(self.brange) * numblocks)
+
+        acc = [None]*(max(self.brange)+1)
+        if self._checkpoint is not None:
+            for bnum, a in zip(self._checkpoint["subkeys"], ClassAccumulator.unstack(self._checkpoint)):
+                acc[bnum] = a
+            self._checkpoint = None
+        self._acc = acc
+        self._nextTrace = tracerange[0]
+
+        pbcnt = 0
+
+        try:
+            for tstart in range(0, numtraces, self._reportingInterval):
+                tend = min(tstart + self._reportingInterval, numtraces)
+
+                try:
+                    traces, textins, textouts, knownkeys = self.loadTraceBlock(traceSource, tstart + tracerange[0], tend + tracerange[0])
+                except Exception, e:
+                    if progressBar:
+                        progressBar.abort(e.message)
+                        return
+                    raise
+
+                def attackSubkey(bnum):
+                    if isinstance(pointRange, list):
+                        bptrange = pointRange[bnum]
+                    else:
+                        bptrange = pointRange
+                    if bptrange is None:
+                        btraces = traces
+                    else:
+                        btraces = traces[:, bptrange[0]:bptrange[1]]
+
+                    classes = self.model.leakageClasses(textins, textouts, bnum, knownkeys)
+                    if classes is None:
+                        raise ValueError("Model %s depends on more than one byte of each trace, use the Progressive algorithm"
+                                         % self.model.getHwModelString())
+                    table, values = classes
+
+                    if acc[bnum] is None:
+                        acc[bnum] = ClassAccumulator(table.shape[1], btraces.shape[1])
+                    acc[bnum].update(values, btraces)
+
+                    if self._statistic == 'corr':
+                        return acc[bnum].correlation(table)
+                    return acc[bnum].differenceOfMeans(table)
+
+                # The progress bar is a GUI object, so it is only updated once the worker threads are done
+                for bnum, data in zip(self.brange, self.mapSubkeys(attackSubkey, self.brange)):
+                    ntraces = np.sum(acc[bnum].n)
+                    self.stats.updateSubkey(bnum, data, tnum=ntraces)
+                    pbcnt += 1
+                    if progressBar:
+                        progressBar.updateStatus(pbcnt, (ntraces - (tend - tstart), ntraces - 1, bnum))
+
+                # Traces dropped by the preprocessing are not in the accumulators, so count the traces read instead
+                self._nextTrace = tend + tracerange[0]
+
+                if progressBar and progressBar.wasAborted():
+                    return
+
+                if self.sr:
+                    self.sr()
+        finally:
+            self.closeWorkers()
@@ -29,121 +29,44 @@ import numpy as np
 import math
 
 from ..algorithmsbase import AlgorithmsBase
+from .._stats import CorrelationAccumulator
 from chipwhisperer.common.utils.pluginmanager import Plugin
 
 
 class CPAProgressiveOneSubkey(object):
-    """This class is the basic progressive CPA attack, capable of adding traces onto a variable with previous data"""
+    """This class is the basic progressive CPA attack, capable of adding traces onto a variable with previous data.
+
+    All key guesses are processed at once: the hypotheticals for a block of traces are stored in a
+    (guesses x traces) matrix, and the running co-moments are updated with a single matrix product.
+    """
     def __init__(self, model):
         self.model = model
-        self.sumhq = [0] * self.model.getPermPerSubkey()
-        self.sumtq = [0]
-        self.sumt = [0]
-        self.sumh = [0] * self.model.getPermPerSubkey()
-        self.sumht = [0] * self.model.getPermPerSubkey()
-        self.totalTraces = 0
+        self.acc = CorrelationAccumulator()
         self.modelstate = {'knownkey':None}
 
-    def oneSubkey(self, bnum, pointRange, traces_all, numtraces, plaintexts, ciphertexts, knownkeys, progressBar, state, pbcnt):
-        diffs = [0] * self.model.getPermPerSubkey()
-        self.totalTraces += numtraces
+    @property
+    def totalTraces(self):
+        return self.acc.n
 
+    def oneSubkey(self, bnum, pointRange, traces_all, numtraces, plaintexts, ciphertexts, knownkeys, progressBar, state, pbcnt):
         if pointRange == None:
             traces = traces_all
-            # padbefore = 0
-            # padafter = 0
         else:
             traces = traces_all[:, pointRange[0] : pointRange[1]]
-            # padbefore = pointRange[0]
-            # padafter = len(traces_all[0, :]) - pointRange[1]
-            # print "%d - %d (%d %d)" % (pointRange[0], pointRange[1], padbefore, padafter)
-
-        self.sumtq += np.sum(np.square(traces), axis=0, dtype=np.float64)
-        self.sumt += np.sum(traces, axis=0)
-        sumden2 = (np.square(self.sumt) - self.totalTraces * self.sumtq)
-
-        #For each 0..0xFF possible value of the key byte
-        for key in range(0, self.model.getPermPerSubkey()):
-            #Initialize arrays & variables to zero
-            sumnum = np.zeros(len(traces[0,:]))
-            # sumden1 = np.zeros(len(traces[0,:]))
-            # sumden2 = np.zeros(len(traces[0,:]))
-
-            hyp = [0] * numtraces
-
-            #Formula for CPA & description found in "Power Analysis Attacks"
-            # by Mangard et al, page 124, formula 6.2.
-            #
-            # This has been modified to reduce computational requirements such that adding a new waveform
-            # doesn't require you to recalculate everything
-
-            #Generate hypotheticals
-            for tnum in range(numtraces):
-
-                if len(plaintexts) > 0:
-                    pt = plaintexts[tnum]
-
-                if len(ciphertexts) > 0:
-                    ct = ciphertexts[tnum]
-
-                if knownkeys and len(knownkeys) > 0:
-                    nk = knownkeys[tnum]
-                else:
-                    nk = None
-
-                state['knownkey'] = nk
-
-                hypint = self.model.leakage(pt, ct, key, bnum, state)
-
-                hyp[tnum] = hypint
-
-            hyp = np.array(hyp)
-
-            self.sumh[key] += np.sum(hyp, axis=0)
-            self.sumht[key] += np.sum(np.multiply(np.transpose(traces), hyp), axis=1)
-
-            #WARNING: not casting to np.float64 causes algorithm degredation... always be careful
-            #meanh = self.sumh[key] / np.float64(self.totalTraces)
-            #meant = self.sumt[key] / np.float64(self.totalTraces)
 
-            #numtraces * meanh * meant = sumh * meant
-            #sumnum =  self.sumht[key] - meant*self.sumh[key] - meanh*self.sumt[key] + (self.sumh[key] * meant)
-            #sumnum =  self.sumht[key] - meanh*self.sumt[key]
-#            sumnum =  self.sumht[key] - meanh*self.sumt[key]
-            #sumnum =  self.sumht[key] - self.sumh[key]*self.sumt[key] / np.float64(self.totalTraces)
-            sumnum = self.totalTraces * self.sumht[key] - self.sumh[key] * self.sumt
+        #Formula for CPA & description found in "Power Analysis Attacks"
+        # by Mangard et al, page 124, formula 6.2.
+        #
+        # This has been modified so adding a new waveform doesn't require you to recalculate everything.
+        # The accumulator keeps centred co-moments rather than raw sums, so it stays accurate on long runs.
+        hyp = self.model.leakageBatch(plaintexts, ciphertexts, bnum, state, knownkeys)
+        self.acc.update(hyp, traces)
 
-            self.sumhq[key] += np.sum(np.square(hyp),axis=0, dtype=np.float64)
+        diffs = self.acc.correlation()
 
-            #numtraces * meanh * meanh = sumh * meanh
-            #sumden1 = sumhq - (2*meanh*self.sumh) + (numtraces*meanh*meanh)
-            #sumden1 = sumhq - (2*meanh*self.sumh) + (self.sumh * meanh)
-            # sumden1 = sumhq - meanh*self.sumh
-            # similarly for sumden2
-            #sumden1 = self.sumhq[key] - meanh*self.sumh[key]
-            #sumden2 = self.sumtq[key] - meant*self.sumt[key]
-            # sumden = sumden1 * sumden2
-
-            #Sumden1/Sumden2 are variance of these variables, may be numeric unstability
-            #See http://en.wikipedia.org/wiki/Algorithms_for_calculating_variance for online update
-            #algorithm which might be better
-            sumden1 = (np.square(self.sumh[key]) - self.totalTraces * self.sumhq[key])
-            sumden = sumden1 * sumden2
-
-            #if sumden.any() < 1E-12:
-            #    print "WARNING: sumden small"
-
-            diffs[key] = sumnum / np.sqrt(sumden)
-
-            if progressBar:
-                progressBar.updateStatus(pbcnt, (self.totalTraces-numtraces, self.totalTraces-1, bnum))
-            pbcnt = pbcnt + 1
-
-            # if padafter > 0:
-            #    diffs[key] = np.concatenate([diffs[key], np.zeros(padafter)])
-
-            # if padbefore > 0:
-            #    diffs[key] = np.concatenate([np.zeros(padbefore), diffs[key]])
+        if progressBar:
+            progressBar.updateStatus(pbcnt, (self.totalTraces-numtraces, self.totalTraces-1, bnum))
+        pbcnt = pbcnt + self.model.getPermPerSubkey()
 
         return (diffs, pbcnt)
 
@@ -157,12 +80,30 @@ class CPAProgressive(AlgorithmsBase, Plugin):
     def __init__(self):
         AlgorithmsBase.__init__(self)
 
+        self._cpa = None
+        self._checkpoint = None
+
         self.getParams().addChildren([
             {'name':'Iteration Mode', 'key':'itmode', 'type':'list', 'values':{'Depth-First':'df', 'Breadth-First':'bf'}, 'value':'bf', 'action':self.updateScript},
             {'name':'Skip when PGE=0', 'key':'checkpge', 'type':'bool', 'value':False, 'action':self.updateScript},
+            {'name':'Worker Threads', 'key':'workers', 'type':'int', 'limits':(1, 256), 'get':self.getWorkers, 'set':self.setWorkers, 'action':self.updateScript},
         ])
         self.updateScript()
 
+    def updateScript(self, _=None):
+        self.addFunction("init", "setWorkers", "%d" % self.getWorkers())
+
+    def getCheckpoint(self):
+        if self._cpa is None or any(self._cpa[bnum].totalTraces == 0 for bnum in self.brange):
+            return {}
+        checkpoint = CorrelationAccumulator.stack([self._cpa[bnum].acc for bnum in self.brange])
+        checkpoint["subkeys"] = np.array(self.brange)
+        checkpoint["nexttrace"] = self._nextTrace
+        return checkpoint
+
+    def setCheckpoint(self, checkpoint):
+        self._checkpoint = checkpoint
+
     def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None):
         numtraces = tracerange[1] - tracerange[0] + 1
         if progressBar:
@@ -175,6 +116,13 @@ class CPAProgressive(AlgorithmsBase, Plugin):
         for bnum in self.brange:
             cpa[bnum] = CPAProgressiveOneSubkey(self.model)
 
+        if self._checkpoint is not None:
+            for bnum, acc in zip(self._checkpoint["subkeys"], CorrelationAccumulator.unstack(self._checkpoint)):
+                cpa[bnum].acc = acc
+            self._checkpoint = None
+        self._cpa = cpa
+        self._nextTrace = tracerange[0]
+
         brangeMap = [None]*(max(self.brange)+1)
         i = 1
         for bnum in self.brange:
@@ -194,67 +142,67 @@ class CPAProgressive(AlgorithmsBase, Plugin):
             brange_bf = [0]
             brange_df = self.brange
 
-        for bnum_df in brange_df:
-            tstart = 0
-            tend = self._reportingInterval
-
-            while tstart < numtraces:
-                if tend > numtraces:
-                    tend = numtraces
+        try:
+            for bnum_df in brange_df:
+                tstart = 0
+                tend = self._reportingInterval
 
-                if tstart > numtraces:
-                    tstart = numtraces
+                while tstart < numtraces:
+                    if tend > numtraces:
+                        tend = numtraces
 
-                data = []
-                textins = []
-                textouts = []
-                knownkeys = []
-                for i in range(tstart, tend):
-                    # Handle Offset
-                    tnum = i + tracerange[0]
+                    if tstart > numtraces:
+                        tstart = numtraces
 
                     try:
-                        data.append(traceSource.getTrace(tnum))
-                        textins.append(traceSource.getTextin(tnum))
-                        textouts.append(traceSource.getTextout(tnum))
-                        knownkeys.append(traceSource.getKnownKey(tnum))
+                        # Correlation is the same on the samples as stored, which saves converting them
+                        traces, textins, textouts, knownkeys = self.loadTraceBlock(traceSource, tstart + tracerange[0], tend + tracerange[0], raw=True)
                     except Exception, e:
                         progressBar.abort(e.message)
                         return
 
-                traces = np.array(data)
-                textins = np.array(textins)
-                textouts = np.array(textouts)
-                # knownkeys = np.array(knownkeys)
+                    #Subkeys are independent, so each one is a separate job which can run on a worker thread
+                    jobs = []
+                    for bnum_bf in brange_bf:
+                        if bf:
+                            bnum = bnum_bf
+                        else:
+                            bnum = bnum_df
+
+                        if (self.stats.simplePGE(bnum) != 0) or (skipPGE == False):
+                            jobs.append((bnum, pbcnt + len(jobs) * self.model.getPermPerSubkey()))
+                        else:
+                            pbcnt = brangeMap[bnum] * self.model.getPermPerSubkey() * (numtraces / self._reportingInterval + 1)
+
+                            if bf is False:
+                                tstart = numtraces
 
-                for bnum_bf in brange_bf:
-                    if bf:
-                        bnum = bnum_bf
-                    else:
-                        bnum = bnum_df
+                    # The progress bar is a GUI object, so worker threads never touch it
+                    parallel = self.getWorkers() > 1
 
-                    skip = False
-                    if (self.stats.simplePGE(bnum) != 0) or (skipPGE == False):
+                    def attackSubkey(job):
+                        bnum, jobpbcnt = job
                         if isinstance(pointRange, list):
                             bptrange = pointRange[bnum]
                         else:
                             bptrange = pointRange
-                        (data, pbcnt) = cpa[bnum].oneSubkey(bnum, bptrange, traces, tend - tstart, textins, textouts, knownkeys, progressBar, cpa[bnum].modelstate, pbcnt)
-                        self.stats.updateSubkey(bnum, data, tnum=tend)
-                    else:
-                        skip = True
+                        return cpa[bnum].oneSubkey(bnum, bptrange, traces, tend - tstart, textins, textouts, knownkeys, None if parallel else progressBar, cpa[bnum].modelstate, jobpbcnt)
 
-                    if skip:
-                        pbcnt = brangeMap[bnum] * self.model.getPermPerSubkey() * (numtraces / self._reportingInterval + 1)
+                    for (bnum, jobpbcnt), (data, pbcnt) in zip(jobs, self.mapSubkeys(attackSubkey, jobs)):
+                        self.stats.updateSubkey(bnum, data, tnum=cpa[bnum].totalTraces)
+                        if parallel and progressBar:
+                            progressBar.updateStatus(jobpbcnt, (cpa[bnum].totalTraces - (tend - tstart), cpa[bnum].totalTraces - 1, bnum))
 
-                        if bf is False:
-                            tstart = numtraces
+                    # Traces dropped by the preprocessing are not in the accumulators, so count the traces read instead
+                    self._nextTrace = tend + tracerange[0]
 
                     if progressBar and progressBar.wasAborted():
                         return
 
-                tend += self._reportingInterval
-                tstart += self._reportingInterval
+                    tend += self._reportingInterval
+                    tstart += self._reportingInterval
 
-                if self.sr:
-                    self.sr()
+                    if self.sr:
+                        self.sr()
+        finally:
+            self.closeWorkers()
@@ -31,6 +31,7 @@ import platform
 from ctypes import *
 
 from ..algorithmsbase import AlgorithmsBase
+from .._stats import CorrelationAccumulator
 from chipwhisperer.common.utils.pluginmanager import Plugin
 
 
@@ -124,21 +125,30 @@ class CPAProgressiveOneSubkey(object):
         self.modelstate = {'knownkey':None}
 
     def clearStats(self):
-        self.anstate = None
+        self.acc = CorrelationAccumulator()
+
+    @property
+    def totalTraces(self):
+        return self.acc.n
 
     def oneSubkey(self, bnum, pointRange, traces_all, numtraces, plaintexts, ciphertexts, knownkeys, progressBar, model, state, pbcnt):
 
         if pointRange == None:
             traces = traces_all
         else:
-            # traces = np.array(traces_all[:, pointRange[0] : pointRange[1]])
             traces = traces_all[:, pointRange[0] : pointRange[1]]
 
+        # The C code walks raw buffers, so blocks sliced from memory-mapped traces need to be packed first
+        traces = np.ascontiguousarray(traces, dtype=np.float64)
+        plaintexts = np.ascontiguousarray(plaintexts, dtype=np.uint8)
+        ciphertexts = np.ascontiguousarray(ciphertexts, dtype=np.uint8)
+
         npoints = np.shape(traces)[1]
 
-        if self.anstate is None:
-            self.anstate = analysis_state_t(npoints, numtraces)
-            
+        # The C code only sees this block: its raw sums are folded into the co-moment accumulator afterwards,
+        # so they never grow large enough to lose precision
+        anstate = analysis_state_t(npoints, numtraces)
+
         mstate = aesmodel_setup_t(bnum=bnum)
         
         guessdata = np.zeros((model.getPermPerSubkey(), npoints), dtype=np.float64)
@@ -154,13 +164,16 @@ class CPAProgressiveOneSubkey(object):
                  c_size_t(numtraces),
                  c_size_t(0),
                  c_size_t(npoints),
-                 c_analysis_state_t_ptr(self.anstate),
+                 c_analysis_state_t_ptr(anstate),
                  c_void_p(0),
                 c_aesmodel_setup_t_ptr(mstate),
                  guessdata.ctypes.data_as(POINTER(c_double)))
-      
+
+        self.acc.updateFromSums(numtraces, anstate._sumh, anstate._sumhq, anstate._sumt, anstate._sumtq, anstate._sumht)
+        guessdata = self.acc.correlation()
+
         if progressBar:
-            progressBar.updateStatus(pbcnt, (self.anstate.totalTraces - numtraces, self.anstate.totalTraces-1, bnum))
+            progressBar.updateStatus(pbcnt, (self.totalTraces - numtraces, self.totalTraces-1, bnum))
 
         pbcnt = pbcnt + model.getPermPerSubkey()
 
@@ -176,12 +189,30 @@ class CPAProgressive_CAccel(AlgorithmsBase, Plugin):
     def __init__(self):
         AlgorithmsBase.__init__(self)
 
+        self._cpa = None
+        self._checkpoint = None
+
         self.getParams().addChildren([
             {'name':'Iteration Mode', 'key':'itmode', 'type':'list', 'values':{'Depth-First':'df', 'Breadth-First':'bf'}, 'value':'bf'},
             {'name':'Skip when PGE=0', 'key':'checkpge', 'type':'bool', 'value':False},
+            {'name':'Worker Threads', 'key':'workers', 'type':'int', 'limits':(1, 256), 'get':self.getWorkers, 'set':self.setWorkers, 'action':self.updateScript},
         ])
         self.updateScript()
 
+    def updateScript(self, _=None):
+        self.addFunction("init", "setWorkers", "%d" % self.getWorkers())
+
+    def getCheckpoint(self):
+        if self._cpa is None or any(self._cpa[bnum].totalTraces == 0 for bnum in self.brange):
+            return {}
+        checkpoint = CorrelationAccumulator.stack([self._cpa[bnum].acc for bnum in self.brange])
+        checkpoint["subkeys"] = np.array(self.brange)
+        checkpoint["nexttrace"] = self._nextTrace
+        return checkpoint
+
+    def setCheckpoint(self, checkpoint):
+        self._checkpoint = checkpoint
+
 
     def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None):
         brange=self.brange
@@ -193,13 +224,17 @@ class CPAProgressive_CAccel(AlgorithmsBase, Plugin):
             progressBar.setStatusMask("Trace Interval: %d-%d. Current Subkey: %d", (0,0,0))
             progressBar.setMaximum(len(brange) * self.model.getPermPerSubkey() * (numtraces / self._reportingInterval + 1))
         pbcnt = 0
-        #r = Parallel(n_jobs=4)(delayed(traceOneSubkey)(bnum, pointRange, traces_all, numtraces, plaintexts, ciphertexts, keyround, modeltype, progressBar, self.model, pbcnt) for bnum in brange)
-        #self.all_diffs, pb = zip(*r)
-        #pbcnt = 0
         cpa = [None]*(max(brange)+1)
         for bnum in brange:
             cpa[bnum] = CPAProgressiveOneSubkey()
 
+        if self._checkpoint is not None:
+            for bnum, acc in zip(self._checkpoint["subkeys"], CorrelationAccumulator.unstack(self._checkpoint)):
+                cpa[bnum].acc = acc
+            self._checkpoint = None
+        self._cpa = cpa
+        self._nextTrace = tracerange[0]
+
         brangeMap = [None]*(max(brange)+1)
         i = 1
         for bnum in brange:
@@ -220,67 +255,61 @@ class CPAProgressive_CAccel(AlgorithmsBase, Plugin):
             brange_df = brange
 
 
-        for bnum_df in brange_df:
-
-            tstart = 0
-            tend = self._reportingInterval
-
-            while tstart < numtraces:
-                if tend > numtraces:
-                    tend = numtraces
+        try:
+            for bnum_df in brange_df:
 
-                if tstart > numtraces:
-                    tstart = numtraces
+                tstart = 0
+                tend = self._reportingInterval
 
-                data = []
-                textins = []
-                textouts = []
-                knownkeys = []
-                for i in range(tstart, tend):
-                    # Handle Offset
-                    tnum = i + tracerange[0]
+                while tstart < numtraces:
+                    if tend > numtraces:
+                        tend = numtraces
 
-                    d = traceSource.getTrace(tnum)
+                    if tstart > numtraces:
+                        tstart = numtraces
 
-                    if d is None:
-                        continue
+                    traces, textins, textouts, knownkeys = self.loadTraceBlock(traceSource, tstart + tracerange[0], tend + tracerange[0])
 
-                    data.append(d)
-                    textins.append(traceSource.getTextin(tnum))
-                    textouts.append(traceSource.getTextout(tnum))
-                    knownkeys.append(traceSource.getKnownKey(tnum))
+                    #Subkeys are independent, so each one is a separate job which can run on a worker thread
+                    jobs = []
+                    for bnum_bf in brange_bf:
 
-                traces = np.array(data)
-                textins = np.array(textins)
-                textouts = np.array(textouts)
+                        if bf:
+                            bnum = bnum_bf
+                        else:
+                            bnum = bnum_df
 
-                for bnum_bf in brange_bf:
+                        if (self.stats.simplePGE(bnum) != 0) or (skipPGE == False):
+                            jobs.append((bnum, pbcnt + len(jobs) * self.model.getPermPerSubkey()))
+                        else:
+                            pbcnt = brangeMap[bnum] * self.model.getPermPerSubkey() * (numtraces / self._reportingInterval + 1)
 
-                    if bf:
-                        bnum = bnum_bf
-                    else:
-                        bnum = bnum_df
+                            if bf is False:
+                                tstart = numtraces
 
+                    # The progress bar is a GUI object, so worker threads never touch it
+                    parallel = self.getWorkers() > 1
 
-                    skip = False
-                    if (self.stats.simplePGE(bnum) != 0) or (skipPGE == False):
+                    def attackSubkey(job):
+                        bnum, jobpbcnt = job
                         if isinstance(pointRange, list):
                             bptrange = pointRange[bnum]
                         else:
                             bptrange = pointRange
-                        (data, pbcnt) = cpa[bnum].oneSubkey(bnum, bptrange, traces, tend - tstart, textins, textouts, knownkeys, progressBar, self.model, cpa[bnum].modelstate, pbcnt)
-                        self.stats.updateSubkey(bnum, data, tnum=tend)
-                    else:
-                        skip = True
+                        return cpa[bnum].oneSubkey(bnum, bptrange, traces, len(traces), textins, textouts, knownkeys, None if parallel else progressBar, self.model, cpa[bnum].modelstate, jobpbcnt)
 
-                    if skip:
-                        pbcnt = brangeMap[bnum] * self.model.getPermPerSubkey() * (numtraces / self._reportingInterval + 1)
+                    for (bnum, jobpbcnt), (data, pbcnt) in zip(jobs, self.mapSubkeys(attackSubkey, jobs)):
+                        self.stats.updateSubkey(bnum, data, tnum=cpa[bnum].totalTraces)
+                        if parallel and progressBar:
+                            progressBar.updateStatus(jobpbcnt, (cpa[bnum].totalTraces - (tend - tstart), cpa[bnum].totalTraces - 1, bnum))
 
-                        if bf is False:
-                            tstart = numtraces
+                    # Traces dropped by the preprocessing are not in the accumulators, so count the traces read instead
+                    self._nextTrace = tend + tracerange[0]
 
-                tend += self._reportingInterval
-                tstart += self._reportingInterval
+                    tend += self._reportingInterval
+                    tstart += self._reportingInterval
 
-                if self.sr is not None:
-                    self.sr()
+                    if self.sr is not None:
+                        self.sr()
+        finally:
+            self.closeWorkers()
@@ -57,6 +57,12 @@ class CPASimpleLoop(AlgorithmsBase, Plugin):
             # padafter = len(traces_all[0, :]) - pointRange[1]
             # print "%d - %d (%d %d)"%( pointRange[0],  pointRange[1], padbefore, padafter)
 
+        #Formula for CPA & description found in "Power Analysis Attacks"
+        # by Mangard et al, page 124, formula 6.2.
+
+        #Generate hypotheticals for all key guesses
+        hypall = model.leakageBatch(plaintexts, ciphertexts, bnum, state, knownkeys)
+
         #For each 0..0xFF possible value of the key byte
         for key in range(0, self.model.getPermPerSubkey()):
             #Initialize arrays & variables to zero
@@ -64,36 +70,7 @@ class CPASimpleLoop(AlgorithmsBase, Plugin):
             sumden1 = np.zeros(len(traces[0,:]))
             sumden2 = np.zeros(len(traces[0,:]))
 
-            hyp = [0] * numtraces
-
-            #Formula for CPA & description found in "Power Analysis Attacks"
-            # by Mangard et al, page 124, formula 6.2.
-
-            #Generate hypotheticals
-            for tnum in range(numtraces):
-
-                if len(plaintexts) > 0:
-                    pt = plaintexts[tnum]
-                else:
-                    pt = []
-
-                if len(ciphertexts) > 0:
-                    ct = ciphertexts[tnum]
-                else:
-                    ct = []
-
-                if knownkeys and len(knownkeys) > 0:
-                    nk = knownkeys[tnum]
-                else:
-                    nk = None
-
-                state['knownkey'] = nk
-
-                hypint = model.leakage(pt, ct, key, bnum, state)
-
-                hyp[tnum] = hypint
-
-            hyp = np.array(hyp)
+            hyp = np.asarray(hypall[key], dtype=np.float64)
 
             #Mean of hypothesis
             meanh = np.mean(hyp, dtype=np.float64)
@@ -134,26 +111,8 @@ class CPASimpleLoop(AlgorithmsBase, Plugin):
             progressBar.setMaximum(len(brange) * self.model.getPermPerSubkey())
 
         # Load all traces
-        data = []
-        textins = []
-        textouts = []
-        knownkeys = []
-        for i in range(tracerange[0], tracerange[1]+1):
-            # Handle Offset
-            tnum = i + tracerange[0]
-
-            d = traceSource.getTrace(tnum)
-            if d is None:
-                continue
-
-            data.append(d)
-            textins.append(traceSource.getTextin(tnum))
-            textouts.append(traceSource.getTextout(tnum))
-            knownkeys.append(traceSource.getKnownKey(tnum))
-
-        traces = np.array(data)
-        textins = np.array(textins)
-        textouts = np.array(textouts)
+        traces, textins, textouts, knownkeys = self.loadTraceBlock(traceSource, tracerange[0], tracerange[1] + 1)
+        numtraces = len(traces)
 
         pbcnt = 0
         for bnum in brange:
@@ -24,12 +24,17 @@
 #    You should have received a copy of the GNU General Public License
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 
+import numpy as np
+
 from chipwhisperer.analyzer.attacks.models.aes.funcs import sbox, inv_sbox
 
 from base import ModelsBase
 from chipwhisperer.analyzer.attacks.models.aes.key_schedule import keyScheduleRounds
 from chipwhisperer.common.utils.pluginmanager import Plugin
 
+SBOX_TABLE = np.array([sbox(i) for i in range(256)], dtype=np.uint8)
+INV_SBOX_TABLE = np.array([inv_sbox(i) for i in range(256)], dtype=np.uint8)
+
 
 class AES128_8bit(ModelsBase, Plugin):
     _name = 'AES 128'
@@ -55,6 +60,9 @@ class AES128_8bit(ModelsBase, Plugin):
 
     INVSHIFT = [0, 5, 10, 15, 4, 9, 14, 3, 8, 13, 2, 7, 12, 1, 6, 11]
 
+    # Leakage tables indexed as [guess, input byte], shared by all instances and built on first use
+    _leakageTables = {}
+
     def __init__(self, model=LEAK_HW_SBOXOUT_FIRSTROUND):
         ModelsBase.__init__(self, 16, 256, model=model)
         self.numRoundKeys = 10
@@ -78,7 +86,7 @@ class AES128_8bit(ModelsBase, Plugin):
             # HD Leakage of AES State between 9th and 10th Round
             # Used to break SASEBO-GII / SAKURA-G
             st10 = ct[self.INVSHIFT[bnum]]
-            st9 =  inv_sbox(ct[bnum] ^ guess)
+            st9 = INV_SBOX_TABLE[ct[bnum] ^ guess]
             return self.HW[st9 ^ st10]
 
         elif self.model == self.LEAK_HD_SBOX_IN_OUT:
@@ -88,14 +96,99 @@ class AES128_8bit(ModelsBase, Plugin):
             return self.HW[st1 ^ st2]
 
         elif self.model == self.LEAK_HD_SBOX_IN_SUCCESSIVE:
-            pass
+            # Leakage from HD of S-Box input i-1 to input i, e.g. a byte-serial implementation reusing a register
+            st1 = self.previousSboxInput(pt, bnum, state)
+            st2 = pt[bnum] ^ guess
+            return self.HW[st1 ^ st2]
 
         elif self.model == self.LEAK_HD_SBOX_OUT_SUCCESSIVE:
-            pass
+            # Leakage from HD of S-Box output i-1 to output i
+            st1 = self.previousSboxInput(pt, bnum, state)
+            st2 = pt[bnum] ^ guess
+            return self.HW[sbox(st1) ^ sbox(st2)] if bnum > 0 else self.HW[sbox(st2)]
 
         else:
             raise ValueError("Invalid model: %s" % str(self.model))
 
+    def previousSboxInput(self, pt, bnum, state):
+        """S-Box input of byte bnum-1, which needs the known key. The register is taken as cleared before byte 0."""
+        if bnum == 0:
+            return 0
+        knownkey = state.get('knownkey') if state is not None else None
+        if knownkey is None or len(knownkey) == 0:
+            raise ValueError("Model %s needs the known key of each trace" % self.hwModels_toStr[self.model])
+        return pt[bnum - 1] ^ knownkey[bnum - 1]
+
+    def leakageTable(self):
+        """
+        Return the 256x256 uint8 table of this model indexed as [guess, input byte]. For the HD models comparing
+        against a second byte of each trace (last-round state, S-Box output i to i+1) this is the intermediate
+        state, the leakage is the HW of it XORed with that byte. See leakageBatch().
+        """
+        if self.model not in self._leakageTables:
+            st1 = np.arange(256, dtype=np.uint8)[None, :] ^ np.arange(256, dtype=np.uint8)[:, None]
+
+            if self.model == self.LEAK_HW_SBOXOUT_FIRSTROUND:
+                table = self.HW_TABLE[SBOX_TABLE[st1]]
+            elif self.model == self.LEAK_HW_INVSBOXOUT_FIRSTROUND:
+                table = self.HW_TABLE[INV_SBOX_TABLE[st1]]
+            elif self.model == self.LEAK_HD_SBOX_IN_OUT:
+                table = self.HW_TABLE[st1 ^ SBOX_TABLE[st1]]
+            elif self.model == self.LEAK_HD_SBOX_IN_SUCCESSIVE:
+                table = self.HW_TABLE[st1]
+            elif self.model == self.LEAK_HD_SBOX_OUT_SUCCESSIVE:
+                table = SBOX_TABLE[st1]
+            elif self.model == self.LEAK_HD_LASTROUND_STATE:
+                table = INV_SBOX_TABLE[st1]
+            else:
+                raise ValueError("Invalid model: %s" % str(self.model))
+            self._leakageTables[self.model] = table
+
+        return self._leakageTables[self.model]
+
+    def previousSboxInputs(self, pt, bnum, knownkeys):
+        """Batch version of previousSboxInput() for a (traces x 16) plaintext array"""
+        if bnum == 0:
+            return np.zeros(len(pt), dtype=np.uint8)
+        if knownkeys is None or len(knownkeys) != len(pt) or any(k is None or len(k) == 0 for k in knownkeys):
+            raise ValueError("Model %s needs the known key of each trace" % self.hwModels_toStr[self.model])
+        return pt[:, bnum - 1] ^ np.asarray(knownkeys, dtype=np.uint8)[:, bnum - 1]
+
+    def leakageBatch(self, plaintexts, ciphertexts, bnum, state, knownkeys=None):
+        table = self.leakageTable()
+
+        if self.model == self.LEAK_HD_LASTROUND_STATE:
+            ct = np.asarray(ciphertexts, dtype=np.uint8)
+            return self.HW_TABLE[table[:, ct[:, bnum]] ^ ct[:, self.INVSHIFT[bnum]]]
+
+        pt = np.asarray(plaintexts, dtype=np.uint8)
+
+        if self.model in (self.LEAK_HD_SBOX_IN_SUCCESSIVE, self.LEAK_HD_SBOX_OUT_SUCCESSIVE):
+            prev = self.previousSboxInputs(pt, bnum, knownkeys)
+
+            if self.model == self.LEAK_HD_SBOX_IN_SUCCESSIVE:
+                return table[:, pt[:, bnum] ^ prev]
+            elif bnum == 0:
+                return self.HW_TABLE[table[:, pt[:, bnum]]]
+            else:
+                return self.HW_TABLE[table[:, pt[:, bnum]] ^ SBOX_TABLE[prev]]
+
+        return table[:, pt[:, bnum]]
+
+    def leakageClasses(self, plaintexts, ciphertexts, bnum, knownkeys=None):
+        # The last-round state and S-Box output i to i+1 models depend on two bytes of each trace
+        if self.model == self.LEAK_HD_LASTROUND_STATE or (self.model == self.LEAK_HD_SBOX_OUT_SUCCESSIVE and bnum > 0):
+            return None
+
+        table = self.leakageTable()
+        pt = np.asarray(plaintexts, dtype=np.uint8)
+
+        if self.model == self.LEAK_HD_SBOX_IN_SUCCESSIVE:
+            return table, pt[:, bnum] ^ self.previousSboxInputs(pt, bnum, knownkeys)
+        elif self.model == self.LEAK_HD_SBOX_OUT_SUCCESSIVE:
+            return self.HW_TABLE[table], pt[:, bnum]
+        return table, pt[:, bnum]
+
     # TODO: Use this
     def xtime(self, a):
         """xtime operation"""
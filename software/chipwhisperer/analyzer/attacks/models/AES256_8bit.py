@@ -24,8 +24,13 @@
 #    You should have received a copy of the GNU General Public License
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 
+import numpy as np
+
 from base import ModelsBase
 from chipwhisperer.analyzer.attacks.models.aes.funcs import sbox, inv_sbox
+from chipwhisperer.analyzer.attacks.models.AES128_8bit import SBOX_TABLE
+
+XTIME_TABLE = np.array([((i << 1) ^ (0x1b if i & 0x80 else 0)) & 0xff for i in range(256)], dtype=np.uint8)
 
 
 class AES(object):
@@ -183,13 +188,86 @@ class AES(object):
 
 
 class AES256_8bit(ModelsBase):
+    LEAK_HW_SBOXOUT_FIRSTROUND = 1
+
+    hwModels_toStr = [None, 'LEAK_HW_SBOXOUT_FIRSTROUND']
+
+    hwModels = {'HW: AES SBox Output, First Round (Enc)':LEAK_HW_SBOXOUT_FIRSTROUND}
+
     SHIFT = []
 
     INVSHIFT = [0, 5, 10, 15, 4, 9, 14, 3, 8, 13, 2, 7, 12, 1, 6, 11]
 
-    def __init__(self, model=None):
+    # Byte taken by each position of the state in ShiftRows (state stored column by column)
+    SHIFTROWS = [0, 5, 10, 15, 4, 9, 14, 3, 8, 13, 2, 7, 12, 1, 6, 11]
+
+    # Leakage tables indexed as [guess, input byte], shared by all instances and built on first use
+    _leakageTables = {}
+
+    def __init__(self, model=LEAK_HW_SBOXOUT_FIRSTROUND):
         ModelsBase.__init__(self, 32, 256, model=model)
 
+    def leakage(self, pt, ct, guess, bnum, state):
+        if self.model == self.LEAK_HW_SBOXOUT_FIRSTROUND:
+            if bnum < 16:
+                return self.HypHW(pt, None, guess, bnum)
+            # The second half of the key is only used in round 2, whose input needs the first half
+            knownkey = state.get('knownkey') if state is not None else None
+            return int(self.leakageBatch([pt], [], bnum, state, [knownkey])[guess, 0])
+        else:
+            raise ValueError("Invalid model: %s" % str(self.model))
+
+    def leakageTable(self):
+        """Return the 256x256 leakage table indexed as [guess, plaintext byte]"""
+        if self.model not in self._leakageTables:
+            st1 = np.arange(256, dtype=np.uint8)[None, :] ^ np.arange(256, dtype=np.uint8)[:, None]
+
+            if self.model == self.LEAK_HW_SBOXOUT_FIRSTROUND:
+                table = self.HW_TABLE[SBOX_TABLE[st1]]
+            else:
+                table = None
+            self._leakageTables[self.model] = table
+
+        return self._leakageTables[self.model]
+
+    def leakageBatch(self, plaintexts, ciphertexts, bnum, state, knownkeys=None):
+        table = self.leakageTable()
+        if table is not None:
+            pt = np.asarray(plaintexts, dtype=np.uint8)
+            if bnum < 16:
+                return table[:, pt[:, bnum]]
+            return table[:, self.secondRoundInput(pt, knownkeys)[:, bnum - 16]]
+
+        return ModelsBase.leakageBatch(self, plaintexts, ciphertexts, bnum, state, knownkeys)
+
+    def leakageClasses(self, plaintexts, ciphertexts, bnum, knownkeys=None):
+        table = self.leakageTable()
+        if table is None:
+            return None
+        pt = np.asarray(plaintexts, dtype=np.uint8)
+        if bnum < 16:
+            return table, pt[:, bnum]
+        return table, self.secondRoundInput(pt, knownkeys)[:, bnum - 16]
+
+    def secondRoundInput(self, plaintexts, knownkeys):
+        """Return the state entering the round 2 key addition (after SubBytes, ShiftRows and MixColumns of round 1),
+        for each plaintext, using the first 16 bytes of its known key"""
+        if knownkeys is None or len(knownkeys) != len(plaintexts) or any(k is None or len(k) < 16 for k in knownkeys):
+            raise ValueError("Subkeys 16-31 of AES-256 need the first 16 bytes of the known key of each trace")
+
+        st = SBOX_TABLE[np.asarray(plaintexts, dtype=np.uint8) ^ np.asarray([k[:16] for k in knownkeys], dtype=np.uint8)]
+        st = st[:, self.SHIFTROWS]
+        st2 = XTIME_TABLE[st]
+        out = np.empty_like(st)
+        for c in range(0, 16, 4):
+            s0, s1, s2, s3 = st[:, c], st[:, c+1], st[:, c+2], st[:, c+3]
+            d0, d1, d2, d3 = st2[:, c], st2[:, c+1], st2[:, c+2], st2[:, c+3]
+            out[:, c] = d0 ^ d1 ^ s1 ^ s2 ^ s3
+            out[:, c+1] = s0 ^ d1 ^ d2 ^ s2 ^ s3
+            out[:, c+2] = s0 ^ s1 ^ d2 ^ d3 ^ s3
+            out[:, c+3] = d0 ^ s0 ^ s1 ^ s2 ^ d3
+        return out
+
     def xtime(self, a):
         """xtime operation"""
         a %= 0x100
@@ -150,18 +150,80 @@ class DES(ModelsBase, Plugin):
     # number left rotations of pc1
     __left_rotations = [0, 1, 1, 2, 2, 2, 2, 2, 2, 1, 2, 2, 2, 2, 2, 2, 1]
 
+    # Leakage tables indexed as [guess, expanded input], shared by all instances and built on first use
+    _leakageTables = {}
+
+    # Number of plaintexts whose expanded S-Box inputs are kept by cachedExpandedInputs()
+    _expandedCacheSize = 4096
+
     def __init__(self, model=LEAK_HW_SBOXOUT_FIRSTROUND):
         ModelsBase.__init__(self, 8, 64, model)
         self.numRoundKeys = 16
 
+        # One row of 8 S-Box inputs per cached plaintext, rows are reused round-robin once all are taken
+        self._expandedCache = {}
+        self._expandedRows = np.zeros((self._expandedCacheSize, 8), dtype=np.uint8)
+        self._expandedKeys = [None] * self._expandedCacheSize
+        self._expandedNext = 0
+
     def processKnownKey(self, inpkey):
         return self.keyScheduleRounds(inpkey, 0, 1)
 
     def leakage(self, pt, ct, guess, bnum, state):
-        if self.model == self.LEAK_HW_SBOXOUT_FIRSTROUND:
-            return self.HW[self.sbox_out_first_fbox(pt, guess, bnum)]
-        elif self.model == self.LEAK_HW_SBOXIN_FIRSTROUND:
-            return self.HW[self.binary_list_to_subkeys(self.sbox_in_first_fbox(pt, guess, bnum),6)[0]]
+        return int(self.leakageTable(bnum)[guess, self.cachedExpandedInputs(pt)[bnum]])
+
+    def leakageTable(self, bnum):
+        """Return the 64x64 leakage table of S-Box bnum, indexed as [guess, 6-bit expanded input]"""
+        if (self.model, bnum) not in self._leakageTables:
+            B = np.arange(64, dtype=np.uint8)[None, :] ^ np.arange(64, dtype=np.uint8)[:, None]
+
+            if self.model == self.LEAK_HW_SBOXOUT_FIRSTROUND:
+                m = ((B >> 4) & 0x02) | (B & 0x01)
+                n = (B >> 1) & 0x0F
+                table = self.HW_TABLE[np.array(self.sBox[bnum], dtype=np.uint8)[(m << 4) + n]]
+            elif self.model == self.LEAK_HW_SBOXIN_FIRSTROUND:
+                table = self.HW_TABLE[B]
+            else:
+                raise ValueError("Invalid model: %s" % str(self.model))
+            self._leakageTables[(self.model, bnum)] = table
+
+        return self._leakageTables[(self.model, bnum)]
+
+    def expandedInputs(self, plaintexts):
+        """Return the 6-bit inputs of all 8 S-Boxes in the first round (before the key addition), as a
+        (plaintexts x 8) uint8 array"""
+        bits = np.unpackbits(np.asarray(plaintexts, dtype=np.uint8).reshape(-1, 8), axis=1)
+        expR = bits[:, [self.__ip[32 + v] for v in self.__expansion_table]].reshape(-1, 8, 6)
+        return np.dot(expR, np.array([32, 16, 8, 4, 2, 1], dtype=np.uint8)).astype(np.uint8)
+
+    def expandedInput(self, plaintexts, bnum):
+        """Return the 6-bit input of S-Box bnum in the first round (before the key addition), for each plaintext"""
+        return self.expandedInputs(plaintexts)[:, bnum]
+
+    def cachedExpandedInputs(self, pt):
+        """expandedInputs() of a single plaintext, only computed if it isn't cached. The result is a view which is
+        only valid until the next call."""
+        key = bytes(bytearray(pt))
+        row = self._expandedCache.get(key)
+        if row is None:
+            row = self._expandedNext
+            self._expandedNext = (row + 1) % self._expandedCacheSize
+            if self._expandedKeys[row] is not None:
+                del self._expandedCache[self._expandedKeys[row]]
+            self._expandedRows[row] = self.expandedInputs([bytearray(key)])[0]
+            self._expandedKeys[row] = key
+            self._expandedCache[key] = row
+        return self._expandedRows[row]
+
+    def leakageVector(self, pt, bnum):
+        """Return the leakage of all 64 guesses of S-Box bnum for one plaintext"""
+        return self.leakageTable(bnum)[:, self.cachedExpandedInputs(pt)[bnum]]
+
+    def leakageBatch(self, plaintexts, ciphertexts, bnum, state, knownkeys=None):
+        return self.leakageTable(bnum)[:, self.expandedInput(plaintexts, bnum)]
+
+    def leakageClasses(self, plaintexts, ciphertexts, bnum, knownkeys=None):
+        return self.leakageTable(bnum), self.expandedInput(plaintexts, bnum)
 
     def __permutate(self, table, block):
         """Permutate this block with the specified table"""
@@ -57,6 +57,7 @@ class ModelsBase(Parameterized):
           6, 3, 4, 4, 5, 4, 5, 5, 6, 4, 5, 5, 6, 5, 6, 6, 7, 3, 4, 4, 5, 4, 5,
           5, 6, 4, 5, 5, 6, 5, 6, 6, 7, 4, 5, 5, 6, 5, 6, 6, 7, 5, 6, 6, 7, 6,
           7, 7, 8]
+    HW_TABLE = np.array(HW, dtype=np.uint8)
 
     def __init__(self, numSubKeys, permPerSubkey, model=None):
         self.sigParametersChanged = util.Signal()
@@ -80,6 +81,39 @@ class ModelsBase(Parameterized):
     def leakage(self, pt, ct, guess, bnum, state):
         pass
 
+    def leakageBatch(self, plaintexts, ciphertexts, bnum, state, knownkeys=None):
+        """
+        Return the hypothetical leakage of every guess for a block of traces, as a (guesses x traces) array.
+
+        Models should override this with a lookup-table implementation. This default calls leakage()
+        once per trace and per guess, so any model providing leakage() works with the batch API.
+        """
+        numtraces = max(len(plaintexts), len(ciphertexts))
+        hyp = np.zeros((self.getPermPerSubkey(), numtraces), dtype=np.float64)
+        if state is None:
+            state = {}
+
+        for tnum in range(numtraces):
+            pt = plaintexts[tnum] if len(plaintexts) > 0 else None
+            ct = ciphertexts[tnum] if len(ciphertexts) > 0 else None
+
+            if knownkeys is not None and len(knownkeys) > 0:
+                state['knownkey'] = knownkeys[tnum]
+            else:
+                state['knownkey'] = None
+
+            for guess in range(0, self.getPermPerSubkey()):
+                hyp[guess, tnum] = self.leakage(pt, ct, guess, bnum, state)
+
+        return hyp
+
+    def leakageClasses(self, plaintexts, ciphertexts, bnum, knownkeys=None):
+        """
+        Return (table, classes) such that leakageBatch() equals table[:, classes], where table is (guesses x classes)
+        and classes holds one integer per trace. None if the model can't be written that way (the default).
+        """
+        return None
+
     def getNumSubKeys(self):
         return self.numSubKeys
 
@@ -0,0 +1,156 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2014, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.assembla.com/spaces/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+import logging
+import numpy as np
+
+from chipwhisperer.analyzer.attacks.models.AES128_8bit import SBOX_TABLE
+from chipwhisperer.analyzer.utils.Partition import PartitionIntermediate
+from .template import ProfilingTemplate, TemplateUsingMVS
+
+# Basis functions of an 8-bit intermediate value: a constant and each bit, one row per value
+BIT_BASIS = np.hstack([np.ones((256, 1)), np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1)[:, ::-1]])
+
+
+class LinearRegressionProfile(object):
+    """
+    Stochastic model: each point of interest is fitted as a linear function of the bits of the first-round
+    S-Box output, plus Gaussian noise of one variance per point
+    """
+
+    @staticmethod
+    def generate(traceSource, trange, poiList, progressBar=None):
+        """Fit the model of all subkeys over traces trange[0] to trange[1]-1"""
+        accumulators = TemplateUsingMVS.accumulate(traceSource, trange, poiList, PartitionIntermediate(), progressBar)
+        if accumulators is None:
+            return None
+
+        model = LinearRegressionProfile.fromAccumulators(accumulators, trange, poiList)
+
+        if progressBar:
+            progressBar.close()
+
+        return model
+
+    @staticmethod
+    def fromAccumulators(accumulators, trange, poiList):
+        """
+        Solve the model from the per-value statistics of each subkey (see TemplateUsingMVS.accumulate()). The
+        normal equations only need the count and mean of each of the 256 values, so every point is solved with
+        one least-squares call.
+        """
+        coefs = []
+        noisevars = []
+
+        for bnum, acc in enumerate(accumulators):
+            weighted = BIT_BASIS * acc.n[:, None]
+            coef = np.linalg.lstsq(np.dot(BIT_BASIS.T, weighted), np.dot(weighted.T, acc.mean), rcond=None)[0]
+
+            # Residual = spread around each value's mean + distance of those means from the fit
+            residual = np.einsum('vii->i', acc.scatter) + np.dot(acc.n, np.square(acc.mean - np.dot(BIT_BASIS, coef)))
+            dof = np.sum(acc.n) - BIT_BASIS.shape[1]
+            if dof <= 0:
+                logging.warning('Insufficient profiling data to fit the regression model for bnum=%d' % bnum)
+
+            coefs.append(coef)
+            noisevars.append(residual / max(dof, 1))
+
+        return {
+         "coef":coefs,
+         "noisevar":noisevars,
+         "trange":(trange[0], trange[1]),
+         "poi":poiList,
+         "partitiontype":PartitionIntermediate.__name__
+        }
+
+
+class ProfilingLinearRegression(ProfilingTemplate):
+    """
+    Profiled attack using a linear regression (stochastic) model of the leakage: the model is fitted on traces
+    with a known key, then every key guess is scored by the likelihood of the attack traces under it
+    """
+    _name = 'Linear Regression'
+
+    _templateSubsection = "Regression Models"
+    _templatePrefix = "regression"
+
+    def __init__(self):
+        ProfilingTemplate.__init__(self)
+        self.findParam(["Generate New Template", 'pooled']).hide()
+        self.setProfileAlgorithm(LinearRegressionProfile)
+
+    def generateArguments(self):
+        return 'self.getTraceSource(), tRange, poiList'
+
+    def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None):
+        # Hack for now - just use last model found
+        model = self.loadTemplatesFromProject()[-1]
+        pois = model["poi"]
+        numtraces = tracerange[1] - tracerange[0] + 1
+        results = np.zeros((self.model.getNumSubKeys(), self.model.getPermPerSubkey()))
+        guesses = np.arange(self.model.getPermPerSubkey(), dtype=np.uint8)[:, None]
+
+        # Log-likelihood of a trace under value v is sum(y*mean[v]/var) - sum(mean[v]^2/var)/2, up to terms
+        # which are the same for all guesses
+        weights = [None] * self.model.getNumSubKeys()
+        offsets = [None] * self.model.getNumSubKeys()
+        for bnum in self.brange:
+            means = np.dot(BIT_BASIS, model["coef"][bnum])
+            weights[bnum] = means / model["noisevar"][bnum]
+            offsets[bnum] = 0.5 * np.sum(means * weights[bnum], axis=1)
+
+        if progressBar:
+            progressBar.setStatusMask("Current Trace = %d Current Subkey = %d", (0, 0))
+            progressBar.setMaximum(self.model.getNumSubKeys() * numtraces)
+        pcnt = 0
+
+        tdone = 0
+        for bstart in range(tracerange[0], tracerange[1] + 1, self._reportingInterval):
+            bend = min(bstart + self._reportingInterval, tracerange[1] + 1)
+            traces, textins, _, _ = self.loadTraceBlock(traceSource, bstart, bend)
+            tdone += len(traces)
+
+            if len(traces) > 0:
+                startingPoint, endingPoint = pointRange  # TODO:support start/end point different per byte
+                traces = traces[:, startingPoint:endingPoint]
+                pt = np.asarray(textins, dtype=np.uint8)
+
+            for bnum in self.brange:
+                if len(traces) > 0:
+                    # Score every trace against every intermediate value, then pick the value each guess predicts
+                    scores = np.dot(np.asarray(traces[:, pois[bnum]], dtype=np.float64), weights[bnum].T) - offsets[bnum]
+                    values = SBOX_TABLE[pt[:, bnum] ^ guesses]
+                    results[bnum] += scores[np.arange(len(traces))[None, :], values].sum(axis=1)
+
+                self.stats.updateSubkey(bnum, results[bnum], tnum=tdone)
+
+                pcnt += bend - bstart
+                if progressBar:
+                    progressBar.updateStatus(pcnt, (bend - 1, bnum))
+                    if progressBar.wasAborted():
+                        return
+
+            # Do plotting if required
+            if self.sr:
+                self.sr()
@@ -27,13 +27,15 @@
 import logging
 import numpy as np
 import scipy
+import scipy.linalg
 import sys
 
-from chipwhisperer.analyzer.attacks.models.AES128_8bit import AES128_8bit
+from chipwhisperer.analyzer.attacks.models.AES128_8bit import AES128_8bit, SBOX_TABLE
 from chipwhisperer.common.utils import util
 from chipwhisperer.common.utils.pluginmanager import Plugin
 from chipwhisperer.analyzer.ui.CWAnalyzerGUI import CWAnalyzerGUI
 from ..algorithmsbase import AlgorithmsBase
+from .._stats import TemplateAccumulator
 
 
 class TemplateUsingMVS(object):
@@ -42,8 +44,26 @@ class TemplateUsingMVS(object):
     """
 
     @staticmethod
-    def generate(traceSource, trange, poiList, partMethod, progressBar=None):
+    def generate(traceSource, trange, poiList, partMethod, progressBar=None, pooled=False):
         """Generate templates for all partitions over entire trace range"""
+        accumulators = TemplateUsingMVS.accumulate(traceSource, trange, poiList, partMethod, progressBar)
+        if accumulators is None:
+            return None
+
+        template = TemplateUsingMVS.fromAccumulators(accumulators, trange, poiList, partMethod, pooled)
+
+        if progressBar:
+            progressBar.close()
+
+        return template
+
+    @staticmethod
+    def accumulate(traceSource, trange, poiList, partMethod, progressBar=None, blockSize=1000):
+        """
+        Return a TemplateAccumulator per subkey holding the statistics of traces trange[0] to trange[1]-1.
+        Traces are read in blocks, so memory does not grow with the trace range. Accumulators of different
+        ranges can be combined with merge() before calling fromAccumulators().
+        """
 
         # Number of subkeys
         subkeys = len(poiList)
@@ -53,67 +73,113 @@ class TemplateUsingMVS(object):
         tstart = trange[0]
         tend = trange[1]
 
-        templateTraces = [ [ [] for j in range(0, numPartitions) ] for i in range(0, subkeys) ]
-
-        templateMeans = [ np.zeros((numPartitions, len(poiList[i]))) for i in range (0, subkeys) ]
-        templateCovs = [ np.zeros((numPartitions, len(poiList[i]), len(poiList[i]))) for i in range (0, subkeys) ]
+        accumulators = [TemplateAccumulator(numPartitions, len(poiList[i])) for i in range(0, subkeys)]
 
         if progressBar:
-            progressBar.setText('Generating Trace Matrix:')
-            progressBar.setMaximum(tend - tstart + subkeys)
+            progressBar.setText('Generating Trace Covariance and Mean Matrices:')
+            progressBar.setMaximum(tend - tstart)
+
+        traceSource.setReadRange(tstart, tend)
+        for bstart in range(tstart, tend, blockSize):
+            bend = min(bstart + blockSize, tend)
+            traces = traceSource.getTraces(bstart, bend)
+            pnum = partMethod.getPartitionNums(traceSource, bstart, bend)
+
+            # Skip traces the source could not provide (e.g. a failed resync)
+            if traces.dtype == object:
+                keep = [i for i, t in enumerate(traces) if t is not None]
+                traces = np.array([traces[i] for i in keep])
+                pnum = pnum[keep]
 
-        for tnum in range(tstart, tend):
-            # partData = traceSource.getAuxData(tnum, self.partObject.attrDictPartition)["filedata"]
-            pnum = partMethod.getPartitionNum(traceSource, tnum)
-            t = traceSource.getTrace(tnum)
             for bnum in range(0, subkeys):
-                templateTraces[bnum][pnum[bnum]].append(t[poiList[bnum]])
+                if len(traces) > 0:
+                    accumulators[bnum].update(traces[:, poiList[bnum]], pnum[:, bnum])
 
             if progressBar:
-                progressBar.updateStatus(tnum - tstart)
+                progressBar.updateStatus(bend - tstart)
                 if progressBar.wasAborted():
                     return None
 
-        if progressBar:
-            progressBar.setText('Generating Trace Covariance and Mean Matrices:')
+        return accumulators
 
-        for bnum in range(0, subkeys):
-            for i in range(0, numPartitions):
-                templateMeans[bnum][i] = np.mean(templateTraces[bnum][i], axis=0)
-                cov = np.cov(templateTraces[bnum][i], rowvar=0)
-                if __debug__: logging.debug('templateTraces[%d][%d] = %d' % (bnum, i, len(templateTraces[bnum][i])))
+    @staticmethod
+    def fromAccumulators(accumulators, trange, poiList, partMethod, pooled=False):
+        """Build the template dictionary from per-subkey accumulators, optionally with one pooled covariance matrix per subkey"""
+        templateMeans = []
+        templateCovs = []
 
-                if len(templateTraces[bnum][i]) > 0:
-                    templateCovs[bnum][i] = cov
-                else:
-                    logging.warning('Insufficient template data to generate covariance matrix for bnum=%d, partition=%d' % (bnum, i))
-                    templateCovs[bnum][i] = np.zeros((len(poiList[bnum]), len(poiList[bnum])))
+        for bnum, acc in enumerate(accumulators):
+            if __debug__: logging.debug('templateTraces[%d] = %s' % (bnum, acc.n))
 
-            if progressBar:
-                progressBar.updateStatus(tend + bnum)
-                if progressBar.wasAborted():
-                    return None
+            covs = acc.covariances(pooled)
+            for i in np.nonzero(acc.n == 0)[0]:
+                logging.warning('Insufficient template data to generate covariance matrix for bnum=%d, partition=%d' % (bnum, i))
+                covs[i] = 0
+
+            templateMeans.append(acc.means())
+            templateCovs.append(covs)
 
         template = {
          "mean":templateMeans,
          "cov":templateCovs,
-         "trange":(tstart, tend),
+         "trange":(trange[0], trange[1]),
          "poi":poiList,
          "partitiontype":partMethod.__class__.__name__
         }
 
-        if progressBar:
-            progressBar.close()
-
         return template
 
 
+class TemplateLogLikelihood(object):
+    """
+    Gaussian log-likelihood of traces under each partition template of a subkey. The covariance matrices are
+    factorized once, so a block of traces is matched against all partitions with a single matrix product.
+    """
+
+    def __init__(self, means, covs):
+        means = np.asarray(means, dtype=np.float64)
+        numparts, npoints = means.shape
+
+        # For each partition, W = inv(L) with cov = L L^T, so the Mahalanobis distance is |W x - W mean|^2
+        self._whiten = np.empty((numparts, npoints, npoints))
+        self._logdet = np.empty(numparts)
+        for i in range(0, numparts):
+            if not np.all(np.isfinite(means[i])):
+                raise np.linalg.LinAlgError("Template mean of partition %d is not finite" % i)
+            chol = np.linalg.cholesky(covs[i])
+            self._whiten[i] = scipy.linalg.solve_triangular(chol, np.eye(npoints), lower=True)
+            self._logdet[i] = 2 * np.sum(np.log(np.diag(chol)))
+
+        self._whitenedMeans = np.einsum('pij,pj->pi', self._whiten, means)
+        self._whiten = self._whiten.reshape(numparts * npoints, npoints)
+        self._numparts = numparts
+        self._npoints = npoints
+
+    def logpdf(self, points):
+        """Return the (traces x partitions) log-likelihood of a (traces x POI) array"""
+        points = np.asarray(points, dtype=np.float64)
+        maha = np.empty((len(points), self._numparts))
+
+        # Work in chunks so the whitened points of all partitions stay small
+        chunk = max(1, (1 << 20) // (self._numparts * self._npoints))
+        for i in range(0, len(points), chunk):
+            z = np.dot(points[i:i + chunk], self._whiten.T).reshape(-1, self._numparts, self._npoints)
+            z -= self._whitenedMeans
+            maha[i:i + chunk] = np.einsum('npi,npi->np', z, z)
+
+        return -0.5 * (maha + self._logdet + self._npoints * np.log(2 * np.pi))
+
+
 class ProfilingTemplate(AlgorithmsBase, Plugin):
     """
     Template Attack done as a loop, but using an algorithm which can progressively add traces & give output stats
     """
     _name= 'Template Attack'
 
+    # Where generated templates are stored in the project
+    _templateSubsection = "Templates"
+    _templatePrefix = "templates"
+
     def __init__(self):
         AlgorithmsBase.__init__(self)
         self.profiling = None
@@ -125,6 +191,7 @@ class ProfilingTemplate(AlgorithmsBase, Plugin):
                 {'name':'Trace End', 'key':'tgenstop', 'value':0, 'type':'int', 'action':self.updateScript},
                 {'name':'POI Selection', 'key':'poimode', 'type':'list', 'values':{'TraceExplorer Table':0, 'Read from Project File':1}, 'value':0, 'action':self.updateScript},
                 {'name':'Read POI', 'type':'action', 'action':self.updateScript},
+                {'name':'Pooled Covariance', 'key':'pooled', 'type':'bool', 'value':False, 'action':self.updateScript},
                 {'name':'Generate Templates', 'type':'action', 'action':util.Command(self.runScriptFunction.emit, "generateTemplates")}
             ]},
         ])
@@ -170,21 +237,26 @@ class ProfilingTemplate(AlgorithmsBase, Plugin):
             self.importsAppend("from chipwhisperer.analyzer.utils.Partition import %s" % poidata["partitiontype"])
 
         profilingPath = sys.modules[self.profiling.__module__].__name__ + '.' + self.profiling.__name__
-        self.addFunction('generateTemplates', profilingPath + '.generate', 'self.getTraceSource(), tRange, poiList, partMethod', 'templatedata', "")
+        self.addFunction('generateTemplates', profilingPath + '.generate', self.generateArguments(), 'templatedata', "")
 
         #Save template data to project
         self.addFunction('generateTemplates', 'saveTemplatesToProject', 'tRange, templatedata', 'tfname')
 
         self.scriptsUpdated.emit()
 
+    def generateArguments(self):
+        """Arguments of the generate() call in the template generation script"""
+        pooled = self.findParam(["Generate New Template", 'pooled']).getValue()
+        return 'self.getTraceSource(), tRange, poiList, partMethod, pooled=%s' % pooled
+
     def saveTemplatesToProject(self, trange, templatedata):
-        cfgsec = self.project().addDataConfig(sectionName="Template Data", subsectionName="Templates")
+        cfgsec = self.project().addDataConfig(sectionName="Template Data", subsectionName=self._templateSubsection)
         cfgsec["tracestart"] = trange[0]
         cfgsec["traceend"] = trange[1]
         cfgsec["poi"] = templatedata["poi"]
         cfgsec["partitiontype"] = templatedata["partitiontype"]
 
-        fname = self.project().getDataFilepath('templates-%s-%d-%d.npz' % (cfgsec["partitiontype"], trange[0], trange[1]), 'analysis')
+        fname = self.project().getDataFilepath('%s-%s-%d-%d.npz' % (self._templatePrefix, cfgsec["partitiontype"], trange[0], trange[1]), 'analysis')
 
         # Save template file
         np.savez(fname["abs"], **templatedata)  # mean=self.profiling.templateMeans, cov=self.profiling.templateCovs)
@@ -196,7 +268,7 @@ class ProfilingTemplate(AlgorithmsBase, Plugin):
 
     def loadTemplatesFromProject(self):
         # Load Template
-        foundsecs = self.project().getDataConfig(sectionName="Template Data", subsectionName="Templates")
+        foundsecs = self.project().getDataConfig(sectionName="Template Data", subsectionName=self._templateSubsection)
         templates = []
 
         for f in foundsecs:
@@ -226,83 +298,76 @@ class ProfilingTemplate(AlgorithmsBase, Plugin):
 
         return poiList
 
-    def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None):
-        data = []
-        textins = []
-        textouts = []
-
-        for i in range(tracerange[0], tracerange[1]+1):
-            d = traceSource.getTrace(i)
-
-            if d is None:
-                continue
-
-            startingPoint, endingPoint = pointRange  # TODO:support start/end point different per byte
-            d = d[startingPoint:endingPoint]
-
-            data.append(d)
-            textins.append(traceSource.getTextin(i))
-            textouts.append(traceSource.getTextout(i))
-
-        try:
-            from scipy.stats import multivariate_normal
-        except ImportError:
-            raise Warning("Version of SciPy too old, require >= 0.14, have %s. "
-                          "Update to support this attack" % (scipy.version.version))
+    def partitionTable(self, ptype, bnum, textins, textouts):
+        """Return the partition each key guess predicts for each trace, as a (guesses x traces) index table"""
+        numtraces = len(textins)
+        if ptype in ("PartitionHWIntermediate", "PartitionHDLastRound"):
+            self.model.setHwModel(self.model.LEAK_HW_SBOXOUT_FIRSTROUND)
+            return np.asarray(self.model.leakageBatch(textins, textouts, bnum, None), dtype=np.intp)
+        elif ptype == "PartitionIntermediate":
+            pt = np.asarray(textins, dtype=np.uint8)
+            guesses = np.arange(self.model.getPermPerSubkey(), dtype=np.uint8)[:, None]
+            return SBOX_TABLE[pt[:, bnum] ^ guesses].astype(np.intp)
+        # TODO Temp
+        elif ptype == "PartitionHDRounds":
+            pt = np.asarray(textins, dtype=np.uint8)
+            guesses = np.arange(self.model.getPermPerSubkey(), dtype=np.uint8)[:, None]
+            if bnum == 0:
+                st = pt[:, bnum] ^ guesses
+            else:
+                knownkey = [0x2b, 0x7e, 0x15, 0x16, 0x28, 0xae, 0xd2, 0xa6, 0xab, 0xf7, 0x15, 0x88, 0x09, 0xcf, 0x4f, 0x3c]
+                st = (pt[:, bnum - 1] ^ knownkey[bnum - 1]) ^ pt[:, bnum] ^ guesses
+            return self.model.HW_TABLE[st].astype(np.intp)
+        else:
+            return np.repeat(np.arange(self.model.getPermPerSubkey(), dtype=np.intp)[:, None], numtraces, axis=1)
 
+    def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None):
         # Hack for now - just use last template found
         template = self.loadTemplatesFromProject()[-1]
         pois = template["poi"]
-        numparts = len(template['mean'][0])
+        ptype = template["partitiontype"]
+        numtraces = tracerange[1] - tracerange[0] + 1
         results = np.zeros((self.model.getNumSubKeys(), self.model.getPermPerSubkey()))
 
+        # Only the variances of the templates are used: the points are treated as independent
+        matchers = [None] * self.model.getNumSubKeys()
+        for bnum in self.brange:
+            try:
+                matchers[bnum] = TemplateLogLikelihood(template['mean'][bnum], [np.diag(np.diag(c)) for c in template['cov'][bnum]])
+            except np.linalg.LinAlgError as e:
+                logging.warning('Error in applying template, probably template is poorly formed or POI incorrect. Byte %d skipped.' % bnum)
+                logging.debug(e)
+
         if progressBar:
             progressBar.setStatusMask("Current Trace = %d Current Subkey = %d", (0, 0))
-            progressBar.setMaximum(self.model.getNumSubKeys() * len(data))
+            progressBar.setMaximum(self.model.getNumSubKeys() * numtraces)
         pcnt = 0
 
-        for tnum in range(0, len(data)):
+        tdone = 0
+        for bstart in range(tracerange[0], tracerange[1] + 1, self._reportingInterval):
+            bend = min(bstart + self._reportingInterval, tracerange[1] + 1)
+            traces, textins, textouts, _ = self.loadTraceBlock(traceSource, bstart, bend)
+            tdone += len(traces)
+
+            if len(traces) > 0:
+                startingPoint, endingPoint = pointRange  # TODO:support start/end point different per byte
+                traces = traces[:, startingPoint:endingPoint]
+
             for bnum in self.brange:
-                try:
-                    newresultsint = [multivariate_normal.logpdf(data[tnum][pois[bnum]], mean=template['mean'][bnum][i], cov=np.diag(template['cov'][bnum][i])) for i in range(0, numparts)]
-                except np.linalg.LinAlgError as e:
-                    logging.warning('Error in applying template, probably template is poorly formed or POI incorrect. Byte %d for tnum %d skipped.' % (bnum, tnum))
-                    logging.debug(e)
-                    newresultsint = [0] * self.model.getPermPerSubkey()
-
-                ptype = template["partitiontype"]
-
-                newresults = []
-                # Map to key guess format
-                for i in range(0, self.model.getPermPerSubkey()):
-                    if ptype == "PartitionHWIntermediate":
-                        self.model.setHwModel(self.model.LEAK_HW_SBOXOUT_FIRSTROUND)
-                        hypint = self.model.leakage(textins[tnum], textouts[tnum], i, bnum, None)
-                    elif ptype == "PartitionHDLastRound":
-                        self.model.setHwModel(self.model.LEAK_HW_SBOXOUT_FIRSTROUND)
-                        hypint = self.model.leakage(textins[tnum], textouts[tnum], i, bnum, None)
-                    # TODO Temp
-                    elif ptype == "PartitionHDRounds":
-                        if bnum == 0:
-                            hypint = self.model.getHW(textins[tnum][bnum] ^ i)
-                        else:
-                            knownkey = [0x2b, 0x7e, 0x15, 0x16, 0x28, 0xae, 0xd2, 0xa6, 0xab, 0xf7, 0x15, 0x88, 0x09, 0xcf, 0x4f, 0x3c]
-                            s1 = textins[tnum][bnum - 1] ^ knownkey[bnum - 1]
-                            s2 = textins[tnum][bnum] ^ i
-                            hypint = self.model.getHW(s1 ^ s2)
-                    else:
-                        hypint = i
-                    newresults.append(newresultsint[hypint])
-
-                results[bnum] += newresults
-                self.stats.updateSubkey(bnum, results[bnum], tnum=(tnum + 1))
-
-                pcnt += 1
+                if matchers[bnum] is not None and len(traces) > 0:
+                    # Score every trace against every partition, then pick the partition each guess predicts
+                    scores = matchers[bnum].logpdf(traces[:, pois[bnum]])
+                    parts = self.partitionTable(ptype, bnum, textins, textouts)
+                    results[bnum] += scores[np.arange(len(traces))[None, :], parts].sum(axis=1)
+
+                self.stats.updateSubkey(bnum, results[bnum], tnum=tdone)
+
+                pcnt += bend - bstart
                 if progressBar:
-                    progressBar.updateStatus(pcnt, (tnum, bnum))
+                    progressBar.updateStatus(pcnt, (bend - 1, bnum))
                     if progressBar.wasAborted():
                         return
 
             # Do plotting if required
-            if (tnum % self._reportingInterval) == 0 and self.sr:
+            if self.sr:
                 self.sr()
@@ -47,18 +47,28 @@ class NormBase(object):
     def loadZFile(self, f):
         pass
 
+    def processBlock(self, traces, start):
+        """Normalize a 2-D block of traces, the first being trace number start"""
+        return np.array([self.processTrace(t, start + i) for i, t in enumerate(traces)])
+
 
 class NormMean(NormBase):
     """Normalize by mean (e.g. make traces zero-mean)"""
     def processTrace(self, t, tindex):
         return t - np.mean(t)
 
+    def processBlock(self, traces, start):
+        return traces - np.mean(traces, axis=1)[:, None]
+
 
 class NormMeanStd(NormBase):
     """Normalize by mean & std-dev """
     def processTrace(self, t, tindex):
         return (t - np.mean(t)) / np.std(t)
 
+    def processBlock(self, traces, start):
+        return (traces - np.mean(traces, axis=1)[:, None]) / np.std(traces, axis=1)[:, None]
+
 
 try:
     from PySide.QtGui import *
@@ -109,6 +119,21 @@ try:
                 f2 = np.polyval(self.f2coeff, self.zdata[tindex])
 
             return (t - f1) / f2
+
+        def processBlock(self, traces, start):
+            z = self.zdata[start:start + len(traces)]
+
+            if isinstance(self.f1coeff, (int, long)) and self.f1coeff == 0:
+                f1 = 0
+            else:
+                f1 = np.polyval(self.f1coeff, z)[:, None]
+
+            if isinstance(self.f2coeff, (int, long)) and self.f2coeff == 1:
+                f2 = 1
+            else:
+                f2 = np.polyval(self.f2coeff, z)[:, None]
+
+            return (traces - f1) / f2
 except:
     class NormLinFunc(NormBase):
         pass
@@ -229,6 +254,12 @@ class Normalize(PreprocessingBase):
         else:
             return self._traceSource.getTrace(n)
 
+    def getTraces(self, start, end):
+        if self.enabled:
+            return self.processBlock(start, end, self.norm.processBlock)
+        else:
+            return self._traceSource.getTraces(start, end)
+
     # def init(self):
     #    if self.ptEnd == 0:
     #        points = np.shape(self.trace().getTrace(0))[0]
@@ -26,6 +26,8 @@
 #=================================================
 import logging
 
+import numpy as np
+
 from chipwhisperer.common.api.autoscript import AutoScript
 from chipwhisperer.common.utils.pluginmanager import Plugin
 from chipwhisperer.common.utils.tracesource import TraceSource, ActiveTraceObserver
@@ -43,6 +45,7 @@ class PreprocessingBase(TraceSource, ActiveTraceObserver, AutoScript, Plugin):
 
     def __init__(self, traceSource=None):
         self.enabled = False
+        self._project = None
         ActiveTraceObserver.__init__(self)
         TraceSource.__init__(self, self.getName())
         AutoScript.__init__(self)
@@ -60,6 +63,12 @@ class PreprocessingBase(TraceSource, ActiveTraceObserver, AutoScript, Plugin):
     def updateScript(self, ignored=None):
         pass
 
+    def setProject(self, proj):
+        self._project = proj
+
+    def project(self):
+        return self._project
+
     def getEnabled(self):
         """Return if it is enable or not"""
         return self.enabled
@@ -79,6 +88,43 @@ class PreprocessingBase(TraceSource, ActiveTraceObserver, AutoScript, Plugin):
         else:
             return self._traceSource.getTrace(n)
 
+    def getTraces(self, start, end):
+        """Get traces start to end-1 as a 2-D array. Modules which can work on a whole block at once override this
+        using processBlock(), by default every trace is processed separately through getTrace()"""
+        if self.enabled:
+            return TraceSource.getTraces(self, start, end)
+        else:
+            return self._traceSource.getTraces(start, end)
+
+    def getRawTraces(self, start, end):
+        if self.enabled:
+            return TraceSource.getRawTraces(self, start, end)
+        else:
+            return self._traceSource.getRawTraces(start, end)
+
+    def getTraceScale(self):
+        if self.enabled:
+            return TraceSource.getTraceScale(self)
+        else:
+            return self._traceSource.getTraceScale()
+
+    def setReadRange(self, start, end):
+        if self._traceSource:
+            self._traceSource.setReadRange(start, end)
+
+    def processBlock(self, start, end, func):
+        """Get source traces start to end-1 and return func(traces, start) applied to them as one 2-D block.
+        If the source couldn't provide some traces (returned None), the others are passed to func one by one."""
+        traces = self._traceSource.getTraces(start, end)
+        if traces.dtype != object:
+            return func(traces, start)
+
+        out = np.empty(len(traces), dtype=object)
+        for i, trace in enumerate(traces):
+            if trace is not None:
+                out[i] = func(np.asarray(trace)[None, :], start + i)[0]
+        return out
+
     def getTextin(self, n):
         """Get text-in number n"""
         return self._traceSource.getTextin(n)
@@ -91,6 +137,18 @@ class PreprocessingBase(TraceSource, ActiveTraceObserver, AutoScript, Plugin):
         """Get known-key number n"""
         return self._traceSource.getKnownKey(n)
 
+    def getTextins(self, start, end):
+        """Get text-ins start to end-1"""
+        return self._traceSource.getTextins(start, end)
+
+    def getTextouts(self, start, end):
+        """Get text-outs start to end-1"""
+        return self._traceSource.getTextouts(start, end)
+
+    def getKnownKeys(self, start, end):
+        """Get known-keys start to end-1"""
+        return self._traceSource.getKnownKeys(start, end)
+
     def getSampleRate(self):
         """Get the Sample Rate"""
         return self._traceSource.getSampleRate()
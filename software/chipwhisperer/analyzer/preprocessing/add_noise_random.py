@@ -60,3 +60,9 @@ class AddNoiseRandom(PreprocessingBase):
                 return trace + np.random.normal(scale=self._maxNoise, size=len(trace))
         else:
             return self._traceSource.getTrace(n)
+
+    def getTraces(self, start, end):
+        if self.enabled and self._maxNoise != 0:
+            return self.processBlock(start, end, lambda traces, _: traces + np.random.normal(scale=self._maxNoise, size=traces.shape))
+        else:
+            return self._traceSource.getTraces(start, end)
@@ -0,0 +1,242 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2016, NewAE Technology Inc
+# All rights reserved.
+#
+# Author: Colin O'Flynn
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.assembla.com/spaces/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+
+import glob
+import hashlib
+import logging
+import os
+import re
+import sys
+
+import numpy as np
+
+from ._base import PreprocessingBase
+from chipwhisperer.common.utils.parameter import setupSetParam
+
+
+class CacheTraces(PreprocessingBase):
+    """
+    Stores the output of the previous preprocessing modules in a memory-mapped file in the project, so
+    expensive modules (e.g. resync) only run once per trace. The cache is keyed by the settings of all
+    upstream modules and by the trace segments, a change to either starts a new cache. The files of each
+    Cache module are named after it (see cacheName()), so it only ever deletes its own.
+    """
+    _name = "Cache"
+    _description = "Store the output of the previous preprocessing modules on disk, so each trace is only "\
+                   "processed once even across attacks, trace plots and analyzer sessions."
+
+    #Values of the per-trace state file
+    MISSING = 0
+    CACHED = 1
+    NONE = 2
+
+    def __init__(self, traceSource=None):
+        PreprocessingBase.__init__(self, traceSource)
+        self._key = None
+        self._traces = None
+        self._state = None
+        self._cacheName = ""
+        self.params.addChildren([
+            {'name':'Cache Name', 'key':'cachename', 'type':'str', 'get':self.getCacheName, 'set':self.setCacheName, 'action':self.updateScript},
+            {'name':'Clear Cache', 'key':'clear', 'type':'action', 'action':lambda _: self.clearCache()}
+        ])
+        self.updateScript()
+
+    def updateScript(self, _=None):
+        self.addFunction("init", "setProject", "UserScript.api.project()", loc=0)
+        self.addFunction("init", "setEnabled", "%s" % self.findParam('enabled').getValue())
+        self.addFunction("init", "setCacheName", "%r" % self.getCacheName())
+
+    def getCacheName(self):
+        return self._cacheName
+
+    @setupSetParam("Cache Name")
+    def setCacheName(self, name):
+        """Set the name of the cache files of this module, for several chains with the same modules. If empty the
+        name is made from the classes of the upstream modules."""
+        self._cacheName = name
+        self._close()
+
+    def cacheName(self):
+        """Return the name the cache files of this module start with"""
+        if self._cacheName:
+            return re.sub(r'[^A-Za-z0-9_]', '_', self._cacheName)
+        chain = []
+        source = self._traceSource
+        while isinstance(source, PreprocessingBase):
+            chain.append(source.__class__.__name__)
+            source = source.getTraceSource()
+        return hashlib.sha1(repr(chain)).hexdigest()[:8]
+
+    def processTraces(self):
+        """Source traces changed: work out the key again on next access"""
+        self._close()
+
+    def cacheKey(self):
+        """Return a hash of the settings of all upstream modules and of the trace segments"""
+        settings = []
+        source = self._traceSource
+        while isinstance(source, PreprocessingBase):
+            settings.append(self._moduleSettings(source))
+            source = source.getTraceSource()
+        settings.append(self._segmentSettings(source))
+        return hashlib.sha1(repr(settings)).hexdigest()
+
+    @staticmethod
+    def _moduleSettings(module):
+        """Settings of a preprocessing module: its script statements, plus any plain attributes set directly"""
+        settings = [sys.modules[module.__class__.__module__].__name__ + "." + module.__class__.__name__,
+                    module.getImportStatements(), module.getStatements('init')]
+        for name, value in sorted(vars(module).items()):
+            if value is None or isinstance(value, (bool, int, long, float, basestring)):
+                settings.append((name, value))
+            elif isinstance(value, (tuple, list)) and all(isinstance(v, (bool, int, long, float, basestring)) for v in value):
+                settings.append((name, tuple(value)))
+            elif isinstance(value, np.ndarray) and not isinstance(value, np.memmap):
+                settings.append((name, value.shape, str(value.dtype), hashlib.sha1(np.ascontiguousarray(value)).hexdigest()))
+            elif not isinstance(value, dict):
+                settings.append((name, value.__class__.__name__))
+        return settings
+
+    @staticmethod
+    def _segmentSettings(source):
+        if source is None:
+            return None
+        if hasattr(source, "traceSegments"):
+            return [(t.config.configFilename(), t.numTraces()) for t in source.traceSegments if t.enabled]
+        return [source.numTraces(), source.numPoints()]
+
+    def cacheFilepath(self, key, suffix):
+        """Return the absolute path of a cache file of this module, or None if there is no project to store it in"""
+        if self.project() is None:
+            return None
+        fname = "preprocessing-cache-%s-%s-%s.npy" % (self.cacheName(), key, suffix)
+        return self.project().getDataFilepath(fname, 'analysis')["abs"]
+
+    def clearCache(self):
+        """Delete the cache files of this module"""
+        self._close()
+        path = self.cacheFilepath("*", "*")
+        if path is not None:
+            for fname in glob.glob(path):
+                os.remove(fname)
+
+    def _close(self):
+        self._key = None
+        self._traces = None
+        self._state = None
+
+    def _open(self, width=None):
+        """Open the cache files for the current settings. They are created once the trace width is known, stale
+        caches of this module from other settings are deleted at that point. Returns False if traces can't be
+        cached."""
+        # Upstream settings may be changed without the traces changed signal (e.g. directly from a script)
+        key = self.cacheKey()
+        if key != self._key:
+            self._close()
+            self._key = key
+        if self._traces is not None:
+            return True
+
+        tracefile = self.cacheFilepath(self._key, "traces")
+        statefile = self.cacheFilepath(self._key, "state")
+        if tracefile is None:
+            return False
+
+        if os.path.isfile(tracefile) and os.path.isfile(statefile):
+            self._traces = np.lib.format.open_memmap(tracefile, mode='r+')
+            self._state = np.lib.format.open_memmap(statefile, mode='r+')
+            return True
+
+        if width is None:
+            return False
+
+        for fname in glob.glob(self.cacheFilepath("*", "*")):
+            if os.path.basename(fname) not in (os.path.basename(tracefile), os.path.basename(statefile)):
+                os.remove(fname)
+
+        numTraces = self._traceSource.numTraces()
+        logging.info("Creating preprocessing cache %s for %d traces" % (tracefile, numTraces))
+        self._traces = np.lib.format.open_memmap(tracefile, mode='w+', dtype=np.float64, shape=(numTraces, width))
+        self._state = np.lib.format.open_memmap(statefile, mode='w+', dtype=np.uint8, shape=(numTraces,))
+        return True
+
+    def _fill(self, start, end):
+        """Run the upstream modules on traces start to end-1 and store their output, returns the output"""
+        traces = self._traceSource.getTraces(start, end)
+        if traces.dtype == object:
+            rows = [(i, t) for i, t in enumerate(traces) if t is not None]
+        else:
+            rows = list(enumerate(traces))
+
+        if self._traces is None and not (rows and self._open(len(rows[0][1]))):
+            return traces
+
+        self._state[start:end] = self.NONE
+        if traces.dtype == object:
+            for i, t in rows:
+                self._traces[start + i] = t
+        else:
+            self._traces[start:end] = traces
+        self._state[start:end][[i for i, _ in rows]] = self.CACHED
+        self._traces.flush()
+        self._state.flush()
+        return traces
+
+    def _cached(self, start, end):
+        """Return traces start to end-1 from the cache, computing missing ones first"""
+        if not self._open():
+            #Cache doesn't exist yet, the first block computed decides its width
+            traces = self._fill(start, end)
+            if self._traces is None:
+                return traces
+
+        missing = np.flatnonzero(self._state[start:end] == self.MISSING)
+        if len(missing):
+            self._fill(start + missing[0], start + missing[-1] + 1)
+
+        traces = self._traces[start:end]
+        traces.flags.writeable = False
+        state = self._state[start:end]
+        if (state == self.NONE).any():
+            out = np.empty(len(traces), dtype=object)
+            for i in np.flatnonzero(state == self.CACHED):
+                out[i] = traces[i]
+            traces = out
+        return traces
+
+    def getTrace(self, n):
+        if self.enabled:
+            return self._cached(n, n + 1)[0]
+        else:
+            return self._traceSource.getTrace(n)
+
+    def getTraces(self, start, end):
+        if self.enabled:
+            return self._cached(start, end)
+        else:
+            return self._traceSource.getTraces(start, end)
@@ -63,6 +63,12 @@ class DecimationFixed(PreprocessingBase):
         else:
             return self._traceSource.getTrace(n)
 
+    def getTraces(self, start, end):
+        if self.enabled:
+            return self.processBlock(start, end, lambda traces, _: np.array(traces[:, ::self._decfactor], dtype=np.float64))
+        else:
+            return self._traceSource.getTraces(start, end)
+
     def numPoints(self):
         if self.enabled:
             return len(range(0, self._traceSource.numPoints(), self._decfactor))
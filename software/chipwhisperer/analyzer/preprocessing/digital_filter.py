@@ -85,3 +85,9 @@ class Filter(PreprocessingBase):
             return signal.lfilter(self.b, self.a, trace)
         else:
             return self._traceSource.getTrace(n)
+
+    def getTraces(self, start, end):
+        if self.enabled:
+            return self.processBlock(start, end, lambda traces, _: signal.lfilter(self.b, self.a, traces, axis=1))
+        else:
+            return self._traceSource.getTraces(start, end)
@@ -46,8 +46,11 @@ class ResyncSAD(PreprocessingBase):
         self.ccEnd = 1
         self.wdStart = 0
         self.wdEnd = 1
+        self.method = "SAD"
 
         self.params.addChildren([
+            {'name':'Match Criteria', 'key':'method', 'type':'list', 'values':{"Sum of Absolute Difference":"SAD", "Sum of Squared Difference (FFT)":"SSD"},
+                                                                     'value':"SAD", 'action':self.updateScript},
             {'name':'Ref Trace', 'key':'reftrace', 'type':'int', 'value':0, 'action':self.updateScript},
             {'name':'Reference Points', 'key':'refpts', 'type':'rangegraph', 'graphwidget':ResultsBase.registeredObjects["Trace Output Plot"],
                                                                      'action':self.updateScript, 'value':(0, 0), 'default':(0, 0)},
@@ -68,6 +71,7 @@ class ResyncSAD(PreprocessingBase):
 
     def updateScript(self, _=None):
         self.addFunction("init", "setEnabled", "%s" % self.findParam('enabled').getValue())
+        self.addFunction("init", "setMethod", "'%s'" % self.findParam('method').getValue())
 
         refpt = self.findParam('refpts').getValue()
         windowpt = self.findParam('windowpt').getValue()
@@ -87,6 +91,12 @@ class ResyncSAD(PreprocessingBase):
         self.ccEnd = refpoints[1]
         self.init()
 
+    def setMethod(self, method="SAD"):
+        """Match with the sum of absolute differences ('SAD'), or the sum of squared differences computed by
+        FFT correlation ('SSD'), which is much faster for long references"""
+        self.method = method
+        self.init()
+
     def setOutputSad(self, enabled):
         self.debugReturnSad = enabled
    
@@ -95,31 +105,50 @@ class ResyncSAD(PreprocessingBase):
             trace = self._traceSource.getTrace(n)
             if trace is None:
                 return None
-            sad = self.findSAD(trace)
-            
+
             if self.debugReturnSad:
-                return sad
-            
-            if len(sad) == 0:
-                return None            
-            
-            newmaxloc = np.argmin(sad)
-            maxval = min(sad)
-            #if (maxval > self.refmaxsize * 1.01) | (maxval < self.refmaxsize * 0.99):
-            #    return None
-            
-            if maxval > self.maxthreshold:
-                return None
-            
-            diff = newmaxloc-self.refmaxloc
-            if diff < 0:
-                trace = np.append(np.zeros(-diff), trace[:diff])
-            elif diff > 0:
-                trace = np.append(trace[diff:], np.zeros(diff))
-            return trace
+                return self.findSAD(trace)
+
+            return self.resyncBlock(np.asarray(trace)[None, :], n)[0]
         else:
             return self._traceSource.getTrace(n)
-   
+
+    def getTraces(self, start, end):
+        if self.enabled and not self.debugReturnSad:
+            return self.processBlock(start, end, self.resyncBlock)
+        else:
+            return PreprocessingBase.getTraces(self, start, end)
+
+    def resyncBlock(self, traces, start=0):
+        """Shift each trace of a 2-D block to line up with the reference. Traces which don't match the reference
+        well enough come back as None, in which case the result is a 1-D array of objects."""
+        sad = self.findSAD(traces)
+        npoints = traces.shape[1]
+
+        if sad.shape[1] == 0:
+            valid = np.zeros(len(traces), dtype=bool)
+            diff = np.zeros(len(traces), dtype=int)
+        else:
+            newmaxloc = np.argmin(sad, axis=1)
+            maxval = np.min(sad, axis=1)
+            #if (maxval > self.refmaxsize * 1.01) | (maxval < self.refmaxsize * 0.99):
+            #    return None
+            valid = maxval <= self.maxthreshold
+            diff = newmaxloc - self.refmaxloc
+
+        #Shift by diff, padding with zeros
+        idx = np.arange(npoints)[None, :] + diff[:, None]
+        inrange = (idx >= 0) & (idx < npoints)
+        out = np.where(inrange, np.take_along_axis(traces, np.clip(idx, 0, npoints - 1), axis=1), 0.0)
+
+        if valid.all():
+            return out
+
+        result = np.empty(len(traces), dtype=object)
+        for i in np.flatnonzero(valid):
+            result[i] = out[i]
+        return result
+
     def init(self):
         try:
             self.calcRefTrace(self.rtrace)
@@ -129,14 +158,40 @@ class ResyncSAD(PreprocessingBase):
             pass
         
     def findSAD(self, inputtrace):
+        """Return the match criteria for every offset of the reference inside the input window. Works on a single
+        trace, or on a 2-D block of traces giving one row per trace."""
+        traces = np.asarray(inputtrace, dtype=np.float64)
+        if traces.ndim == 1:
+            return self.findSAD(traces[None, :])[0]
+
         reflen = self.ccEnd-self.ccStart
-        sadlen = self.wdEnd-self.wdStart
-        sadarray = np.empty(sadlen-reflen)
-        
-        for ptstart in range(self.wdStart, self.wdEnd-reflen):
-            #Find SAD        
-            sadarray[ptstart-self.wdStart] = np.sum(np.abs(inputtrace[ptstart:(ptstart+reflen)] - self.reftrace))
-            
+        nshifts = max(self.wdEnd - self.wdStart - reflen, 0)
+        window = traces[:, self.wdStart:self.wdEnd]
+        ref = np.asarray(self.reftrace, dtype=np.float64)
+        sadarray = np.empty((len(traces), nshifts))
+
+        if nshifts == 0:
+            return sadarray
+
+        if self.method == "SSD":
+            #sum((x-r)^2) = sum(x^2) - 2*sum(x*r) + sum(r^2), with the cross term done as an FFT correlation
+            nfft = 1 << int(np.ceil(np.log2(window.shape[1] + reflen)))
+            corr = np.fft.irfft(np.fft.rfft(window, nfft, axis=1) * np.fft.rfft(ref[::-1], nfft), nfft, axis=1)
+            corr = corr[:, reflen - 1:reflen - 1 + nshifts]
+            energy = np.cumsum(np.square(window), axis=1)
+            energy = np.concatenate([np.zeros((len(traces), 1)), energy], axis=1)
+            energy = energy[:, reflen:reflen + nshifts] - energy[:, :nshifts]
+            sadarray[:] = energy - 2 * corr + np.sum(np.square(ref))
+        else:
+            #Slide the reference over a strided view of all offsets, a few traces at a time to bound memory use
+            stride = window.strides
+            chunk = max(1, (1 << 18) // (nshifts * reflen))
+            for i in range(0, len(traces), chunk):
+                part = window[i:i + chunk]
+                slides = np.lib.stride_tricks.as_strided(part, shape=(len(part), nshifts, reflen),
+                                                         strides=(stride[0], stride[1], stride[1]))
+                sadarray[i:i + chunk] = np.sum(np.abs(slides - ref), axis=2)
+
         return sadarray
         
     def calcRefTrace(self, tnum):
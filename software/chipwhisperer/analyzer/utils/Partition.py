@@ -28,10 +28,12 @@
 import copy
 import logging
 import random
+import threading
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 from chipwhisperer.analyzer.attacks.models.aes.funcs import sbox, inv_sbox
-from chipwhisperer.analyzer.attacks.models.AES128_8bit import AES128_8bit
+from chipwhisperer.analyzer.attacks.models.AES128_8bit import AES128_8bit, SBOX_TABLE, INV_SBOX_TABLE
 from chipwhisperer.analyzer.attacks.models.aes.key_schedule import keyScheduleRounds
 from chipwhisperer.common.utils.parameter import Parameterized
 
@@ -41,6 +43,9 @@ class PartitionHDLastRound(object):
     sectionName = "Partition Based on HD of Last Round"
     partitionType = "HD AES Last-Round"
 
+    def __init__(self):
+        self._roundKeys = {}
+
     def getNumPartitions(self):
         return 9
 
@@ -63,6 +68,24 @@ class PartitionHDLastRound(object):
             guess[i] = AES128_8bit.getHW(st9 ^ st10)
         return guess
 
+    def getPartitionNums(self, trace, start, end):
+        keys = trace.getKnownKeys(start, end)
+        ct = np.asarray(trace.getTextouts(start, end), dtype=np.uint8).reshape(end - start, -1)
+
+        # Expanding the key is slow and most trace sets use few keys, so do it once per distinct key
+        rkeys = np.empty((end - start, 16), dtype=np.uint8)
+        for i, key in enumerate(keys):
+            if len(key) != 16:
+                raise ValueError("Need to implement for selected AES")
+            keybytes = bytes(bytearray(key))
+            if keybytes not in self._roundKeys:
+                self._roundKeys[keybytes] = keyScheduleRounds(list(bytearray(keybytes)), 0, 10)
+            rkeys[i] = self._roundKeys[keybytes]
+
+        st9 = INV_SBOX_TABLE[ct[:, :16] ^ rkeys]
+        st10 = ct[:, AES128_8bit.INVSHIFT]
+        return AES128_8bit.HW_TABLE[st9 ^ st10]
+
 
 class PartitionHWIntermediate(object):
 
@@ -82,6 +105,30 @@ class PartitionHWIntermediate(object):
 
         return guess
 
+    def getPartitionNums(self, trace, start, end):
+        keys = np.array(trace.getKnownKeys(start, end), dtype=np.uint8).reshape(end - start, -1)
+        text = np.asarray(trace.getTextins(start, end), dtype=np.uint8).reshape(end - start, -1)
+        return AES128_8bit.HW_TABLE[SBOX_TABLE[text[:, :16] ^ keys[:, :16]]]
+
+
+class PartitionIntermediate(object):
+
+    sectionName = "Partition Based on Value of Intermediate"
+    partitionType = "AES Intermediate Value"
+
+    def getNumPartitions(self):
+        return 256
+
+    def getPartitionNum(self, trace, tnum):
+        key = trace.getKnownKey(tnum)
+        text = trace.getTextin(tnum)
+        return [sbox(text[i] ^ key[i]) for i in range(0, 16)]
+
+    def getPartitionNums(self, trace, start, end):
+        keys = np.array(trace.getKnownKeys(start, end), dtype=np.uint8).reshape(end - start, -1)
+        text = np.asarray(trace.getTextins(start, end), dtype=np.uint8).reshape(end - start, -1)
+        return SBOX_TABLE[text[:, :16] ^ keys[:, :16]]
+
 
 class PartitionEncKey(object):
 
@@ -95,6 +142,9 @@ class PartitionEncKey(object):
         key = trace.getKnownKey(tnum)
         return key
 
+    def getPartitionNums(self, trace, start, end):
+        return np.array(trace.getKnownKeys(start, end), dtype=np.uint8).reshape(end - start, -1)
+
 
 class PartitionRandvsFixed(object):
 
@@ -107,6 +157,9 @@ class PartitionRandvsFixed(object):
     def getPartitionNum(self, trace, tnum):
         return [tnum % 2]
 
+    def getPartitionNums(self, trace, start, end):
+        return (np.arange(start, end) % 2).astype(np.uint8)[:, None]
+
 
 class PartitionRandDebug(object):
 
@@ -121,6 +174,137 @@ class PartitionRandDebug(object):
     def getPartitionNum(self, trace, tnum):
         return [random.randint(0, self.numRand - 1)]
 
+    def getPartitionNums(self, trace, start, end):
+        return np.array([[random.randint(0, self.numRand - 1)] for _ in range(start, end)], dtype=np.uint8).reshape(end - start, 1)
+
+
+class PartitionStats(object):
+    """
+    Streaming mean and variance of every point for each (subkey, partition), with the pairwise update of
+    Chan et al. Each block of traces is read once and scattered into all subkeys with one matrix product per
+    subkey. Statistics of different trace sets can be combined with merge().
+    """
+
+    def __init__(self, numKeys, numParts, numPoints):
+        self.n = np.zeros((numKeys, numParts), dtype=np.int64)
+        self.mean = np.zeros((numKeys, numParts, numPoints))
+        self.m2 = np.zeros((numKeys, numParts, numPoints))
+
+    def update(self, traces, partNums):
+        """Add a block of traces (traces x points) given the (traces x subkeys) partition numbers, -1 to skip a trace"""
+        traces = np.asarray(traces, dtype=np.float64)
+        partNums = np.asarray(partNums)
+        if len(traces) == 0:
+            return
+
+        # Centre the block first, so the sums of squares below don't cancel out for traces with a large offset
+        offset = np.mean(traces, axis=0)
+        centred = traces - offset
+        squared = np.square(centred)
+        parts = np.arange(self.n.shape[1])[:, None]
+
+        for bnum in range(0, self.n.shape[0]):
+            if self.n.shape[1] <= 16:
+                # Few partitions: a one-hot matrix product is fastest
+                onehot = (partNums[:, bnum] == parts).astype(np.float64)
+                n = np.sum(onehot, axis=1).astype(np.int64)
+                sums = np.dot(onehot, centred)
+                sumsq = np.dot(onehot, squared)
+            else:
+                # Many partitions: sort the block by partition and sum each run
+                valid = np.nonzero(partNums[:, bnum] >= 0)[0]
+                order = valid[np.argsort(partNums[valid, bnum], kind='mergesort')]
+                found, starts, counts = np.unique(partNums[order, bnum], return_index=True, return_counts=True)
+                n = np.zeros(self.n.shape[1], dtype=np.int64)
+                sums = np.zeros((self.n.shape[1], centred.shape[1]))
+                sumsq = np.zeros((self.n.shape[1], centred.shape[1]))
+                if len(order) > 0:
+                    n[found] = counts
+                    sums[found] = np.add.reduceat(centred[order], starts, axis=0)
+                    sumsq[found] = np.add.reduceat(squared[order], starts, axis=0)
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = sums / n[:, None]
+            self._combine(bnum, n, mean + offset, sumsq - sums * mean)
+
+    def merge(self, other):
+        """Add all traces seen by another PartitionStats to this one"""
+        for bnum in range(0, self.n.shape[0]):
+            self._combine(bnum, other.n[bnum], other.mean[bnum], other.m2[bnum])
+
+    def _combine(self, bnum, n, mean, m2):
+        parts = np.nonzero(n)[0]
+        n = n[parts]
+        total = self.n[bnum, parts] + n
+        delta = mean[parts] - self.mean[bnum, parts]
+        weight = self.n[bnum, parts].astype(np.float64) * n / total
+
+        self.m2[bnum, parts] += m2[parts] + np.square(delta) * weight[:, None]
+        self.mean[bnum, parts] += delta * (n.astype(np.float64) / total)[:, None]
+        self.n[bnum, parts] = total
+
+    def stats(self):
+        """Return the statistics as used by the TraceExplorer: a dict of mean, variance and number"""
+        # TODO: Should be using population variance or sample variance (e.g. /n or /n-1)?
+        #      Since this is taken over very large sample sizes I imagine it won't matter
+        #      ultimately.
+        variance = self.m2 / np.maximum(self.n - 1, 1)[:, :, None]
+        return {"mean":self.mean, "variance":variance, "number":self.n}
+
+    @staticmethod
+    def accumulate(traceSource, partNums, start, numParts, workers=1, blockSize=512, progressBar=None):
+        """
+        Return the PartitionStats of traces start to start+len(partNums)-1. Blocks are read in order by one
+        thread and processed by the worker threads, each filling its own PartitionStats which are merged at the end.
+        """
+        numKeys = partNums.shape[1]
+        numPoints = traceSource.numPoints()
+        end = start + len(partNums)
+        results = {}
+        lock = threading.Lock()
+
+        def blocks():
+            traceSource.setReadRange(start, end)
+            for bstart in range(start, end, blockSize):
+                bend = min(bstart + blockSize, end)
+                traces = traceSource.getTraces(bstart, bend)
+                nums = partNums[bstart - start:bend - start]
+
+                # Skip traces the source could not provide (e.g. a failed resync)
+                if traces.dtype == object:
+                    keep = [i for i, t in enumerate(traces) if t is not None]
+                    traces = np.array([traces[i] for i in keep]).reshape(len(keep), numPoints)
+                    nums = nums[keep]
+                yield traces, nums, bend
+
+        def process(block):
+            traces, nums, bend = block
+            with lock:
+                if threading.current_thread() not in results:
+                    results[threading.current_thread()] = PartitionStats(numKeys, numParts, numPoints)
+                stats = results[threading.current_thread()]
+            stats.update(traces, nums)
+            return bend
+
+        if progressBar:
+            progressBar.setMaximum(end - start)
+
+        pool = ThreadPool(workers) if workers > 1 else None
+        try:
+            for bend in (pool.imap(process, blocks()) if pool else (process(b) for b in blocks())):
+                if progressBar:
+                    progressBar.updateStatus(bend - start)
+                    if progressBar.wasAborted():
+                        return None
+        finally:
+            if pool:
+                pool.terminate()
+
+        total = PartitionStats(numKeys, numParts, numPoints)
+        for stats in results.values():
+            total.merge(stats)
+        return total
+
 
 class Partition(Parameterized):
     """
@@ -140,11 +324,12 @@ class Partition(Parameterized):
                     },
                 }
 
-    supportedMethods = [PartitionRandvsFixed, PartitionEncKey, PartitionRandDebug, PartitionHWIntermediate, PartitionHDLastRound]
+    supportedMethods = [PartitionRandvsFixed, PartitionEncKey, PartitionRandDebug, PartitionHWIntermediate, PartitionHDLastRound, PartitionIntermediate]
 
     def __init__(self):
         self.setPartMethod(PartitionRandvsFixed)
         self.partDataCache = None
+        self.partNumCache = None
 
     def setPartMethod(self, method):
         self.partMethodClass = method
@@ -167,46 +352,70 @@ class Partition(Parameterized):
 
         return partitionTable
 
+    def createTable(self, partNums, offset=0):
+        """
+        Convert a (traces x subkeys) partition matrix into the table of trace numbers used by the TraceExplorer,
+        partitionTable[subkey][partition] being an array of trace numbers (starting from offset)
+        """
+        num_parts = self.partMethod.getNumPartitions()
+        partitionTable = []
+        for j in range(0, partNums.shape[1]):
+            order = np.argsort(partNums[:, j], kind='mergesort')
+            counts = np.bincount(partNums[:, j], minlength=num_parts)
+            partitionTable.append(np.split(order + offset, np.cumsum(counts)[:-1]))
+        return partitionTable
+
+    def createMatrix(self, partitionTable, start, end):
+        """Inverse of createTable(): the (traces x subkeys) partition numbers of traces start to end-1, -1 where
+        the table doesn't list a trace"""
+        partNums = np.full((end - start, len(partitionTable)), -1, dtype=np.int16)
+        for j in range(0, len(partitionTable)):
+            for i, tlist in enumerate(partitionTable[j]):
+                tlist = np.asarray(tlist, dtype=np.int64)
+                tlist = tlist[(tlist >= start) & (tlist < end)]
+                partNums[tlist - start, j] = i
+        return partNums
+
     def loadPartitions(self, tRange=(0, -1)):
-        """Load partitions from trace files, convert to mapped range"""
+        """Load the partition matrix of every segment from its auxiliary data, or return None if a segment has none"""
         start = tRange[0]
         end = tRange[1]
 
         if end == -1:
             end = self._traces.numTraces()
 
-        # Generate blank partition table
-        partitionTable = self.createBlankTable(self._traces.getSegment(start))
-        logging.info(np.shape(partitionTable))
-
+        partNums = []
         tnum = start
         while tnum < end:
             t = self._traces.getSegment(tnum)
             # Discover where this trace starts & ends
             tmapstart = t.mappedRange[0]
-            tmapend = t.mappedRange[1]
-            tmapend = min(tmapend, end)
+            tmapend = min(t.mappedRange[1] + 1, end)
 
             partcfg = t.getAuxDataConfig(self.attrDictPartition)
-            # print partcfg
-            # print partcfg["filename"]
+            if partcfg is None:
+                return None
             partdata = t.loadAuxData(partcfg["filename"])
 
-            # Merge tables now - better way to do this?
-            for j in range(0, len(self.partMethod.getPartitionNum(t, 0))):
-                for i in range(0, self.partMethod.getNumPartitions()):
-                    partitionTable[j][i] = partitionTable[j][i] + partdata[j][i]
+            # Files from older versions hold a pickled table of trace numbers instead of the partition matrix
+            if partdata.dtype == object or partdata.ndim != 2:
+                logging.info('Partition data %s is in the old format, regenerating it' % partcfg["filename"])
+                return None
 
-            # print tmapstart
+            partNums.append(partdata[tnum - tmapstart:tmapend - tmapstart])
 
             # Next trace round
-            tnum = tmapend + 1
+            tnum = tmapend
 
-        return partitionTable
+        return np.concatenate(partNums)
 
     def getPartitionData(self):
         return self.partDataCache
 
+    def getPartitionNums(self):
+        """Return the (traces x subkeys) uint8 partition matrix from the last generatePartitions() call"""
+        return self.partNumCache
+
     def generatePartitions(self, partitionClass=None, saveFile=False, loadFile=False, tRange=(0, -1)):
         """
         Generate partitions, using previously setup setTraceManager & partition class, or if they are passed as
@@ -215,23 +424,19 @@ class Partition(Parameterized):
         if partitionClass:
             self.setPartMethod(partitionClass)
 
-        partitionTable = None
-
-        if loadFile:
-            partitionTable = self.loadPartitions(tRange)
-            raise AttributeError("WARNING: loadPartitions broken for split files, disabled for now")
-
         start = tRange[0]
         end = tRange[1]
 
-        num_keys=len(self.partMethod.getPartitionNum(self._traces.getSegment(start), 0))
-        num_parts=self.partMethod.getNumPartitions()
+        if end == -1:
+            end = self._traces.numTraces()
 
-        if partitionTable is None:
-            partitionTable = self.createBlankTable(num_keys, num_parts)
+        partNums = None
 
-            if end == -1:
-                end = self._traces.numTraces()
+        if loadFile:
+            partNums = self.loadPartitions((start, end))
+
+        if partNums is None:
+            partNums = []
 
             tnum = start
             while tnum < end:
@@ -239,34 +444,25 @@ class Partition(Parameterized):
                 # Discover where this trace starts & ends
                 tmapstart = t.mappedRange[0]
                 tmapend = t.mappedRange[1]
-                
-                partitionTableTemp = self.createBlankTable(num_keys, num_parts)
-
-                for tnum in range(tmapstart, tmapend + 1):
-                    # Check each trace, write partition number
-                    partNum = self.partMethod.getPartitionNum(t, tnum - tmapstart)
-                    for i, pn in enumerate(partNum):
-                        partitionTable[i][pn].append(tnum)
-                        partitionTableTemp[i][pn].append(tnum - tmapstart)
 
-                    # self.traceDone.emit(tnum)
+                # Partition numbers for the whole segment, as that is what gets saved along with it
+                segNums = self.partMethod.getPartitionNums(t, 0, tmapend - tmapstart + 1)
 
                 if saveFile:
-                    # Save partition table, reference it in config file
+                    # Save partition matrix, reference it in config file
                     newCfgDict = copy.deepcopy(self.attrDictPartition)
                     updatedDict = t.addAuxDataConfig(newCfgDict)
-                    t.saveAuxData(partitionTableTemp, updatedDict)
+                    t.saveAuxData(segNums, updatedDict)
 
-                # Debug - Dump Table
-                # for t in range(0, self.partMethod.getNumPartitions()):
-                #    print "Traces in %d:" % t
-                #    print "  ",
-                #    print partitionTable[0][t]
+                partNums.append(segNums[tnum - tmapstart:min(tmapend + 1, end) - tmapstart])
 
                 tnum = tmapend + 1
 
-        self.partDataCache = partitionTable
-        return partitionTable
+            partNums = np.concatenate(partNums)
+
+        self.partNumCache = partNums
+        self.partDataCache = self.createTable(partNums, start)
+        return self.partDataCache
 
     def setTraceSource(self, traces):
         self._traces = traces
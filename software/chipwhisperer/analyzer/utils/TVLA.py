@@ -0,0 +1,204 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.assembla.com/spaces/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+
+import numpy as np
+from scipy.special import comb
+
+from chipwhisperer.analyzer.utils.Partition import PartitionRandvsFixed
+
+
+class MomentAccumulator(object):
+    """
+    Streaming central moments of every trace point, up to a given order. Blocks of traces (and other
+    accumulators, see merge()) are combined with the pairwise update of Pebay, so no raw power sums are kept.
+    """
+
+    def __init__(self, maxOrder, numPoints):
+        self.maxOrder = maxOrder
+        self.n = 0
+        self.mean = np.zeros(numPoints)
+        # m[p] is the sum of (x - mean)^p over all traces, for p = 2..maxOrder
+        self.m = np.zeros((maxOrder + 1, numPoints))
+
+    def update(self, traces):
+        """Add a block of traces (traces x points)"""
+        traces = np.asarray(traces, dtype=np.float64)
+        if len(traces) == 0:
+            return
+
+        mean = np.mean(traces, axis=0)
+        centred = traces - mean
+        power = np.ones_like(centred)
+        m = np.zeros_like(self.m)
+        for p in range(1, self.maxOrder + 1):
+            power *= centred
+            if p >= 2:
+                m[p] = np.sum(power, axis=0)
+        self._combine(len(traces), mean, m)
+
+    def merge(self, other):
+        """Add all traces seen by another accumulator to this one"""
+        if other.n > 0:
+            self._combine(other.n, other.mean, other.m)
+
+    def _combine(self, n, mean, m):
+        if self.n == 0:
+            self.n = n
+            self.mean = np.array(mean, dtype=np.float64)
+            self.m = np.array(m, dtype=np.float64)
+            return
+
+        na = float(self.n)
+        nb = float(n)
+        total = na + nb
+        delta = mean - self.mean
+
+        new = np.zeros_like(self.m)
+        for p in range(2, self.maxOrder + 1):
+            new[p] = self.m[p] + m[p]
+            for k in range(1, p - 1):
+                new[p] += comb(p, k, exact=True) * delta ** k * ((-nb / total) ** k * self.m[p - k] + (na / total) ** k * m[p - k])
+            new[p] += (na * nb / total * delta) ** p * (1.0 / nb ** (p - 1) - (-1.0 / na) ** (p - 1))
+
+        self.m = new
+        self.mean += delta * (nb / total)
+        self.n += n
+
+    def centralMoment(self, p):
+        """Return the p-th (population) central moment of every point"""
+        if p == 1:
+            return np.zeros_like(self.mean)
+        return self.m[p] / self.n
+
+
+class TVLA(object):
+    """
+    Fixed-vs-random (or any two-partition) leakage assessment with univariate t-tests of order 1 to maxOrder,
+    as described by Schneider & Moradi, "Leakage Assessment Methodology" (CHES 2015). An order-d test needs
+    the central moments up to 2d of both sets, which are accumulated in a single pass over the traces.
+    """
+
+    def __init__(self, maxOrder=3, partMethod=None):
+        self.maxOrder = maxOrder
+        self.partMethod = partMethod if partMethod is not None else PartitionRandvsFixed()
+        if self.partMethod.getNumPartitions() != 2:
+            raise ValueError("Leakage assessment needs a partition method with two partitions")
+        self.sr = None
+        self._reportingInterval = 1000
+        self.clear()
+
+    def clear(self):
+        self.groups = None
+
+    def setReportingInterval(self, ri):
+        self._reportingInterval = ri
+
+    def setStatsReadyCallback(self, sr):
+        self.sr = sr
+
+    def update(self, traces, partitions):
+        """Add a block of traces (traces x points) with the partition (0 or 1) of each trace"""
+        traces = np.asarray(traces, dtype=np.float64)
+        partitions = np.asarray(partitions)
+        if self.groups is None:
+            self.groups = [MomentAccumulator(2 * self.maxOrder, traces.shape[1]) for _ in range(2)]
+        for i, group in enumerate(self.groups):
+            group.update(traces[partitions == i])
+
+    def merge(self, other):
+        """Add all traces seen by another TVLA object (e.g. run on another trace set) to this one"""
+        if other.groups is None:
+            return
+        if self.groups is None:
+            self.groups = [MomentAccumulator(2 * self.maxOrder, len(g.mean)) for g in other.groups]
+        for group, othergroup in zip(self.groups, other.groups):
+            group.merge(othergroup)
+
+    def addTraces(self, traceSource, tracerange, progressBar=None):
+        """
+        Add traces tracerange[0] to tracerange[1] (inclusive) of a trace source, reading blocks of the reporting
+        interval. The statistics ready callback is called after each block.
+        """
+        start = tracerange[0]
+        end = tracerange[1] + 1
+
+        if progressBar:
+            progressBar.setText("Leakage assessment: traces %d to %d" % (start, end - 1))
+            progressBar.setMaximum(end - start)
+
+        traceSource.setReadRange(start, end)
+        for bstart in range(start, end, self._reportingInterval):
+            bend = min(bstart + self._reportingInterval, end)
+            traces = traceSource.getTraces(bstart, bend)
+            partitions = self.partMethod.getPartitionNums(traceSource, bstart, bend)[:, 0]
+
+            # Skip traces the source could not provide (e.g. a failed resync)
+            if traces.dtype == object:
+                keep = [i for i, t in enumerate(traces) if t is not None]
+                traces = np.array([traces[i] for i in keep])
+                partitions = partitions[keep]
+
+            if len(traces) > 0:
+                self.update(traces, partitions)
+
+            if self.sr is not None:
+                self.sr()
+
+            if progressBar:
+                progressBar.updateStatus(bend - start)
+                if progressBar.wasAborted():
+                    return
+
+    def numTraces(self):
+        """Return the number of traces in each of the two sets"""
+        if self.groups is None:
+            return (0, 0)
+        return tuple(g.n for g in self.groups)
+
+    def tStatistic(self, order=1):
+        """Return Welch's t-statistic of every point for the given order (1: means, 2: variances, 3: skewness)"""
+        if order < 1 or order > self.maxOrder:
+            raise ValueError("Order must be between 1 and %d" % self.maxOrder)
+        if self.groups is None:
+            return None
+
+        stats = []
+        for g in self.groups:
+            cm2 = g.centralMoment(2)
+            if order == 1:
+                mean = g.mean
+                var = cm2
+            elif order == 2:
+                mean = cm2
+                var = g.centralMoment(4) - cm2 ** 2
+            else:
+                # Standardized moments for order 3 and above
+                mean = g.centralMoment(order) / cm2 ** (order / 2.0)
+                var = (g.centralMoment(2 * order) - g.centralMoment(order) ** 2) / cm2 ** order
+            stats.append((mean, var, g.n))
+
+        (mean0, var0, n0), (mean1, var1, n1) = stats
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (mean0 - mean1) / np.sqrt(var0 / n0 + var1 / n1)
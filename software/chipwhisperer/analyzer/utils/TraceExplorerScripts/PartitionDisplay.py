@@ -32,7 +32,7 @@ from PySide.QtCore import *
 from PySide.QtGui import *
 import chipwhisperer.common.utils.qt_tweaks as QtFixes
 import pyqtgraph as pg
-from chipwhisperer.analyzer.utils.Partition import Partition
+from chipwhisperer.analyzer.utils.Partition import Partition, PartitionStats
 from chipwhisperer.common.utils import util
 from chipwhisperer.common.api.autoscript import AutoScript
 from chipwhisperer.common.api.CWCoreAPI import CWCoreAPI
@@ -113,6 +113,117 @@ class DifferenceModeSAD(object):
         return SADSeg
 
 
+class DifferenceModeSNR(object):
+    sectionName = "Difference of Partitions using SNR"
+    moduleName = "PartitionDifferencesSNR"
+    differenceType = "Signal to Noise Ratio"
+
+    def difference(self, numkeys, numparts, trace, numpoints, stats, pbDialog=None):
+        # Variance of the partition means (signal) over the mean of the partition variances (noise),
+        # for all subkeys at once. Partitions without traces are left out.
+        means, var, num = partitionStatsArrays(stats)
+        empty = (num == 0)[:, :, None]
+        means = np.where(empty, np.nan, means)
+        var = np.where(empty, np.nan, var)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            SADSeg = np.nanvar(means, axis=1) / np.nanmean(var, axis=1)
+
+        return np.nan_to_num(SADSeg)
+
+
+class DifferenceModeSOST(object):
+    sectionName = "Difference of Partitions using SOST"
+    moduleName = "PartitionDifferencesSOST"
+    differenceType = "Sum of Squared T-Differences"
+
+    def difference(self, numkeys, numparts, trace, numpoints, stats, pbDialog=None):
+        means, var, num = partitionStatsArrays(stats)
+
+        if pbDialog:
+            pbDialog.setMinimum(0)
+            pbDialog.setMaximum(numparts)
+
+        # Each pair of partitions (i, j > i) once, all subkeys and all j at once
+        SADSeg = np.zeros((numkeys, numpoints))
+        for i in range(0, numparts - 1):
+            if pbDialog:
+                pbDialog.updateStatus(i)
+                util.updateUI()
+                if pbDialog.wasAborted():
+                    return SADSeg
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                sost = np.square(means[:, i:i+1] - means[:, i+1:]) / (var[:, i:i+1] / num[:, i:i+1, None] + var[:, i+1:] / num[:, i+1:, None])
+            valid = (num[:, i:i+1] > 0) & (num[:, i+1:] > 0)
+            SADSeg += np.sum(np.where(valid[:, :, None], np.nan_to_num(sost), 0), axis=1)
+
+        if pbDialog:
+            pbDialog.updateStatus(numparts)
+
+        return SADSeg
+
+
+def partitionStatsArrays(stats):
+    """Return the (subkeys x partitions x points) means and variances and the (subkeys x partitions) counts as arrays"""
+    return (np.asarray(stats["mean"], dtype=np.float64), np.asarray(stats["variance"], dtype=np.float64),
+            np.asarray(stats["number"], dtype=np.int64))
+
+
+def findPOI(data, numMax, minSpace, extendDownhill=False):
+    """
+    Return the locations of the numMax highest points of data, picked from the highest down. Around each pick,
+    +/- minSpace points are excluded from later picks, and with extendDownhill the excluded range is extended
+    down both sides of the peak.
+    """
+    data = np.array(data, dtype=np.float64)
+    n = len(data)
+    index = np.arange(n)
+
+    # Where walking down the hill from each point stops: leftStop[i] is the first point left of i with a
+    # higher point before it, rightStop[i] the same to the right
+    leftBreak = np.ones(n, dtype=bool)
+    leftBreak[1:] = data[:-1] > data[1:]
+    leftStop = np.maximum.accumulate(np.where(leftBreak, index, 0))
+    rightBreak = np.ones(n, dtype=bool)
+    rightBreak[:-1] = data[1:] > data[:-1]
+    rightStop = np.minimum.accumulate(np.where(rightBreak, index, n - 1)[::-1])[::-1]
+
+    blanked = np.zeros(n, dtype=bool)
+    maxarray = []
+
+    while len(maxarray) < numMax:
+        # Find maximum location
+        mloc = np.argmax(data)
+
+        # Store this maximum
+        maxarray.append(mloc)
+
+        # set to -INF data within +/- the minspace
+        mstart = max(0, mloc - minSpace)
+        mend = min(mloc + minSpace, n)
+        if extendDownhill:
+            # A walk which reaches an excluded range goes through it, and stops at its far end
+            if mstart > 0:
+                stop = leftStop[mstart]
+                hit = np.flatnonzero(blanked[max(stop - 1, 0):mstart + 1])
+                if len(hit):
+                    free = np.flatnonzero(~blanked[:max(stop - 1, 0) + hit[-1]])
+                    stop = free[-1] + 1 if len(free) else 0
+                mstart = stop
+            if mend < n - 1:
+                stop = rightStop[mend]
+                hit = np.flatnonzero(blanked[mend:min(stop + 2, n)])
+                if len(hit):
+                    free = np.flatnonzero(~blanked[mend + hit[0]:])
+                    stop = mend + hit[0] + free[0] - 1 if len(free) else n - 1
+                mend = stop
+        data[mstart:mend] = -np.inf
+        blanked[mstart:mend] = True
+
+    return maxarray
+
+
 class DifferenceMode(object):
     attrDictCombination = {
                 "sectionName":"Difference Based on XXXX",
@@ -126,7 +237,7 @@ class DifferenceMode(object):
                     },
                 }
 
-    supportedMethods = [DifferenceModeTTest, DifferenceModeSAD]
+    supportedMethods = [DifferenceModeTTest, DifferenceModeSAD, DifferenceModeSNR, DifferenceModeSOST]
 
     def __init__(self):
         super(DifferenceMode, self).__init__()
@@ -217,27 +328,7 @@ class POI(QWidget):
         extendDownhill = self.parent.findParam(["Points of Interest",'Hill detection']).getValue()
 
         for bnum in range(0, len(self.diffs)):
-
-            maxarray = []
-
-            # Copy since we will be overwriting it a bunch
-            data = copy.deepcopy(self.diffs[bnum][startPoint:endPoint])
-
-            while len(maxarray) < numMax:
-                # Find maximum location
-                mloc = np.argmax(data)
-
-                # Store this maximum
-                maxarray.append(mloc + startPoint)
-
-                # set to -INF data within +/- the minspace
-                mstart = max(0, mloc - minSpace)
-                while extendDownhill and mstart>0 and data[mstart-1] <= data[mstart]:
-                    mstart-=1
-                mend = min(mloc + minSpace, len(data))
-                while extendDownhill and mend<len(data)-1 and data[mend+1] <= data[mend]:
-                    mend+=1
-                data[mstart:mend] = -np.inf
+            maxarray = [mloc + startPoint for mloc in findPOI(self.diffs[bnum][startPoint:endPoint], numMax, minSpace, extendDownhill)]
 
             # print maxarray
             self.poiArray.append(maxarray)
@@ -290,6 +381,7 @@ class PartitionDisplay(Parameterized, AutoScript):
 
               {'name':'Auto-Save Data to Project', 'key':'part-saveints', 'type':'bool', 'value':False, 'action':lambda _: self.updateScript()},
               {'name':'Auto-Load Data from Project', 'key':'part-loadints', 'type':'bool', 'value':False, 'action':lambda _: self.updateScript()},
+              {'name':'Worker Threads', 'key':'part-workers', 'type':'int', 'limits':(1, 256), 'value':1, 'action':lambda _: self.updateScript()},
 
               {'name':'Points of Interest', 'key':'poi', 'type':'group', 'children':[
                  {'name':'Selection Mode', 'type':'list', 'values':{'Max N Points/Subkey':'maxn'}, 'value':'maxn'},
@@ -341,8 +433,8 @@ class PartitionDisplay(Parameterized, AutoScript):
         except AttributeError as e:
             return
 
-        self.importsAppend('from chipwhisperer.analyzer.utils.Partition import PartitionRandDebug, PartitionRandvsFixed, PartitionEncKey, PartitionHWIntermediate, PartitionHDLastRound')
-        self.importsAppend('from chipwhisperer.analyzer.utils.TraceExplorerScripts.PartitionDisplay import DifferenceModeTTest, DifferenceModeSAD')
+        self.importsAppend('from chipwhisperer.analyzer.utils.Partition import PartitionRandDebug, PartitionRandvsFixed, PartitionEncKey, PartitionHWIntermediate, PartitionHDLastRound, PartitionIntermediate')
+        self.importsAppend('from chipwhisperer.analyzer.utils.TraceExplorerScripts.PartitionDisplay import DifferenceModeTTest, DifferenceModeSAD, DifferenceModeSNR, DifferenceModeSOST')
         self.importsAppend('from chipwhisperer.analyzer.ui.CWAnalyzerGUI import CWAnalyzerGUI')
 
         self.addGroup("displayPartitionStats")
@@ -352,7 +444,8 @@ class PartitionDisplay(Parameterized, AutoScript):
         self.addFunction('displayPartitionStats', 'partObject.setPartMethod', partMethodStr, obj='ted')
         self.addFunction('displayPartitionStats', 'partObject.generatePartitions', 'saveFile=True, loadFile=False', 'partData', obj='ted')
         self.addFunction('displayPartitionStats', 'generatePartitionStats',
-                            'partitionData={"partclass":%s, "partdata":partData}, saveFile=True, progressBar=progressBar' % partMethodStr,
+                            'partitionData={"partclass":%s, "partdata":partData}, saveFile=True, progressBar=progressBar, workers=%d' %
+                            (partMethodStr, self.findParam('part-workers').getValue()),
                             'partStats', obj='ted')
         self.addFunction('displayPartitionStats', 'generatePartitionDiffs',
                             '%s, statsInfo={"partclass":%s, "stats":partStats}, saveFile=True, loadFile=False, progressBar=progressBar'%
@@ -375,7 +468,7 @@ class PartitionDisplay(Parameterized, AutoScript):
         if ignored == "traceexplorer_show":
             self._autoscript_init = True
 
-    def generatePartitionStats(self, partitionData={"partclass":None, "partdata":None}, saveFile=False, loadFile=False,  tRange=(0, -1), progressBar=None):
+    def generatePartitionStats(self, partitionData={"partclass":None, "partdata":None}, saveFile=False, loadFile=False,  tRange=(0, -1), progressBar=None, workers=1):
 
         traces = self._traces
 
@@ -407,75 +500,23 @@ class PartitionDisplay(Parameterized, AutoScript):
             fname = self.api.project().convertDataFilepathAbs(foundsecs[0]["filename"])
             stats = np.load(fname)
         else:
-            # Array to hold average + stddev of all traces/partitions
-            A_k = []
-            A_j = []
-            Q_k = []
-            dataArrays = [A_k, A_j, Q_k]
-            ACnt = []
-            for bnum in range(0, self.numKeys):
-                for d in dataArrays:
-                    d.append([])
-                ACnt.append([])
-                for i in range(0, self.partObject.partMethod.getNumPartitions()):
-                    for d in dataArrays:
-                        d[bnum].append(np.zeros(numPoints))
-                    ACnt[bnum].append(0)
-
-            # Get segment list
-            segList = traces.getSegmentList()
-
             if progressBar:
                 progressBar.setWindowTitle("Phase 1: Trace Statistics")
-                progressBar.setMaximum(bnum)  # len(segList['offsetList']) * self.numKeys)
+                progressBar.setText("Calculating Average + Std-Dev")
                 progressBar.show()
 
-            # TODO: Double-check this fix
-            # for tsegn, segtrace in enumerate(segList['offsetList']):
-            tsegn = 0
-            if progressBar: progressBar.setText("Segment %d" % tsegn)
-
             # Average data needs to be calculated
             # Require partition list
-            partData = partitionData["partdata"]
-
-
-            # print "Calculating Average + Std-Dev"
-            # Std-Dev calculation:
-            # A[0] = 0
-            # A[k] = A[k-1] + (x[k] - A[k-1]) / k
-            # Q[0] = 0
-            # Q[k] = Q[k-1] + (x[k] - A[k-1])(x[k] - A[k])
-            for bnum in range(0, self.numKeys):
-                progressBar.updateStatus(tsegn * self.numKeys + bnum)
-                if progressBar.wasAborted():
-                    break
-                for i in range(0, self.partObject.partMethod.getNumPartitions()):
-                    util.updateUI()
-                    tlist = partData[bnum][i]
-                    if len(tlist) > 0:
-                        for tnum in tlist:
-                            if tnum > tRange[0] and tnum < tRange[1]:
-                                t = traces.getTrace(tnum)
-                                ACnt[bnum][i] += 1
-                                A_k[bnum][i] = A_k[bnum][i] + (t - A_j[bnum][i]) / ACnt[bnum][i]
-                                Q_k[bnum][i] = Q_k[bnum][i] + ((t - A_j[bnum][i]) * (t - A_k[bnum][i]))
-                                A_j[bnum][i] = A_k[bnum][i]
-
-            if progressBar.wasAborted():
+            partNums = self.partObject.createMatrix(partitionData["partdata"], tRange[0], tRange[1])
+
+            partStats = PartitionStats.accumulate(traces, partNums, tRange[0], self.partObject.partMethod.getNumPartitions(),
+                                                  workers=workers, progressBar=progressBar)
+            if partStats is None:
                 progressBar.hide()
                 return
 
-            # Finally get variance
-            for bnum in range(0, self.numKeys):
-                    for i in range(0, self.partObject.partMethod.getNumPartitions()):
-                        # TODO: Should be using population variance or sample variance (e.g. /n or /n-1)?
-                        #      Since this is taken over very large sample sizes I imagine it won't matter
-                        #      ultimately.
-                        Q_k[bnum][i] = Q_k[bnum][i] / max(ACnt[bnum][i] - 1, 1)
-
-            # Average is in A_k
-            stats = {"mean":A_k, "variance":Q_k, "number":ACnt}
+            stats = partStats.stats()
+            A_k, Q_k, ACnt = stats["mean"], stats["variance"], stats["number"]
 
             # Wasn't cancelled - save this to project file for future use if requested
             if saveFile:
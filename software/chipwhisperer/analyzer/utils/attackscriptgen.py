@@ -71,6 +71,9 @@ class AttackScriptGen(Parameterized):
     def projectChanged(self):
         if self.attack:
             self.attack.findParam('input').setValue(TraceSource.registeredObjects["Trace Management"])
+        for p in self.preprocessingListGUI:
+            if p is not None:
+                p.setProject(self.cwGUI.api.project())
 
     def flushTimer(self):
         """Flush all pending script updates"""
@@ -142,6 +145,7 @@ class AttackScriptGen(Parameterized):
             self.preprocessingParams.getChild('Pre-Processing Mod. #%d'% num).delete()
         if module:
             self.preprocessingListGUI[num] = module(traceSource=last_trace_src)
+            self.preprocessingListGUI[num].setProject(self.cwGUI.api.project())
             self.preprocessingListGUI[num].scriptsUpdated.connect(self.reloadScripts)
             par = Parameter(name = 'Pre-Processing Mod. #%d'% num, type = "group")
             par.append(self.preprocessingListGUI[num].getParams())
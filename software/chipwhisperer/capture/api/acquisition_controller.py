@@ -22,11 +22,56 @@
 #    You should have received a copy of the GNU General Public License
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 #=================================================
+import copy
 import logging
+import Queue
+import sys
+import threading
 import time
+import numpy as np
 from chipwhisperer.common.utils import util
 
 
+class TraceStorageThread(threading.Thread):
+    """Calls store(*job) for every job put in a bounded queue, so the traces are stored while the next ones are captured"""
+
+    def __init__(self, store, depth):
+        threading.Thread.__init__(self, name="Trace Storage")
+        self.daemon = True
+        self._store = store
+        self._queue = Queue.Queue(maxsize=depth)
+        self._error = None
+
+    def run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            # After an error keep emptying the queue, so put() never blocks forever
+            if self._error is None:
+                try:
+                    self._store(*job)
+                except Exception:
+                    self._error = sys.exc_info()
+
+    def put(self, *job):
+        """Queue a job, blocking while the queue is full. Raises the error of an earlier job, if any."""
+        self._raiseError()
+        self._queue.put(job)
+
+    def close(self, raiseError=True):
+        """Wait for all queued jobs to be done, then raise the error of a job, if any and raiseError is set"""
+        self._queue.put(None)
+        self.join()
+        if raiseError:
+            self._raiseError()
+
+    def _raiseError(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error[0], error[1], error[2]
+
+
 class AcquisitionController():
 
     def __init__(self, scope, target=None, writer=None, auxList=None, keyTextPattern=None):
@@ -41,6 +86,7 @@ class AcquisitionController():
         keyTextPattern.setTarget(target)
 
         self.maxtraces = 1
+        self.pipelineDepth = 0
 
         if self.auxList is not None:
             for aux in auxList:
@@ -138,6 +184,25 @@ class AcquisitionController():
     def setMaxtraces(self, maxtraces):
         self.maxtraces = maxtraces
 
+    def setPipelineDepth(self, depth):
+        """Store up to depth traces on a separate thread while the next ones are captured (0 = store each trace
+        before capturing the next one)"""
+        self.pipelineDepth = depth
+
+    def storeTraces(self, tnum, traces, textin, textout, key):
+        """Add the traces of one capture to the writer, traces is a list of (channelNum, trace, scale)"""
+        try:
+            for channelNum, trace, scale in traces:
+                if scale is None:
+                    self.writer.addTrace(trace, textin, textout, key, channelNum=channelNum)
+                else:
+                    # Store the raw samples, the conversion is applied when reading them back
+                    self.writer.setTraceScale(*scale)
+                    self.writer.addTrace(trace, textin, textout, key, dtype=np.uint16, channelNum=channelNum)
+        except ValueError as e:
+            logging.warning('Exception caught in adding trace %d, trace skipped.' % tnum)
+            logging.debug(str(e))
+
     def doReadings(self, channelNumbers=[0], tracesDestination=None, progressBar=None):
         self._keyTextPattern.initPair()
         data = self._keyTextPattern.newPair()
@@ -156,24 +221,47 @@ class AcquisitionController():
         if self.target:
             self.target.init()
 
+        storage = None
+        if self.writer and self.pipelineDepth > 0:
+            storage = TraceStorageThread(self.storeTraces, self.pipelineDepth)
+            storage.start()
+
         self.currentTrace = 0
-        while self.currentTrace < self.maxtraces:
-            if self.doSingleReading():
-                try:
+        try:
+            while self.currentTrace < self.maxtraces:
+                if self.doSingleReading():
                     if self.writer:
+                        traces = []
                         for channelNum in channelNumbers:
-                            self.writer.addTrace(self.scope.channels[channelNum].getTrace(), self.textin, self.textout, self.key, channelNum=channelNum)
-                except ValueError as e:
-                    logging.warning('Exception caught in adding trace %d, trace skipped.' % self.currentTrace)
-                    logging.debug(str(e))
-                self.sigTraceDone.emit()
-                self.currentTrace += 1
-            else:
-                util.updateUI()  # Check if it was aborted
-
-            if progressBar is not None:
-                if progressBar.wasAborted():
-                    break
+                            channel = self.scope.channels[channelNum]
+                            scale = channel.getSampleScale()
+                            if scale is None:
+                                traces.append((channelNum, channel.getTrace(), None))
+                            else:
+                                traces.append((channelNum, channel.getRawTrace(), scale))
+
+                        if storage:
+                            # Copy what the scope or the next capture may still modify
+                            traces = [(channelNum, np.array(trace), scale) for channelNum, trace, scale in traces]
+                            storage.put(self.currentTrace, traces, copy.copy(self.textin), copy.copy(self.textout), copy.copy(self.key))
+                        else:
+                            self.storeTraces(self.currentTrace, traces, self.textin, self.textout, self.key)
+                    self.sigTraceDone.emit()
+                    self.currentTrace += 1
+                else:
+                    util.updateUI()  # Check if it was aborted
+
+                if progressBar is not None:
+                    if progressBar.wasAborted():
+                        break
+        except:
+            # Let the stored traces be written, but keep the original exception over a storage error
+            error = sys.exc_info()
+            if storage:
+                storage.close(raiseError=False)
+            raise error[0], error[1], error[2]
+        if storage:
+            storage.close()
 
         if self.auxList:
             for aux in self.auxList:
@@ -10,6 +10,7 @@ import logging
 import sys
 import time
 import datetime
+import numpy as np
 from chipwhisperer.common.utils import util
 from chipwhisperer.common.utils.parameter import Parameter, Parameterized, setupSetParam
 
@@ -267,6 +268,10 @@ class TriggerSettings(Parameterized):
                      'help':'%namehdr%'+
                             'Total number of samples to record. Note the capture system has an upper limit. Older FPGA bitstreams had a lower limit of about 256 samples.'+
                             'If using the ChipWhisperer-Lite/ChipWhisperer-Pro (CW1173/CW1200) this is no longer the case, and can be set to almost any number.'},
+            {'name': 'Raw Samples', 'type':'bool', 'default':False, 'set':self.setRawSamples, 'get':self.rawSamples,
+                     'help':'%namehdr%'+
+                            'Keep the 10-bit ADC codes instead of converting every sample to a float. Traces are then stored as ' +
+                            '16-bit integers, with the conversion recorded in the trace configuration and applied when they are read back.'},
         ]
 
         if self.oa.hwInfo and self.oa.hwInfo.is_cw1200():
@@ -306,6 +311,13 @@ class TriggerSettings(Parameterized):
     def getStreamMode(self):
         return self._stream_mode
 
+    @setupSetParam("Raw Samples")
+    def setRawSamples(self, enabled):
+        self.oa.setRawSamples(enabled)
+
+    def rawSamples(self):
+        return self.oa.rawSamples()
+
     def fifoOverflow(self):
         return self.oa.getStatus() & STATUS_OVERFLOW_MASK
 
@@ -878,7 +890,9 @@ class OpenADCInterface(object):
         self.ddrMode = False
         self.sysFreq = 0
         self._streammode = False
-        self._sbuf = []
+        self._rawsamples = False
+        self._sbuf = np.zeros(0, dtype=np.uint8)
+        self._sdata = np.zeros(0, dtype=np.uint8)
         self.settings()
 
         # Send clearing function if using streaming mode
@@ -895,6 +909,17 @@ class OpenADCInterface(object):
         self._streammode = stream
         self.updateStreamBuffer()
 
+    def setRawSamples(self, raw):
+        """If True readData() returns the uint16 ADC codes, see sampleScale() to convert them"""
+        self._rawsamples = raw
+
+    def rawSamples(self):
+        return self._rawsamples
+
+    def sampleScale(self):
+        """Return (scale, offset) converting the raw ADC codes to the values returned when raw samples are off"""
+        return (1.0 / 1024.0, -self.offset)
+
     def setTimeout(self, timeout):
         self._timeout = timeout
 
@@ -1099,8 +1124,10 @@ class OpenADCInterface(object):
             #Save the number we will return
             bufsizebytes, self._stream_len_act = nae.cmdReadStream_bufferSize(self._stream_len)
 
-        #Generate the buffer to save buffer
-        self._sbuf = [0] * bufsizebytes
+        #Generate the buffer the USB reads go into, and the one holding it without the sync bytes. Both are
+        #allocated once and reused by every capture.
+        self._sbuf = np.zeros(bufsizebytes, dtype=np.uint8)
+        self._sdata = np.zeros(bufsizebytes, dtype=np.uint8)
 
     def numSamples(self):
         """Return the number of samples captured in one go. Returns max after resetting the hardware"""
@@ -1275,26 +1302,29 @@ class OpenADCInterface(object):
             # Process data
             bsize = self.serial.cmdReadStream_size_of_fpgablock()
 
-            data = [0] * self.serial.cmdReadStream_bufferSize(self._stream_len)[0]
+            # Every FPGA block starts with a sync byte, keep the first one for processData() and drop the others
+            # by viewing the buffer as one row per block
+            nblocks = min((self._stream_rx_bytes + bsize - 1) // bsize, len(self._sbuf) // bsize)
+            syncs = self._sbuf[0:nblocks * bsize:bsize]
+            badsync = np.flatnonzero(syncs != 0xAC)
+            if len(badsync) > 0:
+                i = badsync[0] * bsize
+                logging.warning("Stream mode: Expected sync byte (AC) at location %d but got %x" % (i, self._sbuf[i]))
+                nblocks = badsync[0]
+
+            data = self._sdata
             data[0] = self._sbuf[0]
-            dbuf2_idx = 1
-            for i in range(0, self._stream_rx_bytes, bsize):
-                if self._sbuf[i] != 0xAC:
-                    logging.warning("Stream mode: Expected sync byte (AC) at location %d but got %x" % (i, self._sbuf[i]))
-                    break
-                s = i + 1
-                data[dbuf2_idx: (dbuf2_idx + (bsize - 1))] = self._sbuf[s:(s + (bsize - 1))]
-
-                # Write to next section
-                dbuf2_idx += (bsize - 1)
+            payload = self._sbuf[0:nblocks * bsize].reshape(nblocks, bsize)[:, 1:]
+            data[1:1 + payload.size].reshape(nblocks, bsize - 1)[:] = payload
+            data[1 + payload.size:] = 0
 
             logging.debug("Stream mode: done, %d bytes ready for processing"%len(data))
-            datapoints = self.processData(data, 0.0)
-            if datapoints:
+            datapoints = self.processData(data, 0.0, raw=self._rawsamples)
+            if datapoints is not None and len(datapoints) > 0:
                 logging.debug("Stream mode: done, %d samples processed"%len(datapoints))
             else:
                 logging.warning("Stream mode: done, no samples resulted from processing")
-                datapoints = []
+                datapoints = np.zeros(0)
 
             if len(datapoints) > NumberPoints:
                 datapoints = datapoints[0:NumberPoints]
@@ -1302,7 +1332,7 @@ class OpenADCInterface(object):
             return datapoints
 
         else:
-            datapoints = []
+            packages = []
 
             if NumberPoints == None:
                 NumberPoints = 0x1000
@@ -1369,7 +1399,9 @@ class OpenADCInterface(object):
                 #       print "%x "%p,
 
                 if data:
-                    datapoints = datapoints + self.processData(data, 0.0)
+                    points = self.processData(data, 0.0, raw=self._rawsamples)
+                    if points is not None:
+                        packages.append(points)
 
                 if progressDialog:
                     progressDialog.setValue(status)
@@ -1377,6 +1409,11 @@ class OpenADCInterface(object):
                     if progressDialog.wasCanceled():
                         break
 
+            if len(packages) > 0:
+                datapoints = np.concatenate(packages)
+            else:
+                datapoints = np.zeros(0)
+
             # for point in datapoints:
             #       print "%3x"%(int((point+0.5)*1024))
 
@@ -1389,69 +1426,60 @@ class OpenADCInterface(object):
 
             return datapoints
 
-    def processData(self, data, pad=float('NaN'), pretrigger_out=None):
-        fpData = []
-        lastpt = -100
+    def processData(self, data, pad=float('NaN'), pretrigger_out=None, raw=False):
+        """
+        Decode the sync byte + 32-bit words read from the ADC FIFO into a numpy array of samples. Each word
+        holds three 10-bit samples, and its top two bits are 3 until the word containing the trigger, where
+        they give the trigger's position in the word. The samples are padded (with pad) or chopped so that
+        presamples_desired samples come before the trigger.
+
+        Returns the samples scaled as code/1024 - offset, or with raw=True the uint16 ADC codes (padded with
+        0), or None if the sync byte is wrong.
+        """
+        if isinstance(data, (bytearray, str)):
+            data = np.frombuffer(data, dtype=np.uint8)
+        else:
+            data = np.asarray(data, dtype=np.uint8)
 
         if data[0] != 0xAC:
             logging.warning('Unexpected sync byte: 0x%x' % data[0])
             return None
 
-        trigfound = False
-        trigsamp = 0
-
-        for i in range(1, len(data) - 3, 4):
-            #Convert
-            temppt = (data[i + 3]<<0) | (data[i + 2]<<8) | (data[i + 1]<<16) | (data[i + 0]<<24)
-
-            #print("%2x "%data[i])
+        nwords = (len(data) - 1) // 4
+        words = data[1:1 + nwords * 4].view('>u4')
 
-            #print "%x %x %x %x"%(data[i +0], data[i +1], data[i +2], data[i +3]);
-            #print "%x"%temppt
+        # Three samples per word, lowest bits first
+        codes = np.empty((nwords, 3), dtype=np.uint16)
+        codes[:, 0] = words & 0x3FF
+        codes[:, 1] = (words >> 10) & 0x3FF
+        codes[:, 2] = (words >> 20) & 0x3FF
+        codes = codes.reshape(-1)
 
-            intpt1 = temppt & 0x3FF
-            intpt2 = (temppt >> 10) & 0x3FF
-            intpt3 = (temppt >> 20) & 0x3FF
-
-            # print "%x %x %x" % (intpt1, intpt2, intpt3)
-
-            if trigfound == False:
-                mergpt = temppt >> 30
-                if (mergpt != 3):
-                       trigfound = True
-                       trigsamp = trigsamp + mergpt
-                       #print "Trigger found at %d"%trigsamp
-                else:
-                   trigsamp += 3
-
-            #input validation test: uncomment following and use
-            #ramp input on FPGA
-            ##if (intpt != lastpt + 1) and (lastpt != 0x3ff):
-            ##    print "intpt: %x lstpt %x\n"%(intpt, lastpt)
-            ##lastpt = intpt;
-
-            #print "%x %x %x"%(intpt1, intpt2, intpt3)
-
-            fpData.append(float(intpt1) / 1024.0 - self.offset)
-            fpData.append(float(intpt2) / 1024.0 - self.offset)
-            fpData.append(float(intpt3) / 1024.0 - self.offset)
-
-        #print len(fpData)
-
-        if trigfound == False:
+        merge = words >> 30
+        trigwords = np.flatnonzero(merge != 3)
+        if len(trigwords) > 0:
+            trigsamp = 3 * int(trigwords[0]) + int(merge[trigwords[0]])
+        else:
+            trigsamp = 3 * nwords
             logging.warning('Trigger not found in ADC data. No data reported!')
 
+        if raw:
+            samples = codes
+            pad = 0
+        else:
+            samples = codes / 1024.0 - self.offset
+
         #Ensure that the trigger point matches the requested by padding/chopping
         diff = self.presamples_desired - trigsamp
         if diff > 0:
-               fpData = [pad]*diff + fpData
-               logging.warning('Pretrigger not met. Increase presampleTempMargin (in the code).')
+            samples = np.concatenate((np.full(diff, pad, dtype=samples.dtype), samples))
+            logging.warning('Pretrigger not met. Increase presampleTempMargin (in the code).')
         else:
-               fpData = fpData[-diff:]
+            samples = samples[-diff:]
 
-        logging.debug("Processed data, ended up with %d samples total"%len(fpData))
+        logging.debug("Processed data, ended up with %d samples total" % len(samples))
 
-        return fpData
+        return samples
 
 if __name__ == "__main__":
     import serial
@@ -48,8 +48,8 @@ class ScopeTemplate(Parameterized):
     def setCurrentScope(self, scope):
         pass
 
-    def newDataReceived(self, channelNum, data=None, offset=0, sampleRate=0):
-        self.channels[channelNum].newScopeData(data, offset, sampleRate)
+    def newDataReceived(self, channelNum, data=None, offset=0, sampleRate=0, scale=None):
+        self.channels[channelNum].newScopeData(data, offset, sampleRate, scale)
 
     def getStatus(self):
         return self.connectStatus.value()
@@ -100,12 +100,15 @@ class Channel(TraceSource):
         self._lastData = []
         self._lastOffset = 0
         self._sampleRate = 0
+        self._sampleScale = None
 
-    def newScopeData(self, data=None, offset=0, sampleRate=0):
-        """Capture the received trace and emit a signal to inform the observers"""
+    def newScopeData(self, data=None, offset=0, sampleRate=0, scale=None):
+        """Capture the received trace and emit a signal to inform the observers. If the scope sends raw samples
+        (e.g. ADC codes), scale is the (scale, offset) converting them to physical values."""
         self._lastData = data
         self._lastOffset = offset
         self._sampleRate = sampleRate
+        self._sampleScale = scale
         if len(data) > 0:
             self.sigTracesChanged.emit()
         else:
@@ -114,8 +117,18 @@ class Channel(TraceSource):
     def getTrace(self, n=0):
         if n != 0:
             raise ValueError("Live trace source has no buffer, so it only supports trace 0.")
+        if self._sampleScale is not None:
+            return self._lastData * self._sampleScale[0] + self._sampleScale[1]
         return self._lastData
 
+    def getRawTrace(self):
+        """Return the last trace as sent by the scope, see getSampleScale()"""
+        return self._lastData
+
+    def getSampleScale(self):
+        """Return the (scale, offset) converting getRawTrace() to physical values, or None if it already is"""
+        return self._sampleScale
+
     def numPoints(self):
         return len(self._lastData)
 
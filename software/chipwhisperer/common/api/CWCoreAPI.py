@@ -81,6 +81,7 @@ class CWCoreAPI(Parameterized):
         self._auxList = [None]  # TODO: implement it as a list in the whole class
         self._numTraces = 50
         self._numTraceSets = 1
+        self._pipelineDepth = 16
 
         self.params = Parameter(name='Generic Settings', type='group', addLoadSave=True).register()
         self.params.addChildren([
@@ -94,6 +95,8 @@ class CWCoreAPI(Parameterized):
                      'which may cause data to be saved more frequently. The default capture driver requires that NTraces/NSets is small enough to avoid running out of system memory '
                      'as each segment is buffered into RAM before being written to disk.'},
                     {'name':'Traces per Set', 'type':'int', 'readonly':True, 'get':self.tracesPerSet},
+                    {'name':'Pipeline Depth', 'type':'int', 'limits':(0, 1024), 'get':self.getPipelineDepth, 'set':self.setPipelineDepth, 'tip': 'Number of traces '
+                     'which can wait to be stored while the next ones are captured. 0 stores each trace before capturing the next one.'},
                     {'name':'Key/Text Pattern', 'type':'list', 'values':self.valid_acqPatterns, 'get':self.getAcqPattern, 'set':self.setAcqPattern},
             ]},
         ])
@@ -299,6 +302,15 @@ class CWCoreAPI(Parameterized):
         """Set the number of sets/segments"""
         self._numTraceSets = s
 
+    def getPipelineDepth(self):
+        """Return the number of traces stored in the background while capturing"""
+        return self._pipelineDepth
+
+    @setupSetParam("Pipeline Depth")
+    def setPipelineDepth(self, depth):
+        """Set the number of traces stored in the background while capturing (0 = no background storage)"""
+        self._pipelineDepth = depth
+
     def tracesPerSet(self):
         """Return the number of traces in each set/segment"""
         return int(self._numTraces / self._numTraceSets)
@@ -350,6 +362,7 @@ class CWCoreAPI(Parameterized):
 
                 ac = AcquisitionController(self.getScope(), self.getTarget(), currentTrace, self._auxList, self.getAcqPattern())
                 ac.setMaxtraces(setSize)
+                ac.setPipelineDepth(self._pipelineDepth)
                 ac.sigNewTextResponse.connect(self.sigNewTextResponse.emit)
                 ac.sigTraceDone.connect(self.sigTraceDone.emit)
                 __pb = lambda: progressBar.updateStatus(i*setSize + ac.currentTrace + 1, (i, ac.currentTrace))
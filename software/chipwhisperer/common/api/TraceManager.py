@@ -26,6 +26,9 @@ import ConfigParser
 import logging
 import os.path
 import re
+import threading
+
+import numpy as np
 
 from chipwhisperer.common.traces.TraceContainerNative import TraceContainerNative
 from chipwhisperer.common.utils import util
@@ -47,7 +50,13 @@ class TraceManager(TraceSource):
         self._numPoints = 0
         self._sampleRate = 0
         self.lastUsedSegment = None
+        self._previousSegment = None
         self.traceSegments = []
+        self.prefetch = True
+        self._prefetched = None
+        self._readRange = None
+        self._traceScale = None
+        self._mixedScales = False
         if __debug__: logging.debug('Created: ' + str(self))
 
     def newProject(self):
@@ -127,13 +136,13 @@ class TraceManager(TraceSource):
             if self.lastUsedSegment.mappedRange is not None and self.lastUsedSegment.mappedRange[0] <= traceIndex <= \
                     self.lastUsedSegment.mappedRange[1]:
                 return self.lastUsedSegment
-            else:
-                # Only load one segment at a time for memory reasons
-                self.lastUsedSegment.unloadAllTraces()
-                self.lastUsedSegment = None
 
         for traceSegment in self.traceSegments:
             if traceSegment.mappedRange and traceSegment.mappedRange[0] <= traceIndex <= traceSegment.mappedRange[1]:
+                # Only keep two segments loaded for memory reasons, enough for blocks of traces crossing a boundary
+                if self._previousSegment is not None and self._previousSegment is not traceSegment:
+                    self._previousSegment.unloadAllTraces()
+                self._previousSegment = self.lastUsedSegment
                 if not traceSegment.isLoaded():
                     traceSegment.loadAllTraces(None, None)
                 self.lastUsedSegment = traceSegment
@@ -157,6 +166,81 @@ class TraceManager(TraceSource):
         t = self.getSegment(n)
         return t.getTrace(n - t.mappedRange[0])
 
+    def setReadRange(self, start, end):
+        self._readRange = (start, end)
+
+    def getTraces(self, start, end):
+        """Return traces start to end-1 of the enabled segments as a 2-D array (read-only, copy before modifying it).
+        If prefetch is enabled, the following block of the same size is read from disk in the background, as long as
+        it is in the range given to setReadRange()."""
+        block = None
+        prefetched = self._prefetched
+        self._prefetched = None
+        if prefetched is not None:
+            pstart, pend, thread, result = prefetched
+            thread.join()
+            if pstart == start and pend == end:
+                block = result[0]
+            elif pstart == start and pend < end:
+                # The prefetch stopped at the end of a segment
+                block = np.concatenate([result[0]] + self._tracePieces(pend, end))
+
+        if block is None:
+            block = self._joinPieces(self._tracePieces(start, end))
+
+        if self.prefetch and self._readRange is not None and self._readRange[0] <= start < end < self._readRange[1]:
+            self._startPrefetch(end, min(end + (end - start), self._readRange[1]))
+        return block
+
+    def getRawTraces(self, start, end):
+        """Return traces start to end-1 of the enabled segments as stored, see getTraceScale()"""
+        if self._mixedScales:
+            return self.getTraces(start, end)
+        pieces = self._segmentSlices(start, end, lambda t, s, e: t.getRawTraces(s, e)[:, :self._numPoints])
+        return self._joinPieces(pieces or [np.zeros((0, self._numPoints))])
+
+    def getTraceScale(self):
+        """Return the (scale, offset) of getRawTraces(), None if the enabled segments store physical values or
+        don't all use the same scale"""
+        return self._traceScale
+
+    def _tracePieces(self, start, end):
+        """Return views on the segment arrays covering traces start to end-1"""
+        pieces = self._segmentSlices(start, end, lambda t, s, e: t.getTraces(s, e)[:, :self._numPoints])
+        return pieces or [np.zeros((0, self._numPoints))]
+
+    @staticmethod
+    def _joinPieces(pieces):
+        if not pieces:
+            return np.array([])
+        if len(pieces) == 1:
+            return pieces[0]
+        return np.concatenate(pieces)
+
+    def _startPrefetch(self, start, end):
+        """Copy traces start to end-1 into memory on a background thread, getTraces() picks them up if requested next.
+        Only the part in the segment which is already loaded is read."""
+        segment = self.lastUsedSegment
+        if segment is None or segment.mappedRange is None or not segment.mappedRange[0] <= start <= segment.mappedRange[1]:
+            # Loading the next segment here would unload the one the caller is still reading texts from
+            return
+        end = min(end, segment.mappedRange[1] + 1)
+        # Only a view of the samples as stored here, they are read and converted on the background thread
+        piece = segment.getRawTraces(start - segment.mappedRange[0], end - segment.mappedRange[0])[:, :self._numPoints]
+        scale = segment.getTraceScale()
+        result = []
+
+        def read():
+            if scale is None:
+                result.append(np.array(piece))
+            else:
+                result.append(piece * scale[0] + scale[1])
+
+        thread = threading.Thread(target=read, name="Trace prefetch")
+        thread.daemon = True
+        thread.start()
+        self._prefetched = (start, end, thread, result)
+
     def getTextin(self, n):
         """Return the input text of trace with index n in the list of enabled segments"""
         t = self.getSegment(n)
@@ -167,6 +251,26 @@ class TraceManager(TraceSource):
         t = self.getSegment(n)
         return t.getTextout(n - t.mappedRange[0])
 
+    def getTextins(self, start, end):
+        """Return the input texts of traces start to end-1 in the list of enabled segments"""
+        return self._joinPieces(self._segmentSlices(start, end, lambda t, s, e: t.getTextins(s, e)))
+
+    def getTextouts(self, start, end):
+        """Return the output texts of traces start to end-1 in the list of enabled segments"""
+        return self._joinPieces(self._segmentSlices(start, end, lambda t, s, e: t.getTextouts(s, e)))
+
+    def _segmentSlices(self, start, end, getter):
+        """Call getter(segment, localstart, localend) for each segment covering traces start to end-1, loading the
+        segments as needed, and return the list of results"""
+        pieces = []
+        tnum = start
+        while tnum < end:
+            t = self.getSegment(tnum)
+            last = min(end, t.mappedRange[1] + 1)
+            pieces.append(getter(t, tnum - t.mappedRange[0], last - t.mappedRange[0]))
+            tnum = last
+        return pieces
+
     def getKnownKey(self, n):
         """Return the known encryption key."""
         try:
@@ -177,6 +281,9 @@ class TraceManager(TraceSource):
 
     def _updateRanges(self):
         """Update the trace range for each segments."""
+        self._prefetched = None
+        self._readRange = None
+        scales = set()
         startTrace = 0
         self._sampleRate = 0
         self._numPoints = 0
@@ -184,6 +291,7 @@ class TraceManager(TraceSource):
             if t.enabled:
                 tlen = t.numTraces()
                 t.mappedRange = [startTrace, startTrace+tlen-1]
+                scales.add(t.getTraceScale())
                 startTrace = startTrace + tlen
                 np = int(t.config.attr("numPoints"))
                 if self._numPoints != np and np != 0:
@@ -202,6 +310,8 @@ class TraceManager(TraceSource):
             else:
                 t.mappedRange = None
         self._numTraces = startTrace
+        self._mixedScales = len(scales) > 1
+        self._traceScale = scales.pop() if len(scales) == 1 else None
 
     def numPoints(self):
         """Return the number of points in traces of the selected segments."""
@@ -56,18 +56,9 @@ class CorrelationVsTrace(AttackResultPlot, Plugin):
             xrangelist = [0] * self._numKeys()
             newdata = [0] * self._numKeys()
             for bnum in enabledlist:
-                maxdata = data[bnum]
-                tlist = []
-                for m in maxdata:
-                    tlist.append(m['trace'])
-
-                maxlist = np.zeros((self._numPerms(bnum), len(tlist)))
-                for i, m in enumerate(maxdata):
-                    for j in range(0, self._numPerms(bnum)):
-                        maxlist[m['maxes'][j][0], i] = m['maxes'][j][2]
-
-                newdata[bnum] = maxlist
-                xrangelist[bnum] = tlist
+                maxdata = data[bnum].data()
+                newdata[bnum] = maxdata['value'].T
+                xrangelist[bnum] = maxdata['trace'].tolist()
 
             self.drawData(progress, xrangelist, newdata, enabledlist)
             self.pw.setYRange(0, 1, update=True)
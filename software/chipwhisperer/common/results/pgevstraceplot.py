@@ -105,7 +105,7 @@ class PGEVsTrace(AttackResultPlot, Plugin):
             raise Warning("Attack not set/executed yet")
 
         stats = self._analysisSource.getStatistics()
-        pge = stats.pge_total
+        pge = stats.pge_total.data()
         allpge = util.DictType()
 
         for i in pge:
@@ -78,6 +78,7 @@ class TraceRecorder(ResultsBase, PassiveTraceObserver, Plugin):
         trace = CWCoreAPI.getInstance().getNewTrace(self.findParam('tracefmt').getValue())
         trace.config.setAttr("scopeSampleRate", self._traceSource.getSampleRate())
         trace.config.setAttr("notes", "Recorded from \"%s\" output: Traces (%s,%s). Points (%s,%s)" % (self.findParam('Input').getValueKey(), tstart, tend, pstart, pend))
+        trace.prepareDisk()
         for tnum in range(tstart, tend+1):
             trace.addTrace(self.getTraceSource().getTrace(tnum)[pstart:pend+1], self.getTraceSource().getTextin(tnum), self.getTraceSource().getTextout(tnum), self.getTraceSource().getKnownKey(tnum))
         trace.closeAll()
@@ -22,14 +22,139 @@
 #    You should have received a copy of the GNU General Public License
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
 import os
+import struct
 import numpy as np
 from _base import TraceContainer
 
 
+class NpyChunkWriter(object):
+    """
+    Append-only writer of a 2-D .npy file. Rows are written as they come in, and the header is rewritten with the
+    number of rows after every write, so the file is valid (holding all rows written so far) at any time.
+    """
+
+    # Fixed header size, large enough for any shape so it can be rewritten in place
+    HEADER_LEN = 128
+
+    def __init__(self, filename, dtype, numPoints):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.numPoints = numPoints
+        self.numRows = 0
+        self._fp = open(filename, "wb")
+        self._writeHeader()
+
+    def _writeHeader(self):
+        header = "{'descr': %r, 'fortran_order': False, 'shape': (%d, %d), }" % (
+            np.lib.format.dtype_to_descr(self.dtype), self.numRows, self.numPoints)
+        preamble = np.lib.format.magic(1, 0) + struct.pack('<H', self.HEADER_LEN - 10)
+        self._fp.seek(0)
+        self._fp.write(preamble + header.ljust(self.HEADER_LEN - len(preamble) - 1) + '\n')
+        self._fp.seek(0, os.SEEK_END)
+
+    def append(self, rows):
+        """Write a (rows x points) array at the end of the file"""
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        self._fp.write(rows.tostring())
+        self.numRows += len(rows)
+        self._writeHeader()
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+
+
 class TraceContainerNative(TraceContainer):
     _name = "ChipWhisperer/Native"
 
+    # Size of the buffer holding traces until they are written to disk, see prepareDisk()
+    chunkBytes = 16 * 1024 * 1024
+
+    def clear(self):
+        TraceContainer.clear(self)
+        self._streamToDisk = False
+        self._chunkWriter = None
+        self._chunk = None
+        self._chunkLen = 0
+        self._flushedTraces = None
+
+    def prepareDisk(self):
+        """Write the traces added from now on to disk in chunks as they come in, instead of keeping all of them in
+        memory until closeAll()"""
+        self._streamToDisk = self.config.configFilename() is not None
+
+    def addWave(self, trace, dtype=None):
+        if not self._streamToDisk:
+            return TraceContainer.addWave(self, trace, dtype)
+
+        if self._chunk is None:
+            if dtype is None:
+                dtype = np.double
+            self.tracedtype = dtype
+            chunkTraces = max(1, self.chunkBytes // (len(trace) * np.dtype(dtype).itemsize))
+
+            # Reuse a buffer given by setTraceBuffer() if it fits, never a memory-mapped file from an earlier segment
+            if isinstance(self.traces, np.ndarray) and not isinstance(self.traces, np.memmap) and \
+                    self.traces.ndim == 2 and self.traces.shape[1] == len(trace) and self.traces.dtype == dtype and \
+                    self.traces.flags.writeable and len(self.traces) > 0:
+                self._chunk = self.traces[:chunkTraces]
+            else:
+                self._chunk = np.zeros((chunkTraces, len(trace)), dtype=dtype)
+            self.traces = self._chunk
+
+            self._chunkWriter = NpyChunkWriter(self._tracesFilename(), dtype, len(trace))
+
+        #Validate traces fit - if too short warn & pad (prevents aborting long captures)
+        pad = self._chunk.shape[1] - len(trace)
+        if pad > 0:
+            logging.warning('Trace too short (length=%d)' % len(trace) + " *This MAY SUGGEST DATA CORRUPTION*")
+            logging.warning('Padding with %d zero points' % pad)
+            self._chunk[self._chunkLen][len(trace):] = 0
+            self._chunk[self._chunkLen][:len(trace)] = trace
+        else:
+            self._chunk[self._chunkLen][:] = trace
+
+        self._chunkLen += 1
+        if self._chunkLen == len(self._chunk):
+            self._flushChunk()
+
+        self._numTraces += 1
+        self.setDirty(True)
+        self.writeDataToConfig()
+
+    def _flushChunk(self):
+        if self._chunkLen > 0:
+            self._chunkWriter.append(self._chunk[:self._chunkLen])
+            self._chunkLen = 0
+
+    def _streamedTraces(self, start, end):
+        """Return a copy of traces start to end-1 while they are written to disk: the ones already written are read
+        from the file, the others from the chunk buffer (self.traces only holds the current chunk)"""
+        start, end, _ = slice(start, end).indices(self._numTraces)
+        end = max(start, end)
+        written = self._chunkWriter.numRows
+        if written == 0:
+            self._flushedTraces = self._chunk[:0]
+        elif self._flushedTraces is None or len(self._flushedTraces) != written:
+            self._flushedTraces = np.memmap(self._chunkWriter.filename, dtype=self._chunk.dtype, mode='r',
+                                            offset=NpyChunkWriter.HEADER_LEN, shape=(written, self._chunk.shape[1]))
+        return np.concatenate((self._flushedTraces[start:min(end, written)],
+                               self._chunk[max(start, written) - written:max(end, written) - written]))
+
+    def _tracesFilename(self, directory=None, prefix=None):
+        if directory is None:
+            directory = os.path.dirname(self.config.configFilename())
+        if prefix is None:
+            prefix = self.config.attr("prefix")
+        return directory + "/%straces.npy" % prefix
+
+    def numPoints(self):
+        if self._chunk is not None:
+            return self._chunk.shape[1]
+        return TraceContainer.numPoints(self)
+
     def copyTo(self, srcTraces=None):
         self.numTrace = srcTraces.numTraces()
         self.numPoint = srcTraces.numPoints()
@@ -52,6 +177,10 @@ class TraceContainerNative(TraceContainer):
 
         self.traces = np.array(srcTraces.traces, dtype=userdtype)
 
+        scale = srcTraces.getTraceScale()
+        if scale is not None:
+            self.setTraceScale(*scale)
+
         # Traces copied in means not saved
         self.setDirty(True)
 
@@ -65,6 +194,7 @@ class TraceContainerNative(TraceContainer):
                 prefix = self.config.attr("prefix")
 
         self.traces = np.load(directory + "/%straces.npy" % prefix, mmap_mode='r')
+        self.updateTraceScale()
         self.textins = np.load(directory + "/%stextin.npy" % prefix)
         self.textouts = np.load(directory + "/%stextout.npy" % prefix)
 
@@ -92,6 +222,34 @@ class TraceContainerNative(TraceContainer):
         self.keylist = None
         self._isloaded = False
 
+    def getTraces(self, start, end):
+        """Return traces start to end-1, a view on the trace array (read-only if memory-mapped from disk) unless
+        they are stored as raw samples, which are converted to a new array"""
+        traces = self.getRawTraces(start, end)
+        scale = self.getTraceScale()
+        if scale is not None:
+            return traces * scale[0] + scale[1]
+        return traces
+
+    def getRawTraces(self, start, end):
+        """Return traces start to end-1 as stored, see getTraceScale()"""
+        if self._chunkWriter is not None:
+            return self._streamedTraces(start, end)
+        return self.traces[start:end]
+
+    def getRawTrace(self, n):
+        if self._chunkWriter is not None:
+            if n < 0:
+                n += self._numTraces
+            return self._streamedTraces(n, n + 1)[0]
+        return TraceContainer.getRawTrace(self, n)
+
+    def getTextins(self, start, end):
+        return np.asarray(self.textins[start:end])
+
+    def getTextouts(self, start, end):
+        return np.asarray(self.textouts[start:end])
+
     def saveAuxData(self, data, configDict, filenameKey="filename"):
         path = os.path.dirname(self.config.configFilename())
         prefix = self.config.attr("prefix")
@@ -114,7 +272,18 @@ class TraceContainerNative(TraceContainer):
 
     def saveAllTraces(self, directory, prefix=""):
         self.config.saveTrace()
-        np.save(directory + "/%straces.npy" % prefix, self.traces)
+        fname = self._tracesFilename(directory, prefix)
+        if self._chunkWriter is not None and os.path.abspath(fname) == os.path.abspath(self._chunkWriter.filename):
+            # Already written while adding the traces
+            self._flushChunk()
+        elif isinstance(self.traces, np.memmap) and os.path.abspath(fname) == os.path.abspath(self.traces.filename):
+            # Saving over the file the traces are mapped from would truncate it first
+            pass
+        elif self.traces is not None and len(self.traces) > self.numTraces():
+            # Drop the unused rows allocated ahead in addWave()
+            np.save(fname, self.traces[:self.numTraces()])
+        else:
+            np.save(fname, self.traces)
         np.save(directory + "/%stextin.npy" % prefix, self.textins)
         np.save(directory + "/%stextout.npy" % prefix, self.textouts)
         np.save(directory + "/%skeylist.npy" % prefix, self.keylist)
@@ -124,6 +293,17 @@ class TraceContainerNative(TraceContainer):
     def closeAll(self, clearTrace=True, clearText=True, clearKeys=True):
         self.saveAllTraces(os.path.dirname(self.config.configFilename()), prefix=self.config.attr("prefix"))
 
+        if self._chunkWriter is not None:
+            self._chunkWriter.close()
+            self._chunkWriter = None
+            self._chunk = None
+            self._flushedTraces = None
+            self._streamToDisk = False
+            self.traces = None
+            if not clearTrace:
+                # Only the last chunk was in memory, read all traces back from the file
+                self.traces = np.load(self._tracesFilename(), mmap_mode='r')
+
         # Release memory associated with data in case this isn't deleted
         if clearTrace:
             self.traces = None
@@ -64,6 +64,8 @@ class TraceContainer(Parameterized, Plugin):
         self.pointhint = 0
         self._numTraces = 0
         self._isloaded = False
+        self._traceScale = None
+        self._traceScaleRead = False
 
     def setDirty(self, dirty):
         self.dirty = dirty
@@ -117,8 +119,8 @@ class TraceContainer(Parameterized, Plugin):
                 # Check can fit this
                 if self.traces.shape[0] <= self._numTraces:
                     if self._numTraces >= self.tracehint:
-                        # Tracehint wrong - increase by 25
-                        self.tracehint += 25
+                        # Tracehint wrong - grow geometrically, so adding N traces costs O(log N) reallocations
+                        self.tracehint = max(self.tracehint + 25, self.tracehint * 3 / 2)
 
                     # Do a resize now to allocate more memory
                     self.traces.resize((self.tracehint, self.traces.shape[1]))
@@ -128,9 +130,10 @@ class TraceContainer(Parameterized, Plugin):
                 if pad > 0:
                     logging.warning('Trace too short (length=%d)' % len(trace) + " *This MAY SUGGEST DATA CORRUPTION*")
                     logging.warning('Padding with %d zero points' % pad)
-                    trace.extend([0]*pad)
-
-                self.traces[self._numTraces][:] = trace
+                    self.traces[self._numTraces][len(trace):] = 0
+                    self.traces[self._numTraces][:len(trace)] = trace
+                else:
+                    self.traces[self._numTraces][:] = trace
         except MemoryError:
             raise Warning("Failed to allocate/resize array for %d x %d, if you have sufficient memory it may be fragmented. Use smaller segments and retry." % (self.tracehint, self.traces.shape[1]))
             
@@ -150,8 +153,36 @@ class TraceContainer(Parameterized, Plugin):
     def addTextout(self, data):
         self.textouts.append(data)
         
+    def setTraceScale(self, scale, offset):
+        """Record that the traces are stored as raw samples (e.g. ADC codes), read back as sample * scale + offset"""
+        # Saved with repr() so the .cfg file keeps every digit
+        self.config.setAttr("traceScale", repr(float(scale)))
+        self.config.setAttr("traceOffset", repr(float(offset)))
+        self.updateTraceScale()
+
+    def updateTraceScale(self):
+        """Read the scale of the stored samples from the config, getTraceScale() only returns this cached value"""
+        scale = float(self.config.attr("traceScale"))
+        offset = float(self.config.attr("traceOffset"))
+        self._traceScale = None if (scale == 1.0 and offset == 0.0) else (scale, offset)
+        self._traceScaleRead = True
+
+    def getTraceScale(self):
+        """Return the (scale, offset) of the stored samples, or None if they are stored as physical values"""
+        if not self._traceScaleRead:
+            self.updateTraceScale()
+        return self._traceScale
+
+    def getRawTrace(self, n):
+        """Return trace n as stored, see getTraceScale()"""
+        return self.traces[n]
+
     def getTrace(self, n):
-        data = self.traces[n]
+        data = self.getRawTrace(n)
+
+        scale = self.getTraceScale()
+        if scale is not None:
+            data = data * scale[0] + scale[1]
 
         #Following line will normalize all traces relative to each
         #other by mean & standard deviation
@@ -170,6 +201,18 @@ class TraceContainer(Parameterized, Plugin):
                 return self.keylist[n]
 
         return self.knownkey
+
+    def getTextins(self, start, end):
+        """Get text-ins start to end-1 as a 2-D array"""
+        return np.array([self.getTextin(n) for n in range(start, end)])
+
+    def getTextouts(self, start, end):
+        """Get text-outs start to end-1 as a 2-D array"""
+        return np.array([self.getTextout(n) for n in range(start, end)])
+
+    def getKnownKeys(self, start, end):
+        """Get known-keys start to end-1 as a list"""
+        return [self.getKnownKey(n) for n in range(start, end)]
     
     def getAuxDataConfig(self, newmodule):
         """
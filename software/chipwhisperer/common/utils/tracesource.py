@@ -26,6 +26,8 @@
 #=================================================
 import logging
 
+import numpy as np
+
 from chipwhisperer.common.utils import util
 from chipwhisperer.common.utils.parameter import Parameterized, setupSetParam
 
@@ -47,6 +49,24 @@ class TraceSource(object):
         """Return the trace with number n in the current TraceSource object"""
         return None
 
+    def getTraces(self, start, end):
+        """Return traces start to end-1 as a 2-D array (may be a read-only view, copy before modifying it)"""
+        return np.array([self.getTrace(n) for n in range(start, end)])
+
+    def getRawTraces(self, start, end):
+        """Return traces start to end-1 as stored: values are traces * scale + offset, with (scale, offset) from
+        getTraceScale(). The same as getTraces() if that is None."""
+        return self.getTraces(start, end)
+
+    def getTraceScale(self):
+        """Return the (scale, offset) of getRawTraces(), or None if they are physical values"""
+        return None
+
+    def setReadRange(self, start, end):
+        """Hint that traces start to end-1 are about to be read in order with getTraces(), so a source may read
+        ahead within that range"""
+        pass
+
     def numPoints(self):
         return 0
 
@@ -68,10 +88,22 @@ class TraceSource(object):
         """Get text-out number n"""
         raise NotImplementedError
 
+    def getTextins(self, start, end):
+        """Get text-ins start to end-1 as a 2-D array"""
+        return np.array([self.getTextin(n) for n in range(start, end)])
+
+    def getTextouts(self, start, end):
+        """Get text-outs start to end-1 as a 2-D array"""
+        return np.array([self.getTextout(n) for n in range(start, end)])
+
     def getKnownKey(self, n=None):
         """Get known-key number n"""
         raise NotImplementedError
 
+    def getKnownKeys(self, start, end):
+        """Get known-keys start to end-1 as a list"""
+        return [self.getKnownKey(n) for n in range(start, end)]
+
     def getSegmentList(self):
         """Return a list of segments."""
         raise NotImplementedError
@@ -21,11 +21,13 @@
 #    You should have received a copy of the GNU General Public License
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 #==========================================================================
+import array
 import logging
 import time
 import usb.core
 import usb.util
 import math
+import numpy as np
 from threading import Condition, Thread
 
 
@@ -251,6 +253,24 @@ class NAEUSB(object):
 
         return (dlen_ceil  - blocks, bsize_samples, bsize_bytes)
 
+    def _cmdReadStream_readSizes(self, dlen):
+        """Return the size in bytes of each USB read done by the stream mode capture thread for dlen samples"""
+        _, _, bsize_bytes = self._cmdReadStream_blockSizes(dlen)
+
+        sizes = []
+        while dlen > 0:
+            if dlen > 9216:
+                bsize = bsize_bytes
+            elif dlen >= 6122:
+                bsize = 4096*3
+            elif dlen >= 3072:
+                bsize = 4096*2
+            else:
+                bsize = 4096
+            sizes.append(bsize)
+            dlen -= (bsize / 4) * 3
+        return sizes
+
     def cmdReadStream_size_of_fpgablock(self):
         """ Asks the hardware how many BYTES are read in one go from FPGA, which indicates where the sync
             bytes will be located. These sync bytes must be removed in post-processing. """
@@ -265,11 +285,10 @@ class NAEUSB(object):
             Tuple: (Size of temporary buffer required, actual samples in buffer)
         """
 
-        dlen, _ , _ = self._cmdReadStream_blockSizes(dlen)
+        # Make room for every byte the capture thread will read
+        tempbuf_len = sum(self._cmdReadStream_readSizes(dlen))
 
-        # Make room for (4/3) * number of samples
-        blen = int((dlen * (4/3)))
-        tempbuf_len =  blen
+        dlen, _ , _ = self._cmdReadStream_blockSizes(dlen)
 
         return (tempbuf_len, dlen)
 
@@ -327,7 +346,7 @@ class NAEUSB(object):
 
             Args:
                 dlen: Number of samples to request.
-                dbuf_temp: Temporary data buffer, must be of size cmdReadStream_bufferSize(dlen) or bad things happen
+                dbuf_temp: Temporary numpy uint8 buffer, must be of size cmdReadStream_bufferSize(dlen) or bad things happen
                 timeout_ms: Timeout in ms to wait for stream to start, otherwise returns a zero-length buffer
             Returns:
                 Tuple of (samples_per_block, total_bytes_rx)
@@ -343,25 +362,24 @@ class NAEUSB(object):
             # Get block size of samples, bytes per block
             _, self.bsize_samples, self.bsize_bytes = self.serial._cmdReadStream_blockSizes(self.dlen)
 
-            dlen = self.dlen
             to = self.timeout_ms
 
+            # pyusb reads into an array of the requested size, so keep one per read size and copy each read
+            # straight into the preallocated buffer instead of building a new list for every block
+            readbufs = {}
+
             self.drx = 0
-            while dlen > 0:
+            for bsize in self.serial._cmdReadStream_readSizes(self.dlen):
                 try:
-                    if dlen > 9216:
-                        bsize = self.bsize_bytes
-                    elif dlen >= 6122:
-                        bsize = 4096*3
-                    elif dlen >= 3072:
-                        bsize = 4096*2
-                    else:
-                        bsize = 4096
+                    if bsize not in readbufs:
+                        readbufs[bsize] = array.array('B', [0]) * bsize
+                    readbuf = readbufs[bsize]
 
                     #Commented out normally for performance
-                    #logging.debug("USB Read Request: %d bytes, %d samples left"%(bsize, dlen))
+                    #logging.debug("USB Read Request: %d bytes"%bsize)
 
-                    self.dbuf_temp[self.drx:(self.drx+bsize)] = (self.serial.usbdev().read(self.serial.rep, bsize, timeout=to))
+                    nrx = self.serial.usbdev().read(self.serial.rep, readbuf, timeout=to)
+                    self.dbuf_temp[self.drx:(self.drx+nrx)] = np.frombuffer(readbuf, dtype=np.uint8, count=nrx)
                 except IOError:
                     self.timeout = True
                     if self.drx == 0:
@@ -373,8 +391,7 @@ class NAEUSB(object):
                 #once we have a block of data, quicker timeout is OK
                 to = 50
 
-                dlen -= (bsize / 4) * 3
-                self.drx += bsize
+                self.drx += nrx
 
 
 if __name__ == '__main__':
@@ -0,0 +1,149 @@
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from chipwhisperer.analyzer.preprocessing.cache import CacheTraces
+from chipwhisperer.analyzer.preprocessing.decimation_fixed import DecimationFixed
+from chipwhisperer.common.utils.tracesource import TraceSource
+
+
+class FakeProject(object):
+    def __init__(self, directory):
+        self.directory = directory
+
+    def getDataFilepath(self, filename, subdirectory='analysis'):
+        fname = os.path.join(self.directory, filename)
+        return {"abs":fname, "rel":filename}
+
+
+class FakeSegment(object):
+    def __init__(self, name, numTraces):
+        self.enabled = True
+        self.name = name
+        self.traces = numTraces
+        self.config = self
+
+    def configFilename(self):
+        return self.name
+
+    def numTraces(self):
+        return self.traces
+
+
+class CountingSource(TraceSource):
+    """Traces of a trace manager with two segments, counting the traces read"""
+    def __init__(self, traces):
+        TraceSource.__init__(self, "test")
+        self.traces = traces
+        self.traceSegments = [FakeSegment("a.cfg", 30), FakeSegment("b.cfg", len(traces) - 30)]
+        self.read = 0
+
+    def getTraces(self, start, end):
+        self.read += len(self.traces[start:end])
+        return self.traces[start:end]
+
+    def numTraces(self):
+        return len(self.traces)
+
+    def numPoints(self):
+        return self.traces.shape[1]
+
+
+class TestCacheTraces(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.project = FakeProject(self.directory)
+        self.traces = np.random.RandomState(10).normal(size=(50, 40))
+        self.source = CountingSource(self.traces)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def makeChain(self, source, factor=2):
+        decimation = DecimationFixed(source)
+        decimation.setEnabled(True)
+        decimation.setDecimationFactor(factor)
+        cache = CacheTraces(decimation)
+        cache.setEnabled(True)
+        cache.setProject(self.project)
+        return decimation, cache
+
+    def cacheFiles(self):
+        return sorted(os.path.basename(f) for f in glob.glob(os.path.join(self.directory, "*.npy")))
+
+    def assertBuilt(self, cache, expected):
+        """Read all traces twice: the source is read once, then the traces come from the cache"""
+        self.source.read = 0
+        np.testing.assert_array_equal(cache.getTraces(0, 50), expected)
+        self.assertEqual(self.source.read, 50)
+        np.testing.assert_array_equal(cache.getTraces(0, 50), expected)
+        np.testing.assert_array_equal(cache.getTrace(7), expected[7])
+        self.assertEqual(self.source.read, 50)
+
+    def test_cached(self):
+        decimation, cache = self.makeChain(self.source)
+        self.assertBuilt(cache, self.traces[:, ::2])
+        self.assertEqual(len(self.cacheFiles()), 2)
+
+        # A new module with the same settings (e.g. the next analyzer session) uses the same files
+        decimation, cache = self.makeChain(self.source)
+        self.source.read = 0
+        np.testing.assert_array_equal(cache.getTraces(0, 50), self.traces[:, ::2])
+        self.assertEqual(self.source.read, 0)
+
+    def test_upstreamSetting(self):
+        decimation, cache = self.makeChain(self.source)
+        self.assertBuilt(cache, self.traces[:, ::2])
+        files = self.cacheFiles()
+
+        decimation.setDecimationFactor(3)
+        self.assertBuilt(cache, self.traces[:, ::3])
+        self.assertEqual(len(self.cacheFiles()), 2)
+        self.assertFalse(set(files) & set(self.cacheFiles()))
+
+        decimation.setEnabled(False)
+        self.assertBuilt(cache, self.traces)
+
+    def test_segments(self):
+        decimation, cache = self.makeChain(self.source)
+        self.assertBuilt(cache, self.traces[:, ::2])
+        self.source.traceSegments[1].enabled = False
+        self.assertBuilt(cache, self.traces[:, ::2])
+        self.source.traceSegments[1].enabled = True
+        self.source.traceSegments[0].name = "c.cfg"
+        self.assertBuilt(cache, self.traces[:, ::2])
+
+    def test_separateChains(self):
+        # Caches of other chains are left alone when a cache is rebuilt
+        decimation, cache = self.makeChain(self.source)
+        self.assertBuilt(cache, self.traces[:, ::2])
+        other = CacheTraces(self.source)
+        other.setEnabled(True)
+        other.setProject(self.project)
+        self.assertBuilt(other, self.traces)
+        decimation.setDecimationFactor(4)
+        self.assertBuilt(cache, self.traces[:, ::4])
+        self.assertEqual(len(self.cacheFiles()), 4)
+
+        # Chains with the same modules are told apart by their cache names
+        decimation2, cache2 = self.makeChain(self.source, 5)
+        cache2.setCacheName("second")
+        self.assertBuilt(cache2, self.traces[:, ::5])
+        self.source.read = 0
+        np.testing.assert_array_equal(cache.getTraces(0, 50), self.traces[:, ::4])
+        self.assertEqual(self.source.read, 0)
+
+        cache2.clearCache()
+        self.assertEqual(len(self.cacheFiles()), 4)
+
+    def test_noProject(self):
+        decimation, cache = self.makeChain(self.source)
+        cache.setProject(None)
+        np.testing.assert_array_equal(cache.getTraces(0, 50), self.traces[:, ::2])
+        self.assertEqual(self.cacheFiles(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
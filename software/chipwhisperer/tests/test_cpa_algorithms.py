@@ -0,0 +1,125 @@
+import unittest
+import numpy as np
+from chipwhisperer.analyzer.attacks.cpa_algorithms.progressive import CPAProgressive
+from chipwhisperer.analyzer.attacks.cpa_algorithms import progressive_caccel
+from chipwhisperer.analyzer.attacks.cpa_algorithms.dpa import DPAProgressive
+from chipwhisperer.analyzer.attacks.models.AES128_8bit import AES128_8bit
+from chipwhisperer.common.utils.tracesource import TraceSource
+
+
+def correlation(hyp, traces):
+    """Correlation of every hypothesis (guesses x traces) with every point, computed directly"""
+    hyp = hyp - np.mean(hyp, axis=1)[:, None]
+    traces = traces - np.mean(traces, axis=0)
+    return np.dot(hyp, traces) / np.sqrt(np.outer(np.sum(hyp ** 2, axis=1), np.sum(traces ** 2, axis=0)))
+
+
+class ArraySource(TraceSource):
+    def __init__(self, traces, textins):
+        TraceSource.__init__(self, "test")
+        self.traces = traces
+        self.textins = textins
+
+    def getTraces(self, start, end):
+        return self.traces[start:end]
+
+    def getTextins(self, start, end):
+        return self.textins[start:end]
+
+    def getTextouts(self, start, end):
+        return self.textins[start:end]
+
+    def getKnownKeys(self, start, end):
+        return [None] * len(self.traces[start:end])
+
+    def numTraces(self):
+        return len(self.traces)
+
+    def numPoints(self):
+        return self.traces.shape[1]
+
+
+class AttackTest(unittest.TestCase):
+    subkeys = [0, 1, 5]
+
+    def setUp(self):
+        rng = np.random.RandomState(9)
+        self.model = AES128_8bit()
+        self.textins = rng.randint(0, 256, size=(120, 16)).astype(np.uint8)
+        self.traces = rng.normal(size=(120, 20))
+        self.traces[:, 4] += 0.5 * np.array([self.hypothesis(pt, 0x2b, 1) for pt in self.textins])
+        self.source = ArraySource(self.traces, self.textins)
+
+    def hypothesis(self, pt, guess, bnum):
+        return self.model.leakage(pt, None, guess, bnum, {'knownkey':None})
+
+    def hypotheses(self, bnum, ntraces):
+        return np.array([[self.hypothesis(pt, guess, bnum) for pt in self.textins[:ntraces]] for guess in range(256)])
+
+    def expectedCorrelation(self, bnum, ntraces):
+        return correlation(self.hypotheses(bnum, ntraces).astype(np.float64), self.traces[:ntraces])
+
+    def runAttack(self, algorithm, workers):
+        algorithm.setModel(self.model)
+        algorithm.setTargetSubkeys(self.subkeys)
+        algorithm.setReportingInterval(25)
+        algorithm.setWorkers(workers)
+        self.assertEqual(algorithm.findParam("Worker Threads").getValue(), workers)
+        algorithm.addTraces(self.source, (0, 119))
+        # The worker threads only live while traces are added
+        self.assertIsNone(algorithm._pool)
+        return algorithm.getStatistics()
+
+
+class TestCPAProgressive(AttackTest):
+    algorithm = CPAProgressive
+
+    def test_addTraces(self):
+        for workers in (1, 3):
+            stats = self.runAttack(self.algorithm(), workers)
+            for bnum in self.subkeys:
+                np.testing.assert_allclose(stats.diffs[bnum], self.expectedCorrelation(bnum, stats.diffs_tnum[bnum]),
+                                           rtol=1e-10, atol=1e-12)
+
+
+class TestCPAProgressiveCAccel(TestCPAProgressive):
+    algorithm = progressive_caccel.CPAProgressive_CAccel
+
+    def setUp(self):
+        try:
+            progressive_caccel.CPAProgressiveOneSubkey()
+        except Exception:
+            raise unittest.SkipTest("libcpa is not compiled for this platform")
+        TestCPAProgressive.setUp(self)
+
+
+class TestDPAProgressive(AttackTest):
+    def test_correlation(self):
+        for workers in (1, 3):
+            algorithm = DPAProgressive()
+            algorithm.setStatistic('corr')
+            stats = self.runAttack(algorithm, workers)
+            for bnum in self.subkeys:
+                self.assertEqual(stats.diffs_tnum[bnum], 120)
+                np.testing.assert_allclose(stats.diffs[bnum], self.expectedCorrelation(bnum, 120), rtol=1e-10, atol=1e-12)
+
+    def test_differenceOfMeans(self):
+        stats = self.runAttack(DPAProgressive(), 3)
+        for bnum in self.subkeys:
+            for guess, hyp in enumerate(self.hypotheses(bnum, 120)):
+                # Traces with a leakage above the middle of the possible values (0-8) against the ones below
+                expected = np.mean(self.traces[hyp > 4], axis=0) - np.mean(self.traces[hyp < 4], axis=0)
+                np.testing.assert_allclose(stats.diffs[bnum][guess], expected, rtol=1e-10, atol=1e-12)
+
+    def test_sourceError(self):
+        # Without a progress bar the error of the trace source is raised
+        self.source.getTraces = None
+        algorithm = DPAProgressive()
+        algorithm.setModel(self.model)
+        algorithm.setTargetSubkeys(self.subkeys)
+        algorithm.setReportingInterval(25)
+        self.assertRaises(TypeError, algorithm.addTraces, self.source, (0, 119))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import logging
+import unittest
+import numpy as np
+from chipwhisperer.capture.scopes._OpenADCInterface import OpenADCInterface
+
+
+def loopProcessData(data, offset, presamples, pad=float('NaN')):
+    """Sample decoding of the original OpenADCInterface.processData(), one word at a time"""
+    fpData = []
+    if data[0] != 0xAC:
+        return None
+
+    trigfound = False
+    trigsamp = 0
+    for i in range(1, len(data) - 3, 4):
+        temppt = (data[i + 3] << 0) | (data[i + 2] << 8) | (data[i + 1] << 16) | (data[i + 0] << 24)
+        if not trigfound:
+            mergpt = temppt >> 30
+            if mergpt != 3:
+                trigfound = True
+                trigsamp += mergpt
+            else:
+                trigsamp += 3
+        fpData.append(float(temppt & 0x3FF) / 1024.0 - offset)
+        fpData.append(float((temppt >> 10) & 0x3FF) / 1024.0 - offset)
+        fpData.append(float((temppt >> 20) & 0x3FF) / 1024.0 - offset)
+
+    diff = presamples - trigsamp
+    if diff > 0:
+        fpData = [pad] * diff + fpData
+    else:
+        fpData = fpData[-diff:]
+    return fpData
+
+
+class TestProcessData(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.rng = np.random.RandomState(6)
+        self.oa = OpenADCInterface.__new__(OpenADCInterface)
+        self.oa.offset = 0.5
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def makeData(self, nwords, trigword=None, trigpos=0, extra=0):
+        """Sync byte + nwords random sample words, the trigger in word trigword at position trigpos (0-2)"""
+        words = self.rng.randint(0, 1 << 30, nwords).astype(np.uint64) | np.uint64(3 << 30)
+        if trigword is not None:
+            words[trigword] = (words[trigword] & np.uint64((1 << 30) - 1)) | np.uint64(trigpos << 30)
+            # Words after the trigger may have any top bits
+            words[trigword + 1:] ^= self.rng.randint(0, 4, nwords - trigword - 1).astype(np.uint64) << np.uint64(30)
+        tail = self.rng.randint(0, 256, extra).astype(np.uint8)
+        return bytearray([0xAC]) + bytearray(words.astype('>u4').tostring()) + bytearray(tail.tostring())
+
+    def assertDecodes(self, data, presamples):
+        self.oa.presamples_desired = presamples
+        expected = np.array(loopProcessData(data, 0.5, presamples))
+        samples = self.oa.processData(data)
+        self.assertEqual(samples.dtype, np.float64)
+        np.testing.assert_array_equal(samples, expected)
+
+        raw = self.oa.processData(data, raw=True)
+        self.assertEqual(raw.dtype, np.uint16)
+        np.testing.assert_array_equal(raw, np.where(np.isnan(expected), 0, np.round((expected + 0.5) * 1024)))
+
+    def test_triggerPositions(self):
+        for trigword in (0, 1, 7, 19):
+            for trigpos in (0, 1, 2):
+                for presamples in (0, 3 * trigword + trigpos, 30):
+                    self.assertDecodes(self.makeData(20, trigword, trigpos), presamples)
+
+    def test_noTrigger(self):
+        for presamples in (0, 10, 80):
+            self.assertDecodes(self.makeData(20), presamples)
+
+    def test_padding(self):
+        # Fewer samples before the trigger than requested: padded at the front
+        self.oa.presamples_desired = 25
+        samples = self.oa.processData(self.makeData(20, 2, 1), pad=0.0)
+        np.testing.assert_array_equal(samples[:18], 0.0)
+        self.assertEqual(len(samples), 25 - 7 + 60)
+        self.assertTrue(np.isnan(self.oa.processData(self.makeData(20, 2, 1))[:18]).all())
+
+    def test_chopping(self):
+        data = self.makeData(20, 10, 2)
+        self.assertDecodes(data, 5)
+        self.oa.presamples_desired = 5
+        self.assertEqual(len(self.oa.processData(data)), 60 - (32 - 5))
+
+    def test_partialWord(self):
+        for extra in (1, 2, 3):
+            self.assertDecodes(self.makeData(12, 4, 1, extra), 8)
+
+    def test_input(self):
+        data = self.makeData(16, 5, 0)
+        self.oa.presamples_desired = 4
+        expected = self.oa.processData(data)
+        np.testing.assert_array_equal(self.oa.processData(list(data)), expected)
+        np.testing.assert_array_equal(self.oa.processData(np.frombuffer(data, dtype=np.uint8)), expected)
+
+    def test_syncByte(self):
+        data = self.makeData(8, 2, 0)
+        data[0] = 0x12
+        self.oa.presamples_desired = 0
+        self.assertIsNone(self.oa.processData(data))
+
+    def test_random(self):
+        for trial in range(200):
+            nwords = self.rng.randint(1, 40)
+            trigword = self.rng.randint(0, nwords) if self.rng.rand() < 0.8 else None
+            data = self.makeData(nwords, trigword, self.rng.randint(0, 3), self.rng.randint(0, 4))
+            self.assertDecodes(data, self.rng.randint(0, 60))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import numpy as np
+from chipwhisperer.analyzer.utils.Partition import PartitionStats
+from chipwhisperer.common.utils.tracesource import TraceSource
+
+
+def welfordStats(traces, partNums, numParts):
+    """Mean and variance of each (subkey, partition) with the trace-by-trace update of the original TraceExplorer"""
+    numKeys = partNums.shape[1]
+    mean = np.zeros((numKeys, numParts, traces.shape[1]))
+    q = np.zeros((numKeys, numParts, traces.shape[1]))
+    n = np.zeros((numKeys, numParts), dtype=np.int64)
+    for bnum in range(numKeys):
+        for t, part in zip(traces, partNums[:, bnum]):
+            if part < 0:
+                continue
+            n[bnum, part] += 1
+            previous = mean[bnum, part].copy()
+            mean[bnum, part] += (t - previous) / n[bnum, part]
+            q[bnum, part] += (t - previous) * (t - mean[bnum, part])
+    return {"mean":mean, "variance":q / np.maximum(n - 1, 1)[:, :, None], "number":n}
+
+
+class ArraySource(TraceSource):
+    def __init__(self, traces):
+        TraceSource.__init__(self, "test")
+        self.traces = traces
+
+    def getTraces(self, start, end):
+        return self.traces[start:end]
+
+    def numTraces(self):
+        return len(self.traces)
+
+    def numPoints(self):
+        return self.traces.shape[1]
+
+
+class TestPartitionStats(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(2)
+        self.traces = rng.normal(size=(300, 12)) + 50.0
+        self.partNums = rng.randint(0, 9, size=(300, 3))
+        self.manyPartNums = rng.randint(0, 256, size=(300, 2))
+
+    def assertStatsEqual(self, stats, expected):
+        np.testing.assert_array_equal(stats["number"], expected["number"])
+        np.testing.assert_allclose(stats["mean"], expected["mean"], rtol=1e-9)
+        np.testing.assert_allclose(stats["variance"], expected["variance"], rtol=1e-7, atol=1e-12)
+
+    def test_fewPartitions(self):
+        stats = PartitionStats(3, 9, 12)
+        for start in range(0, 300, 70):
+            stats.update(self.traces[start:start + 70], self.partNums[start:start + 70])
+        self.assertStatsEqual(stats.stats(), welfordStats(self.traces, self.partNums, 9))
+
+    def test_manyPartitions(self):
+        stats = PartitionStats(2, 256, 12)
+        for start in range(0, 300, 70):
+            stats.update(self.traces[start:start + 70], self.manyPartNums[start:start + 70])
+        self.assertStatsEqual(stats.stats(), welfordStats(self.traces, self.manyPartNums, 256))
+
+    def test_skip(self):
+        partNums = self.partNums.copy()
+        partNums[::5, 1] = -1
+        stats = PartitionStats(3, 9, 12)
+        stats.update(self.traces, partNums)
+        self.assertStatsEqual(stats.stats(), welfordStats(self.traces, partNums, 9))
+
+    def test_merge(self):
+        first = PartitionStats(3, 9, 12)
+        first.update(self.traces[:100], self.partNums[:100])
+        second = PartitionStats(3, 9, 12)
+        second.update(self.traces[100:], self.partNums[100:])
+        first.merge(second)
+        self.assertStatsEqual(first.stats(), welfordStats(self.traces, self.partNums, 9))
+
+    def test_accumulate(self):
+        source = ArraySource(self.traces)
+        for workers in (1, 3):
+            stats = PartitionStats.accumulate(source, self.partNums[20:], 20, 9, workers=workers, blockSize=32)
+            self.assertStatsEqual(stats.stats(), welfordStats(self.traces[20:], self.partNums[20:], 9))
+
+
+if __name__ == '__main__':
+    unittest.main()
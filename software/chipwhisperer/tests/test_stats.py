@@ -0,0 +1,176 @@
+import unittest
+import numpy as np
+from chipwhisperer.analyzer.attacks._stats import ClassAccumulator, CorrelationAccumulator, TemplateAccumulator
+
+
+def rawSumsCorrelation(hyp, traces):
+    """Correlation as computed from raw sums by the original progressive CPA (one guess at a time)"""
+    n = traces.shape[0]
+    sumt = np.sum(traces, axis=0)
+    sumtq = np.sum(np.square(traces), axis=0, dtype=np.float64)
+    sumden2 = np.square(sumt) - n * sumtq
+    diffs = []
+    for h in hyp:
+        sumh = np.sum(h)
+        sumhq = np.sum(np.square(h), dtype=np.float64)
+        sumht = np.sum(np.multiply(np.transpose(traces), h), axis=1)
+        sumnum = n * sumht - sumh * sumt
+        sumden1 = np.square(sumh) - n * sumhq
+        diffs.append(sumnum / np.sqrt(sumden1 * sumden2))
+    return np.array(diffs)
+
+
+class TestCorrelationAccumulator(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.hyp = rng.randint(0, 9, size=(16, 200)).astype(np.float64)
+        self.traces = rng.normal(size=(200, 30)) + 0.1 * self.hyp[3][:, None]
+
+    def test_update(self):
+        acc = CorrelationAccumulator()
+        acc.update(self.hyp, self.traces)
+        np.testing.assert_allclose(acc.correlation(), rawSumsCorrelation(self.hyp, self.traces), rtol=1e-9)
+
+    def test_blocks(self):
+        acc = CorrelationAccumulator()
+        for start in range(0, 200, 37):
+            acc.update(self.hyp[:, start:start + 37], self.traces[start:start + 37])
+        self.assertEqual(acc.n, 200)
+        np.testing.assert_allclose(acc.correlation(), rawSumsCorrelation(self.hyp, self.traces), rtol=1e-9)
+
+    def test_merge(self):
+        first = CorrelationAccumulator()
+        first.update(self.hyp[:, :120], self.traces[:120])
+        second = CorrelationAccumulator()
+        second.update(self.hyp[:, 120:], self.traces[120:])
+        first.merge(second)
+        first.merge(CorrelationAccumulator())
+        np.testing.assert_allclose(first.correlation(), rawSumsCorrelation(self.hyp, self.traces), rtol=1e-9)
+
+    def test_updateFromSums(self):
+        acc = CorrelationAccumulator()
+        acc.update(self.hyp[:, :50], self.traces[:50])
+        h = self.hyp[:, 50:]
+        t = self.traces[50:]
+        acc.updateFromSums(150, np.sum(h, axis=1), np.sum(np.square(h), axis=1), np.sum(t, axis=0),
+                           np.sum(np.square(t), axis=0), np.dot(h, t))
+        np.testing.assert_allclose(acc.correlation(), rawSumsCorrelation(self.hyp, self.traces), rtol=1e-9)
+
+    def test_stack(self):
+        accs = []
+        for i in range(3):
+            acc = CorrelationAccumulator()
+            acc.update(self.hyp[:, i * 60:(i + 1) * 60], self.traces[i * 60:(i + 1) * 60])
+            accs.append(acc)
+        for acc, restored in zip(accs, CorrelationAccumulator.unstack(CorrelationAccumulator.stack(accs))):
+            self.assertEqual(acc.n, restored.n)
+            np.testing.assert_array_equal(acc.correlation(), restored.correlation())
+
+    def test_offset(self):
+        # Raw sums lose most digits on traces with a large offset, the accumulator must not
+        acc = CorrelationAccumulator()
+        for start in range(0, 200, 50):
+            acc.update(self.hyp[:, start:start + 50], self.traces[start:start + 50] + 1e6)
+        np.testing.assert_allclose(acc.correlation(), rawSumsCorrelation(self.hyp, self.traces), rtol=1e-6)
+
+
+class TestTemplateAccumulator(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.partitions = rng.randint(0, 9, size=500)
+        self.points = rng.normal(size=(500, 4)) + self.partitions[:, None] * np.array([0.0, 1.0, 0.5, -2.0])
+
+    def assertMatchesPartitions(self, acc):
+        # Mean and covariance of each partition as computed by the original template generation
+        for part in range(9):
+            data = self.points[self.partitions == part]
+            self.assertEqual(acc.n[part], len(data))
+            np.testing.assert_allclose(acc.means()[part], np.mean(data, axis=0), rtol=1e-9, atol=1e-12)
+            np.testing.assert_allclose(acc.covariances()[part], np.cov(data, rowvar=0), rtol=1e-9, atol=1e-12)
+
+    def test_update(self):
+        acc = TemplateAccumulator(9, 4)
+        acc.update(self.points, self.partitions)
+        self.assertMatchesPartitions(acc)
+
+    def test_blocks(self):
+        acc = TemplateAccumulator(9, 4)
+        for start in range(0, 500, 64):
+            acc.update(self.points[start:start + 64], self.partitions[start:start + 64])
+        self.assertMatchesPartitions(acc)
+
+    def test_merge(self):
+        first = TemplateAccumulator(9, 4)
+        first.update(self.points[:200], self.partitions[:200])
+        second = TemplateAccumulator(9, 4)
+        second.update(self.points[200:], self.partitions[200:])
+        first.merge(second)
+        self.assertMatchesPartitions(first)
+
+    def test_pooled(self):
+        acc = TemplateAccumulator(9, 4)
+        acc.update(self.points, self.partitions)
+        centred = self.points - acc.means()[self.partitions]
+        pooled = np.dot(centred.T, centred) / (len(self.points) - 9)
+        for cov in acc.covariances(pooled=True):
+            np.testing.assert_allclose(cov, pooled, rtol=1e-9)
+
+    def test_emptyPartition(self):
+        acc = TemplateAccumulator(10, 4)
+        acc.update(self.points, self.partitions)
+        self.assertEqual(acc.n[9], 0)
+        self.assertTrue(np.isnan(acc.means()[9]).all())
+
+    def test_stack(self):
+        acc = TemplateAccumulator(9, 4)
+        acc.update(self.points, self.partitions)
+        restored = TemplateAccumulator.unstack(TemplateAccumulator.stack([acc]))[0]
+        self.assertMatchesPartitions(restored)
+
+
+class TestClassAccumulator(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(5)
+        self.classes = rng.randint(0, 64, size=400)
+        self.table = rng.randint(0, 5, size=(16, 64)).astype(np.float64)
+        self.traces = rng.normal(size=(400, 20)) + 0.2 * self.table[7, self.classes][:, None]
+
+    def test_correlation(self):
+        # Same result as CPA on the hypotheticals of every trace
+        acc = ClassAccumulator(64, 20)
+        for start in range(0, 400, 90):
+            acc.update(self.classes[start:start + 90], self.traces[start:start + 90])
+        np.testing.assert_allclose(acc.correlation(self.table),
+                                   rawSumsCorrelation(self.table[:, self.classes], self.traces), rtol=1e-9)
+
+    def test_differenceOfMeans(self):
+        acc = ClassAccumulator(64, 20)
+        acc.update(self.classes, self.traces)
+        dom = acc.differenceOfMeans(self.table)
+        for guess, row in enumerate(self.table):
+            hyp = row[self.classes]
+            middle = (row.min() + row.max()) / 2.0
+            expected = np.mean(self.traces[hyp > middle], axis=0) - np.mean(self.traces[hyp < middle], axis=0)
+            np.testing.assert_allclose(dom[guess], expected, rtol=1e-9, atol=1e-12)
+
+    def test_merge(self):
+        first = ClassAccumulator(64, 20)
+        first.update(self.classes[:150], self.traces[:150])
+        second = ClassAccumulator(64, 20)
+        second.update(self.classes[150:], self.traces[150:])
+        first.merge(second)
+        whole = ClassAccumulator(64, 20)
+        whole.update(self.classes, self.traces)
+        np.testing.assert_array_equal(first.n, whole.n)
+        np.testing.assert_allclose(first.correlation(self.table), whole.correlation(self.table), rtol=1e-9)
+
+    def test_stack(self):
+        acc = ClassAccumulator(64, 20)
+        acc.update(self.classes, self.traces)
+        restored = ClassAccumulator.unstack(ClassAccumulator.stack([acc]))[0]
+        np.testing.assert_array_equal(restored.n, acc.n)
+        np.testing.assert_allclose(restored.correlation(self.table), acc.correlation(self.table), rtol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
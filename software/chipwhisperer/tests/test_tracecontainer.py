@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from chipwhisperer.common.traces.TraceContainerNative import NpyChunkWriter, TraceContainerNative
+
+
+class TestNpyChunkWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_validAfterAppend(self):
+        rng = np.random.RandomState(7)
+        for dtype in (np.float64, np.uint16):
+            filename = os.path.join(self.directory, "traces.npy")
+            data = (rng.rand(40, 17) * 1000).astype(dtype)
+            writer = NpyChunkWriter(filename, dtype, 17)
+            self.assertEqual(np.load(filename).shape, (0, 17))
+            for start in range(0, 40, 9):
+                writer.append(data[start:start + 9])
+                loaded = np.load(filename)
+                self.assertEqual(loaded.dtype, dtype)
+                np.testing.assert_array_equal(loaded, data[:start + 9])
+            writer.close()
+            np.testing.assert_array_equal(np.load(filename), data)
+
+
+class TestTraceContainerNative(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.rng = np.random.RandomState(8)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def makeContainer(self, stream):
+        traces = TraceContainerNative()
+        traces.config.setConfigFilename(os.path.join(self.directory, "config_test_.cfg"))
+        traces.config.setAttr("prefix", "test_")
+        traces.setKnownKey([0] * 16)
+        traces.chunkBytes = 4096
+        if stream:
+            traces.prepareDisk()
+        return traces
+
+    def addTraces(self, traces, data):
+        for i, trace in enumerate(data):
+            traces.addTrace(trace, [i % 256] * 16, [0] * 16, [0] * 16, dtype=data.dtype)
+
+    def test_roundTrip(self):
+        for dtype in (np.float64, np.uint16):
+            data = (self.rng.rand(300, 50) * 1000).astype(dtype)
+            for stream in (False, True):
+                traces = self.makeContainer(stream)
+                self.addTraces(traces, data)
+                traces.closeAll(clearTrace=False)
+                self.assertEqual(traces.numTraces(), 300)
+                np.testing.assert_array_equal(np.asarray(traces.traces)[:300], data)
+
+                saved = np.load(os.path.join(self.directory, "test_traces.npy"))
+                self.assertEqual(saved.dtype, dtype)
+                np.testing.assert_array_equal(saved, data)
+
+                loaded = TraceContainerNative()
+                loaded.config.loadTrace(os.path.join(self.directory, "config_test_.cfg"))
+                loaded.loadAllTraces(self.directory, "test_")
+                np.testing.assert_array_equal(loaded.getRawTraces(0, 300), data)
+
+    def test_readWhileStreaming(self):
+        data = self.rng.rand(60, 50)
+        traces = self.makeContainer(True)
+        for n, trace in enumerate(data):
+            traces.addTrace(trace, [0] * 16, [0] * 16, [0] * 16)
+            np.testing.assert_array_equal(traces.getTrace(0), data[0])
+            np.testing.assert_array_equal(traces.getTrace(n), data[n])
+            np.testing.assert_array_equal(traces.getTraces(0, n + 1), data[:n + 1])
+            np.testing.assert_array_equal(traces.getTraces(max(0, n - 12), n + 1), data[max(0, n - 12):n + 1])
+        np.testing.assert_array_equal(traces.getTrace(-1), data[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
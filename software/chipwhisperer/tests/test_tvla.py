@@ -0,0 +1,90 @@
+import unittest
+import numpy as np
+from chipwhisperer.analyzer.utils.TVLA import MomentAccumulator, TVLA
+
+
+def centralMoment(traces, p):
+    """Two-pass central moment of every point"""
+    return np.mean((traces - np.mean(traces, axis=0)) ** p, axis=0)
+
+
+def welchT(a, b, order):
+    """Order-d t-statistic of Schneider & Moradi, computed directly from both trace sets"""
+    stats = []
+    for traces in (a, b):
+        cm2 = centralMoment(traces, 2)
+        if order == 1:
+            mean, var = np.mean(traces, axis=0), cm2
+        elif order == 2:
+            mean, var = cm2, centralMoment(traces, 4) - cm2 ** 2
+        else:
+            mean = centralMoment(traces, order) / cm2 ** (order / 2.0)
+            var = (centralMoment(traces, 2 * order) - centralMoment(traces, order) ** 2) / cm2 ** order
+        stats.append((mean, var, len(traces)))
+    (mean0, var0, n0), (mean1, var1, n1) = stats
+    return (mean0 - mean1) / np.sqrt(var0 / n0 + var1 / n1)
+
+
+class TestMomentAccumulator(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(3)
+        self.traces = rng.gamma(2.0, size=(400, 10)) + 100.0
+
+    def assertMoments(self, acc, traces):
+        self.assertEqual(acc.n, len(traces))
+        np.testing.assert_allclose(acc.mean, np.mean(traces, axis=0), rtol=1e-12)
+        for p in range(2, acc.maxOrder + 1):
+            np.testing.assert_allclose(acc.centralMoment(p), centralMoment(traces, p), rtol=1e-8)
+
+    def test_update(self):
+        acc = MomentAccumulator(6, 10)
+        acc.update(self.traces)
+        self.assertMoments(acc, self.traces)
+
+    def test_blocks(self):
+        acc = MomentAccumulator(6, 10)
+        for start in range(0, 400, 33):
+            acc.update(self.traces[start:start + 33])
+        self.assertMoments(acc, self.traces)
+
+    def test_merge(self):
+        first = MomentAccumulator(6, 10)
+        first.update(self.traces[:150])
+        second = MomentAccumulator(6, 10)
+        second.update(self.traces[150:])
+        first.merge(second)
+        first.merge(MomentAccumulator(6, 10))
+        self.assertMoments(first, self.traces)
+
+
+class TestTVLA(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(4)
+        self.partitions = rng.randint(0, 2, size=600)
+        self.traces = rng.normal(size=(600, 8))
+        self.traces[:, 2] += 0.3 * self.partitions
+        self.traces[:, 5] *= 1 + 0.5 * self.partitions
+
+    def test_tStatistic(self):
+        tvla = TVLA(maxOrder=3)
+        for start in range(0, 600, 128):
+            tvla.update(self.traces[start:start + 128], self.partitions[start:start + 128])
+        self.assertEqual(tvla.numTraces(), (np.sum(self.partitions == 0), np.sum(self.partitions == 1)))
+        for order in (1, 2, 3):
+            np.testing.assert_allclose(tvla.tStatistic(order), welchT(self.traces[self.partitions == 0],
+                                       self.traces[self.partitions == 1], order), rtol=1e-7)
+
+    def test_merge(self):
+        first = TVLA(maxOrder=2)
+        first.update(self.traces[:250], self.partitions[:250])
+        second = TVLA(maxOrder=2)
+        second.update(self.traces[250:], self.partitions[250:])
+        first.merge(second)
+        whole = TVLA(maxOrder=2)
+        whole.update(self.traces, self.partitions)
+        for order in (1, 2):
+            np.testing.assert_allclose(first.tStatistic(order), whole.tStatistic(order), rtol=1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()